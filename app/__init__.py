@@ -1,55 +1,68 @@
+import click
 from flask import Flask
 from config import Config
-from flask_migrate import Migrate
-from flask_sqlalchemy import SQLAlchemy
+from funcs import UploadRequest
 from flask_bootstrap import Bootstrap
 from flask_login import LoginManager
-from flask_mail import Mail
 from flask_moment import Moment
-import logging, os
-from logging.handlers import SMTPHandler, RotatingFileHandler
-
-app = Flask(__name__)
-app.config.from_object(Config)
-db = SQLAlchemy(app)
-migrate = Migrate(app, db)
-bootstrap = Bootstrap(app)
-login = LoginManager(app)
-mail = Mail(app)
-moment = Moment(app)
-
-login.login_view = 'login'
+from app.activity import LastSeenTracker
+from app.database import SQLAlchemy
+from app.cache import FragmentCache, TTLCache
+from app.email import mail_queue
+from app.profiling import RequestProfiler
+from app.tasks import BackgroundWorker
+from app.log import setup_logging, track_requests
+
+db = SQLAlchemy()
+bootstrap = Bootstrap()
+login = LoginManager()
+login.login_view = 'auth.login'
 login.login_message = 'Please log in to access this page.'
 login.login_message_category = "info"
+moment = Moment()
+last_seen = LastSeenTracker()
+fragment_cache = FragmentCache()
+tasks = BackgroundWorker()
+profiler = RequestProfiler()
+
+
+def create_app(config_class=Config):
+    app = Flask(__name__)
+    app.request_class = UploadRequest
+    app.config.from_object(config_class)
+
+    db.init_app(app)
+    # only the `flask db` commands need Flask-Migrate, and alembic with it
+    if click.get_current_context(silent=True) is not None:
+        from flask_migrate import Migrate
+        Migrate(app, db)
+    bootstrap.init_app(app)
+    login.init_app(app)
+    moment.init_app(app)
+    mail_queue.init_app(app)
+    last_seen.init_app(app, db)
+    fragment_cache.init_app(app)
+    tasks.init_app(app, db)
+    profiler.init_app(app)
+
+    from app.errors import bp as errors_bp
+    app.register_blueprint(errors_bp)
+
+    from app.auth import bp as auth_bp
+    app.register_blueprint(auth_bp)
+
+    from app.main import bp as main_bp
+    app.register_blueprint(main_bp)
+
+    from app.api import bp as api_bp
+    app.register_blueprint(api_bp, url_prefix='/api/v1')
+
+    app.extensions['user_cache'] = TTLCache(maxsize=app.config['USER_CACHE_SIZE'],
+                                            ttl=app.config['USER_CACHE_TTL'])
+
+    track_requests(app)
+    if not app.debug and not app.testing:
+        setup_logging(app)
+        app.logger.info('ProjAPP')
 
-from app import routes, models, errors
-
-if not app.debug:
-    # sending email
-    if app.config['MAIL_SERVER']:
-        auth = None
-        if app.config['MAIL_USERNAME'] or app.config['MAIL_PASSWORD']:
-            auth = (app.config['MAIL_USERNAME'], app.config['MAIL_PASSWORD'])
-        secure = None
-        if app.config['MAIL_USE_TLS']:
-            secure = ()
-        mail_handler = SMTPHandler(
-            mailhost=(app.config['MAIL_SERVER'], app.config['MAIL_PORT']),
-            fromaddr='no-reply@' + app.config['MAIL_SERVER'],
-            toaddrs=app.config['ADMINS'], subject='Microblog Failure',
-            credentials=auth, secure=secure)
-        mail_handler.setLevel(logging.ERROR)
-        app.logger.addHandler(mail_handler)
-
-    # logging to a file
-    if not os.path.exists('logs'):
-        os.mkdir('logs')
-    file_handler = RotatingFileHandler('logs/projapp.log', maxBytes=10240,
-                                       backupCount=10)
-    file_handler.setFormatter(logging.Formatter(
-        '%(asctime)s %(levelname)s: %(message)s [in %(pathname)s:%(lineno)d]'))
-    file_handler.setLevel(logging.INFO)
-    app.logger.addHandler(file_handler)
-
-    app.logger.setLevel(logging.INFO)
-    app.logger.info('ProjAPP')
\ No newline at end of file
+    return app
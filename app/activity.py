@@ -0,0 +1,105 @@
+import atexit
+from datetime import datetime, timedelta
+from threading import Event, Lock, Thread
+from flask import current_app
+
+
+class LastSeenBuffer(object):
+    """The pending timestamps and flush thread of one application."""
+
+    def __init__(self, app, db):
+        self.app = app
+        self.db = db
+        self.granularity = timedelta(
+            seconds=app.config['LAST_SEEN_GRANULARITY'])
+        self.flush_interval = app.config['LAST_SEEN_FLUSH_INTERVAL']
+        self._pending = {}
+        self._recorded = {}
+        self._lock = Lock()
+        self._stop = Event()
+        self._thread = None
+
+    def touch(self, user, now=None):
+        now = now or datetime.utcnow()
+        seen = self._recorded.get(user.id) or user.last_seen
+        if seen is not None and now - seen < self.granularity:
+            return False
+        with self._lock:
+            self._pending[user.id] = now
+            self._recorded[user.id] = now
+            self._start()
+        return True
+
+    def flush(self):
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            # anything older than the granularity would be re-recorded anyway
+            cutoff = datetime.utcnow() - self.granularity
+            self._recorded = {id: seen for id, seen in self._recorded.items()
+                              if seen > cutoff}
+        if not pending:
+            return 0
+        from app.models import User
+        user = User.__table__
+        stmt = user.update().where(user.c.id == self.db.bindparam('user_id')) \
+            .values(last_seen=self.db.bindparam('seen'),
+                    # a heartbeat is not a profile change; keep onupdate off it
+                    updated_at=user.c.updated_at)
+        try:
+            with self.db.get_engine(self.app).begin() as conn:
+                conn.execute(stmt, [{'user_id': id, 'seen': seen}
+                                    for id, seen in pending.items()])
+        except Exception:
+            with self._lock:
+                for id, seen in pending.items():
+                    self._pending.setdefault(id, seen)
+            raise
+        return len(pending)
+
+    def stop(self):
+        self._stop.set()
+
+    def _start(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = Thread(target=self._run, daemon=True,
+                                  name='last-seen-flush')
+            self._thread.start()
+
+    def _run(self):
+        while not self._stop.wait(self.flush_interval):
+            try:
+                self.flush()
+            except Exception:
+                self.app.logger.exception('Could not flush last_seen updates')
+
+
+class LastSeenTracker(object):
+    """Buffers last_seen timestamps in memory and writes them in one bulk
+    UPDATE every LAST_SEEN_FLUSH_INTERVAL seconds, recording a user at most
+    once per LAST_SEEN_GRANULARITY seconds. Reads no longer have to open
+    a write transaction just to say "this user is still around". Each app
+    keeps its own buffer in ``app.extensions['last_seen']``."""
+
+    def __init__(self, app=None, db=None):
+        self.db = db
+        if app is not None:
+            self.init_app(app, db)
+
+    def init_app(self, app, db=None):
+        self.db = db or self.db
+        previous = app.extensions.get('last_seen')
+        if previous is not None:
+            previous.stop()
+            atexit.unregister(previous.flush)
+        buffer = app.extensions['last_seen'] = LastSeenBuffer(app, self.db)
+        atexit.register(buffer.flush)
+
+    @property
+    def buffer(self):
+        return current_app.extensions['last_seen']
+
+    def touch(self, user, now=None):
+        return self.buffer.touch(user, now)
+
+    def flush(self):
+        return self.buffer.flush()
@@ -0,0 +1,368 @@
+from collections import defaultdict
+from datetime import datetime
+from flask import abort, current_app, jsonify, request, url_for
+from flask_login import current_user
+from werkzeug.exceptions import HTTPException
+from app import db, login
+from app.api import bp
+from app.models import User, Project, Todo, Comment, Artifact
+from app.pagination import decode_cursor, encode_cursor, keyset_page, seek_before
+from app.search import INDEXED, doc_id, remove_documents
+
+
+def iso(value):
+    return value.isoformat() + 'Z' if value is not None else None
+
+
+# every field a client can ask for with ?fields=, per resource type
+FIELDS = {
+    'user': {
+        'id': lambda u: u.id,
+        'username': lambda u: u.username,
+        'about_me': lambda u: u.about_me,
+        'avatar': lambda u: u.avatar(128),
+        'follower_count': lambda u: u.follower_count,
+        'following_count': lambda u: u.following_count,
+        'last_seen': lambda u: iso(u.last_seen),
+        'created_at': lambda u: iso(u.created_at),
+    },
+    'project': {
+        'id': lambda p: p.id,
+        'title': lambda p: p.title,
+        'body': lambda p: p.body,
+        'status': lambda p: p.status,
+        'sdate': lambda p: iso(p.sdate),
+        'edate': lambda p: iso(p.edate),
+        'author_id': lambda p: p.user_id,
+        'comment_count': lambda p: p.comment_count,
+        'open_todo_count': lambda p: p.open_todo_count,
+        'created_at': lambda p: iso(p.created_at),
+        'updated_at': lambda p: iso(p.updated_at),
+    },
+    'todo': {
+        'id': lambda t: t.id,
+        'task': lambda t: t.task,
+        'edate': lambda t: iso(t.edate),
+        'is_done': lambda t: bool(t.is_done),
+        'project_id': lambda t: t.project_id,
+        'created_at': lambda t: iso(t.created_at),
+    },
+    'comment': {
+        'id': lambda c: c.id,
+        'body': lambda c: c.body,
+        'user_id': lambda c: c.user_id,
+        'project_id': lambda c: c.project_id,
+        'created_at': lambda c: iso(c.created_at),
+    },
+    'artifact': {
+        'id': lambda a: a.id,
+        'name': lambda a: a.name,
+        'filename': lambda a: a.filename,
+        'sha256': lambda a: a.file,
+        'project_id': lambda a: a.project_id,
+        'url': lambda a: url_for('main.download_file', file=a.file, _external=True),
+        'created_at': lambda a: iso(a.created_at),
+    },
+}
+
+# ?include= relations of a project: (resource type, model, key column, private)
+INCLUDES = {
+    'author': ('user', User, User.id, False),
+    'todos': ('todo', Todo, Todo.project_id, True),
+    'comments': ('comment', Comment, Comment.project_id, False),
+    'artifacts': ('artifact', Artifact, Artifact.project_id, True),
+}
+# rows of each todos/comments/artifacts include per project; the rest are
+# paged through the project's own sub-resource
+MAX_INCLUDE = 20
+MAX_BATCH = 100
+MAX_TODO_BATCH = 500
+
+
+@login.request_loader
+def load_token_user(request):
+    """Machine clients send ``Authorization: Bearer <token>`` instead of a
+    session cookie. Only the API takes tokens; pages keep to the session."""
+    if request.blueprint != 'api':
+        return None
+    scheme, _, token = request.headers.get('Authorization', '').partition(' ')
+    if scheme.lower() == 'bearer' and token:
+        return User.verify_api_token(token.strip())
+
+
+@bp.before_request
+def require_login():
+    if request.endpoint != 'api.tokens' and not current_user.is_authenticated:
+        abort(401)
+
+
+@bp.route('/tokens', methods=['POST'])
+def tokens():
+    """Trade a username and password, sent with HTTP Basic auth, for a
+    bearer token that expires after API_TOKEN_EXPIRES seconds."""
+    auth = request.authorization
+    user = User.query.filter_by(username=auth.username).first() \
+        if auth and auth.username else None
+    if user is None or not user.check_password(auth.password or ''):
+        abort(401, 'Send your username and password with HTTP Basic auth')
+    expires_in = current_app.config['API_TOKEN_EXPIRES']
+    return jsonify(token=user.get_api_token(expires_in), expires_in=expires_in)
+
+
+@bp.errorhandler(HTTPException)
+def error_response(error):
+    return jsonify(error={'status': error.code, 'message': error.description}), error.code
+
+
+def requested_fields(kind, param='fields'):
+    available = FIELDS[kind]
+    value = request.args.get(param)
+    if not value:
+        return list(available)
+    fields = [name.strip() for name in value.split(',') if name.strip()]
+    unknown = [name for name in fields if name not in available]
+    if unknown:
+        abort(400, f'Unknown {kind} field(s): {", ".join(unknown)}')
+    return fields
+
+
+def requested_includes():
+    value = request.args.get('include')
+    if not value:
+        return []
+    includes = [name.strip() for name in value.split(',') if name.strip()]
+    unknown = [name for name in includes if name not in INCLUDES]
+    if unknown:
+        abort(400, f'Unknown include(s): {", ".join(unknown)}')
+    return includes
+
+
+def serialize(kind, obj, fields):
+    getters = FIELDS[kind]
+    return {name: getters[name](obj) for name in fields}
+
+
+def per_page():
+    limit = request.args.get('limit', current_app.config['PROJECTS_PER_PAGE'], type=int)
+    return max(1, min(limit, current_app.config['API_MAX_PAGE_SIZE']))
+
+
+def seek_page(query, model):
+    """The ?cursor= page of ``query`` in (created_at, id) DESC order."""
+    after = decode_cursor(request.args.get('cursor'))
+    if after is not None:
+        query = query.filter(seek_before(model.created_at, model.id, after))
+    return keyset_page(query.order_by(model.created_at.desc(), model.id.desc()),
+                       per_page())
+
+
+def project_documents(projects):
+    """Serialize projects with their ?include= relations, loading each
+    relation for every project at once: one query per relation, whatever
+    the number of projects. A project includes its newest MAX_INCLUDE
+    children of each kind, and ``<include>_next`` links to the rest."""
+    fields = requested_fields('project')
+    documents = [serialize('project', p, fields) for p in projects]
+    for name in requested_includes():
+        kind, model, key, private = INCLUDES[name]
+        include_fields = requested_fields(kind, f'fields[{name}]')
+        if name == 'author':
+            ids = {p.user_id for p in projects}
+            authors = {u.id: u for u in User.query.filter(User.id.in_(ids))} if ids else {}
+            for document, project in zip(documents, projects):
+                author = authors.get(project.user_id)
+                document[name] = serialize(kind, author, include_fields) if author else None
+            continue
+        # todos and artifacts are only shown to the project's author
+        ids = {p.id for p in projects
+               if not private or p.user_id == current_user.id}
+        related = defaultdict(list)
+        if ids:
+            newest = (model.created_at.desc(), model.id.desc())
+            rank = db.func.row_number().over(partition_by=key, order_by=newest)
+            ranked = db.session.query(model.id, rank.label('rank')) \
+                .filter(key.in_(ids)).subquery()
+            rows = model.query.join(ranked, ranked.c.id == model.id) \
+                .filter(ranked.c.rank <= MAX_INCLUDE + 1).order_by(*newest)
+            for row in rows:
+                related[row.project_id].append(row)
+        for document, project in zip(documents, projects):
+            if project.id not in ids:
+                continue
+            rows = related[project.id]
+            document[name] = [serialize(kind, row, include_fields)
+                              for row in rows[:MAX_INCLUDE]]
+            if len(rows) > MAX_INCLUDE:
+                last = rows[MAX_INCLUDE - 1]
+                document[f'{name}_next'] = url_for(
+                    f'api.project_{name}', id=project.id, _external=True,
+                    cursor=encode_cursor(last.created_at, last.id),
+                    fields=request.args.get(f'fields[{name}]'))
+    return documents
+
+
+def next_page_url(endpoint, cursor, **values):
+    # the query string carries over, except what url_for() would take as
+    # its own arguments; the view args win over same-named query args
+    args = {name: value for name, value in request.args.items()
+            if name != 'endpoint' and not name.startswith('_')}
+    args.update(values, cursor=cursor)
+    return url_for(endpoint, _external=True, **args)
+
+
+def project_page(query, endpoint, **values):
+    page = seek_page(query, Project)
+    next_url = next_page_url(endpoint, page.next_cursor, **values) \
+        if page.has_next else None
+    return jsonify(data=project_documents(page.items),
+                   next_cursor=page.next_cursor, next=next_url)
+
+
+@bp.route('/projects')
+def projects():
+    return project_page(Project.live(), 'api.projects')
+
+
+@bp.route('/feed')
+def feed():
+    after = decode_cursor(request.args.get('cursor'))
+    page = keyset_page(current_user.followed_projects(after), per_page())
+    next_url = next_page_url('api.feed', page.next_cursor) if page.has_next else None
+    return jsonify(data=project_documents(page.items),
+                   next_cursor=page.next_cursor, next=next_url)
+
+
+@bp.route('/projects/batch')
+def projects_batch():
+    """Many projects by id in one request: ?ids=1,2,3 (at most 100)."""
+    try:
+        ids = [int(id) for id in request.args.get('ids', '').split(',') if id.strip()]
+    except ValueError:
+        abort(400, 'ids must be a comma separated list of integers')
+    if not ids:
+        abort(400, 'ids is required')
+    if len(ids) > MAX_BATCH:
+        abort(400, f'At most {MAX_BATCH} ids per request')
+    found = {p.id: p for p in Project.live().filter(Project.id.in_(ids))}
+    projects = [found[id] for id in dict.fromkeys(ids) if id in found]
+    return jsonify(data=project_documents(projects),
+                   missing=[id for id in dict.fromkeys(ids) if id not in found])
+
+
+@bp.route('/projects/<int:id>')
+def project(id):
+    project = Project.live().filter_by(id=id).first_or_404()
+    return jsonify(data=project_documents([project])[0])
+
+
+def project_children(id, kind, model, private):
+    """One page of a project's todos, comments or artifacts, newest first."""
+    project = Project.live().filter_by(id=id).first_or_404()
+    if private and project.user_id != current_user.id:
+        abort(403, 'Only the project author can see this')
+    fields = requested_fields(kind)
+    page = seek_page(model.query.filter_by(project_id=project.id), model)
+    next_url = next_page_url(request.endpoint, page.next_cursor, id=project.id) \
+        if page.has_next else None
+    return jsonify(data=[serialize(kind, row, fields) for row in page.items],
+                   next_cursor=page.next_cursor, next=next_url)
+
+
+@bp.route('/projects/<int:id>/todos')
+def project_todos(id):
+    return project_children(id, 'todo', Todo, private=True)
+
+
+def todo_ids(value):
+    if not isinstance(value, list) or not value or \
+            not all(isinstance(id, int) and not isinstance(id, bool) for id in value):
+        abort(400, 'ids must be a non-empty list of integers')
+    if len(value) > MAX_TODO_BATCH:
+        abort(400, f'At most {MAX_TODO_BATCH} todos per request')
+    return list(dict.fromkeys(value))
+
+
+def todo_tasks(value):
+    """A pasted list, one task per line, or a list of strings."""
+    if isinstance(value, str):
+        value = value.splitlines()
+    if not isinstance(value, list) or not all(isinstance(task, str) for task in value):
+        abort(400, 'tasks must be a string or a list of strings')
+    tasks = [task.strip() for task in value if task.strip()]
+    if not tasks:
+        abort(400, 'tasks is required')
+    if len(tasks) > MAX_TODO_BATCH:
+        abort(400, f'At most {MAX_TODO_BATCH} todos per request')
+    if any(len(task) > 140 for task in tasks):
+        abort(400, 'Tasks are at most 140 characters long')
+    return tasks
+
+
+def todo_deadline(project, value):
+    if value is None:
+        return project.edate
+    try:
+        deadline = datetime.strptime(value, '%Y-%m-%d')
+    except (TypeError, ValueError):
+        abort(400, 'edate must be a date like 2020-05-31')
+    if project.sdate and deadline.date() < project.sdate.date() or \
+            project.edate and deadline.date() > project.edate.date():
+        abort(400, 'edate must be within the project start and end date')
+    return deadline
+
+
+@bp.route('/projects/<int:id>/todos', methods=['POST'])
+def update_project_todos(id):
+    """Change many todos at once. The JSON body is either
+    {"action": "done" | "undone" | "delete", "ids": [...]} or
+    {"action": "create", "tasks": "one task per line", "edate": "2020-05-31"}.
+    Replies with only what changed, for the page to apply in place."""
+    project = Project.live().filter_by(id=id).first_or_404()
+    if project.user_id != current_user.id:
+        abort(403, 'Only the project author can change its todos')
+    # a cross-site form cannot send JSON, so this also stands in for CSRF
+    if not request.is_json:
+        abort(415, 'Send the changes as application/json')
+    changes = request.get_json(silent=True)
+    if not isinstance(changes, dict):
+        abort(400, 'The body must be a JSON object')
+    action = changes.get('action')
+    diff = {'done': [], 'undone': [], 'deleted': [], 'created': []}
+    if action in ('done', 'undone'):
+        diff[action] = project.mark_todos(todo_ids(changes.get('ids')), action == 'done')
+    elif action == 'delete':
+        diff['deleted'] = project.delete_todos(todo_ids(changes.get('ids')))
+        kind = INDEXED[Todo][0]
+        remove_documents(db.session, [doc_id(kind, id) for id in diff['deleted']])
+    elif action == 'create':
+        todos = project.add_todos(todo_tasks(changes.get('tasks')),
+                                  todo_deadline(project, changes.get('edate')))
+        db.session.flush()
+        fields = requested_fields('todo')
+        diff['created'] = [serialize('todo', todo, fields) for todo in todos]
+    else:
+        abort(400, 'action must be one of done, undone, delete or create')
+    db.session.commit()
+    return jsonify(data=diff, open_todo_count=project.open_todo_count)
+
+
+@bp.route('/projects/<int:id>/comments')
+def project_comments(id):
+    return project_children(id, 'comment', Comment, private=False)
+
+
+@bp.route('/projects/<int:id>/artifacts')
+def project_artifacts(id):
+    return project_children(id, 'artifact', Artifact, private=True)
+
+
+@bp.route('/users/<username>')
+def user(username):
+    user = User.query.filter_by(username=username).first_or_404()
+    return jsonify(data=serialize('user', user, requested_fields('user')))
+
+
+@bp.route('/users/<username>/projects')
+def user_projects(username):
+    user = User.query.filter_by(username=username).first_or_404()
+    return project_page(user.projects.filter(Project.deleted_at == None), 'api.user_projects', username=username)
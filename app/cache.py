@@ -0,0 +1,171 @@
+import os
+import pickle
+from collections import OrderedDict
+from hashlib import sha1
+from threading import Lock
+from time import monotonic
+from flask import current_app
+
+
+class TTLCache(object):
+    """Thread-safe LRU mapping whose entries also expire ``ttl`` seconds
+    after they were stored. Keeps hit/miss counters for the stats pages."""
+
+    def __init__(self, maxsize=1024, ttl=60, timer=monotonic):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.timer = timer
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = Lock()
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None:
+                expires, value = entry
+                if self.ttl is None or expires > self.timer():
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._data[key]
+            self.misses += 1
+            return default
+
+    def set(self, key, value):
+        expires = self.timer() + self.ttl if self.ttl is not None else None
+        with self._lock:
+            self._data[key] = (expires, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def pop(self, key):
+        with self._lock:
+            entry = self._data.pop(key, None)
+        return entry[1] if entry is not None else None
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'size': len(self._data),
+            'maxsize': self.maxsize,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+        }
+
+
+class FileCache(object):
+    """Fragment backend shared by every worker on the host: one pickle per
+    key under ``directory``, with least-recently-used files evicted once
+    there are more than ``maxsize`` of them."""
+
+    def __init__(self, directory, maxsize=4096, evict_every=64):
+        self.directory = directory
+        self.maxsize = maxsize
+        self.evict_every = evict_every
+        self.hits = 0
+        self.misses = 0
+        self._writes = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.directory,
+                            sha1(str(key).encode('utf-8')).hexdigest())
+
+    def get(self, key, default=None):
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as f:
+                value = pickle.load(f)
+            os.utime(path)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            self.misses += 1
+            return default
+        self.hits += 1
+        return value
+
+    def set(self, key, value):
+        path = self._path(key)
+        tmp = f'{path}.{os.getpid()}.tmp'
+        with open(tmp, 'wb') as f:
+            pickle.dump(value, f, pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, path)
+        self._writes += 1
+        if self._writes % self.evict_every == 0:
+            self.evict()
+
+    def pop(self, key):
+        value = self.get(key)
+        try:
+            os.remove(self._path(key))
+        except OSError:
+            pass
+        return value
+
+    def clear(self):
+        for entry in os.scandir(self.directory):
+            os.remove(entry.path)
+
+    def evict(self):
+        entries = sorted(os.scandir(self.directory),
+                         key=lambda entry: entry.stat().st_mtime)
+        for entry in entries[:max(len(entries) - self.maxsize, 0)]:
+            try:
+                os.remove(entry.path)
+            except OSError:
+                pass
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'size': sum(1 for _ in os.scandir(self.directory)),
+            'maxsize': self.maxsize,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+        }
+
+
+class FragmentCache(object):
+    """Caches rendered HTML fragments. Each entry remembers the version it
+    was rendered for; a lookup with a different version is a miss, so
+    callers can key on a stable id and let edits invalidate by version.
+    Each app keeps its own backend in ``app.extensions['fragment_cache']``."""
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        size = app.config['FRAGMENT_CACHE_SIZE']
+        if app.config['FRAGMENT_CACHE_BACKEND'] == 'file':
+            backend = FileCache(app.config['FRAGMENT_CACHE_DIR'], size)
+        else:
+            backend = TTLCache(maxsize=size, ttl=None)
+        app.extensions['fragment_cache'] = backend
+
+    @property
+    def backend(self):
+        return current_app.extensions['fragment_cache']
+
+    def get_or_render(self, key, version, render):
+        backend = self.backend
+        entry = backend.get(key)
+        if entry is not None and entry[0] == version:
+            return entry[1]
+        html = render()
+        backend.set(key, (version, html))
+        return html
+
+    def delete(self, key):
+        self.backend.pop(key)
@@ -0,0 +1,224 @@
+import gzip
+import json
+from datetime import datetime
+from time import perf_counter, sleep
+import click
+from app import db, reaper, search, timeline
+from app.database import replicate_sqlite
+from app.models import User, Project, Comment, Todo, Artifact, Blob, followers
+
+# dependency order: every table only references tables listed before it
+EXPORT_TABLES = [User, followers, Blob, Project, Todo, Comment, Artifact]
+
+
+def counter_sources():
+    """(model, counter column, correlated COUNT subquery) for every
+    denormalized counter we maintain."""
+    return [
+        (User, User.follower_count, db.select([db.func.count()]).where(
+            followers.c.followed_id == User.id).as_scalar()),
+        (User, User.following_count, db.select([db.func.count()]).where(
+            followers.c.follower_id == User.id).as_scalar()),
+        (Project, Project.comment_count, db.select([db.func.count()]).where(
+            Comment.project_id == Project.id).as_scalar()),
+        (Project, Project.open_todo_count, db.select([db.func.count()]).where(
+            db.and_(Todo.project_id == Project.id,
+                    db.or_(Todo.is_done == False, Todo.is_done == None))).as_scalar()),
+    ]
+
+
+def table_of(source):
+    return getattr(source, '__table__', source)
+
+
+def open_dump(path, mode):
+    if path.endswith('.gz'):
+        return gzip.open(path, mode + 't', encoding='utf-8')
+    return open(path, mode, encoding='utf-8')
+
+
+def encode(value):
+    return value.isoformat() if isinstance(value, datetime) else value
+
+
+def decoder(table):
+    dates = {c.name for c in table.columns if isinstance(c.type, db.DateTime)}
+
+    def decode(row):
+        for name in dates & row.keys():
+            if row[name] is not None:
+                row[name] = datetime.fromisoformat(row[name])
+        return row
+    return decode
+
+
+def advance_sequences(tables):
+    """Move the id sequence of each table past its highest id. Rows loaded
+    with their ids never draw from the sequence, so on PostgreSQL the next
+    ordinary INSERT would collide with an imported row. SQLite and MySQL
+    carry on from the highest id by themselves."""
+    if db.engine.dialect.name != 'postgresql':
+        return
+    quote = db.engine.dialect.identifier_preparer.quote
+    for table in tables:
+        if 'id' not in table.c:
+            continue
+        name = quote(table.name)
+        db.session.execute(db.text(
+            f"SELECT setval(pg_get_serial_sequence('{name}', 'id'), "
+            f"coalesce(max(id), 1), max(id) IS NOT NULL) FROM {name}"))
+    db.session.commit()
+
+
+def report(name, count, started):
+    elapsed = perf_counter() - started
+    rate = count / elapsed if elapsed else 0
+    click.echo(f'{name}: {count} row(s) in {elapsed:.1f}s ({rate:,.0f} rows/sec)')
+
+
+def register(app):
+    @app.cli.group()
+    def projapp():
+        """ProjApp maintenance commands."""
+        pass
+
+    @projapp.command()
+    @click.option('--verify', is_flag=True,
+                  help='Only report drifted counters, do not fix them.')
+    def counters(verify):
+        """Recompute denormalized follower, comment and todo counters."""
+        drifted = 0
+        for model, column, actual in counter_sources():
+            stale = model.query.filter(column != actual)
+            count = stale.count()
+            drifted += count
+            label = f'{model.__tablename__}.{column.key}'
+            if verify:
+                for row in stale.limit(20):
+                    click.echo(f'{label}: id={row.id} stored={getattr(row, column.key)}')
+                click.echo(f'{label}: {count} row(s) out of date')
+            elif count:
+                stale.update({column: actual}, synchronize_session=False)
+                click.echo(f'{label}: fixed {count} row(s)')
+        if not verify:
+            db.session.commit()
+        elif drifted:
+            raise click.exceptions.Exit(1)
+
+    @projapp.command()
+    @click.option('--batch-size', default=1000, show_default=True)
+    def reindex(batch_size):
+        """Rebuild the full-text search index."""
+        total = search.reindex(batch_size)
+        click.echo(f'Indexed {total} document(s); extracting artifact text...')
+        search.tasks.join()
+
+    @projapp.command('timeline')
+    @click.option('--batch-size', default=1000, show_default=True)
+    def rebuild_timeline(batch_size):
+        """Rebuild every home-feed timeline from the follow graph."""
+        started = perf_counter()
+        report('timeline', timeline.rebuild(batch_size), started)
+
+    @projapp.command()
+    @click.option('--batch-size', default=None, type=int,
+                  help='Rows per transaction.  [default: REAPER_BATCH]')
+    def reap(batch_size):
+        """Finish removing deleted projects, e.g. after a restart."""
+        batch_size = batch_size or app.config['REAPER_BATCH']
+        started, count = perf_counter(), 0
+        ids = [id for id, in db.session.query(Project.id)
+               .filter(Project.deleted_at != None).order_by(Project.id)]
+        for id in ids:
+            while True:
+                result = reaper.reap_batch(id, batch_size)
+                if result is None:
+                    break
+                table, removed = result
+                count += removed
+                click.echo(f'project {id}: removed {removed} {table} row(s)')
+                if table == 'project':
+                    break
+        report('reap', count, started)
+
+    @projapp.command()
+    @click.argument('path')
+    @click.option('--batch-size', default=5000, show_default=True)
+    def export(path, batch_size):
+        """Stream every table to an NDJSON file (gzipped if PATH ends in .gz)."""
+        with open_dump(path, 'w') as out, db.read_only():
+            for source in EXPORT_TABLES:
+                table = table_of(source)
+                started, count = perf_counter(), 0
+                rows = db.session.query(*table.columns) \
+                    .order_by(*table.primary_key.columns).yield_per(batch_size)
+                for row in rows:
+                    out.write(json.dumps({'table': table.name, 'row': {
+                        key: encode(value) for key, value in row._asdict().items()}}))
+                    out.write('\n')
+                    count += 1
+                report(table.name, count, started)
+
+    @projapp.command()
+    @click.option('--interval', default=5.0, show_default=True,
+                  help='Seconds between copies.')
+    @click.option('--once', is_flag=True, help='Copy once and exit.')
+    def replicate(interval, once):
+        """Keep SQLite replicas in sync with the primary (development only)."""
+        primary = db.get_engine(app)
+        replicas = db.replica_engines(app)
+        if not replicas:
+            raise click.ClickException('No replicas configured (DATABASE_REPLICA_URLS).')
+        if any(engine.dialect.name != 'sqlite' for engine in [primary] + replicas):
+            raise click.ClickException('Only SQLite databases can be replicated this way.')
+        while True:
+            started = perf_counter()
+            replicate_sqlite(primary.url.database, [e.url.database for e in replicas])
+            click.echo(f'Copied to {len(replicas)} replica(s) in '
+                       f'{(perf_counter() - started) * 1000:.0f}ms')
+            if once:
+                break
+            sleep(interval)
+
+    @projapp.command('import')
+    @click.argument('path')
+    @click.option('--batch-size', default=5000, show_default=True)
+    def import_(path, batch_size):
+        """Load an NDJSON dump written by `flask projapp export`."""
+        models = {table_of(source).name: source for source in EXPORT_TABLES}
+        decoders = {name: decoder(table_of(source)) for name, source in models.items()}
+        state = {'table': None, 'batch': [], 'count': 0, 'started': perf_counter()}
+
+        def flush():
+            source = models.get(state['table'])
+            if state['batch']:
+                if source is followers:
+                    db.session.execute(followers.insert(), state['batch'])
+                else:
+                    # render_nulls keeps NULLs instead of re-applying column defaults
+                    db.session.bulk_insert_mappings(source, state['batch'], render_nulls=True)
+                db.session.commit()
+                state['count'] += len(state['batch'])
+                state['batch'] = []
+
+        with open_dump(path, 'r') as dump:
+            for line in dump:
+                record = json.loads(line)
+                if record['table'] != state['table']:
+                    flush()
+                    if state['table'] is not None:
+                        report(state['table'], state['count'], state['started'])
+                    if record['table'] not in models:
+                        raise click.ClickException(f'Unknown table {record["table"]}')
+                    state.update(table=record['table'], count=0, started=perf_counter())
+                state['batch'].append(decoders[record['table']](record['row']))
+                if len(state['batch']) >= batch_size:
+                    flush()
+        flush()
+        if state['table'] is not None:
+            report(state['table'], state['count'], state['started'])
+        advance_sequences(table_of(source) for source in EXPORT_TABLES)
+        # bulk inserts skip the publishing hook, so no feed has these projects yet
+        started = perf_counter()
+        report('timeline', timeline.rebuild(batch_size), started)
+        click.echo('Run `flask projapp reindex` to rebuild the search index.')
@@ -0,0 +1,149 @@
+import random
+import sqlite3
+from contextlib import contextmanager
+from threading import Lock
+from flask import current_app, has_request_context, request
+from flask_sqlalchemy import SQLAlchemy as _SQLAlchemy, SignallingSession
+from sqlalchemy import event, orm
+from sqlalchemy.engine.url import make_url
+from sqlalchemy.sql.dml import UpdateBase
+from sqlalchemy.sql.elements import TextClause
+from config import engine_options
+
+READ_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+
+def sqlite_pragmas(config):
+    return [
+        # readers no longer block the writer (and vice versa)
+        f"PRAGMA journal_mode={config['SQLITE_JOURNAL_MODE']}",
+        # with WAL, NORMAL only risks the last commits on power loss, never corruption
+        f"PRAGMA synchronous={config['SQLITE_SYNCHRONOUS']}",
+        # wait for the write lock instead of failing with "database is locked"
+        f"PRAGMA busy_timeout={config['SQLITE_BUSY_TIMEOUT']}",
+        f"PRAGMA mmap_size={config['SQLITE_MMAP_SIZE']}",
+        # negative means KiB rather than pages
+        f"PRAGMA cache_size=-{config['SQLITE_CACHE_SIZE']}",
+        'PRAGMA temp_store=MEMORY',
+    ]
+
+
+def use_sqlite_pragmas(engine, config):
+    """Run the tuning pragmas on every connection the engine opens."""
+    pragmas = sqlite_pragmas(config)
+
+    @event.listens_for(engine, 'connect')
+    def set_sqlite_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        try:
+            for pragma in pragmas:
+                cursor.execute(pragma)
+        finally:
+            cursor.close()
+
+
+def use_primary(view):
+    """Mark a GET view that writes, so none of its reads go to a replica."""
+    view.use_primary = True
+    return view
+
+
+def is_write(clause):
+    if isinstance(clause, UpdateBase):
+        return True
+    if isinstance(clause, TextClause):
+        return not clause.text.lstrip().upper().startswith(('SELECT', 'WITH', 'PRAGMA'))
+    return False
+
+
+class RoutingSession(SignallingSession):
+    """Sends reads to a replica when it is safe to: in GET requests (unless
+    the view is marked with @use_primary) and inside db.read_only().
+    Everything else, and every statement after the session's first write,
+    goes to the primary, so a request always reads its own writes."""
+
+    def __init__(self, db, **options):
+        self.db = db
+        super(RoutingSession, self).__init__(db, **options)
+
+    def get_bind(self, mapper=None, clause=None):
+        if self._flushing or is_write(clause):
+            self.info['wrote'] = True
+        elif not self.info.get('wrote') and self._may_use_replica():
+            replicas = self.db.replica_engines(self.app)
+            if replicas:
+                # stay on one replica for the whole request
+                if self.info.get('replica') not in replicas:
+                    self.info['replica'] = random.choice(replicas)
+                return self.info['replica']
+        return super(RoutingSession, self).get_bind(mapper, clause)
+
+    def _may_use_replica(self):
+        if self.info.get('read_only'):
+            return True
+        if not has_request_context() or request.method not in READ_METHODS:
+            return False
+        view = current_app.view_functions.get(request.endpoint)
+        return not getattr(view, 'use_primary', False)
+
+
+class SQLAlchemy(_SQLAlchemy):
+    """Flask-SQLAlchemy with SQLite connections tuned as they are opened
+    and reads routed to the engines in SQLALCHEMY_REPLICA_URIS.
+    journal_mode=WAL is stored in the database file, so it also holds for
+    connections made outside the app, such as the migration scripts."""
+
+    def __init__(self, *args, **kwargs):
+        self._replicas = {}
+        self._replicas_lock = Lock()
+        super(SQLAlchemy, self).__init__(*args, **kwargs)
+
+    def create_session(self, options):
+        return orm.sessionmaker(class_=RoutingSession, db=self, **options)
+
+    def create_engine(self, sa_url, engine_opts):
+        engine = super(SQLAlchemy, self).create_engine(sa_url, engine_opts)
+        if engine.dialect.name == 'sqlite':
+            use_sqlite_pragmas(engine, self.get_app().config)
+        return engine
+
+    def replica_engines(self, app):
+        uris = app.config['SQLALCHEMY_REPLICA_URIS']
+        engines = []
+        for uri in uris:
+            engine = self._replicas.get(uri)
+            if engine is None:
+                with self._replicas_lock:
+                    engine = self._replicas.get(uri)
+                    if engine is None:
+                        url, options = make_url(uri), engine_options(uri)
+                        self.apply_driver_hacks(app, url, options)
+                        engine = self._replicas[uri] = self.create_engine(url, options)
+            engines.append(engine)
+        return engines
+
+    @contextmanager
+    def read_only(self):
+        """Let reads in this block use a replica even outside a GET request."""
+        info = self.session().info
+        previous = info.get('read_only')
+        info['read_only'] = True
+        try:
+            yield
+        finally:
+            info['read_only'] = previous
+
+
+def replicate_sqlite(primary, replicas):
+    """Copy the primary SQLite file over each replica with the online
+    backup API; a stand-in for real replication when developing locally."""
+    source = sqlite3.connect(primary)
+    try:
+        for path in replicas:
+            target = sqlite3.connect(path)
+            try:
+                source.backup(target)
+            finally:
+                target.close()
+    finally:
+        source.close()
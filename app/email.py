@@ -1,33 +1,209 @@
-from flask_mail import Message
-from app import mail, app
-from flask import render_template
-from threading import Thread
+import json
+import sqlite3
+from threading import Event, Lock, Thread
+from time import time
+from uuid import uuid4
+from flask import current_app, render_template
+
+
+class MailSpool(object):
+    """The spool file, settings and worker threads of one application."""
+
+    SCHEMA = '''
+        CREATE TABLE IF NOT EXISTS mail_queue (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            message TEXT NOT NULL,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            next_attempt_at REAL NOT NULL,
+            claimed_by TEXT,
+            claimed_at REAL,
+            failed_at REAL,
+            last_error TEXT
+        )'''
+    DUE_INDEX = '''
+        CREATE INDEX IF NOT EXISTS ix_mail_queue_due
+        ON mail_queue (failed_at, next_attempt_at)'''
+
+    def __init__(self, app):
+        self.app = app
+        self.path = app.config['MAIL_QUEUE_PATH']
+        self.workers = app.config['MAIL_WORKERS']
+        self.batch_size = app.config['MAIL_BATCH_SIZE']
+        self.max_attempts = app.config['MAIL_MAX_ATTEMPTS']
+        self.backoff = app.config['MAIL_RETRY_BACKOFF']
+        self._mail = None
+        self._threads = []
+        self._lock = Lock()
+        self._wakeup = Event()
+        self._stop = Event()
+
+    @property
+    def mail(self):
+        if self._mail is None:
+            from flask_mail import Mail
+            self._mail = Mail(self.app)
+        return self._mail
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute(self.SCHEMA)
+        conn.execute(self.DUE_INDEX)
+        return conn
+
+    def enqueue(self, msg):
+        message = json.dumps({
+            'subject': msg.subject, 'sender': msg.sender,
+            'recipients': msg.recipients, 'body': msg.body, 'html': msg.html})
+        conn = self._connect()
+        try:
+            conn.execute('INSERT INTO mail_queue (message, next_attempt_at) '
+                         'VALUES (?, ?)', (message, time()))
+        finally:
+            conn.close()
+        self.start()
+        self._wakeup.set()
+
+    def start(self):
+        with self._lock:
+            self._threads = [t for t in self._threads if t.is_alive()]
+            while len(self._threads) < self.workers:
+                thread = Thread(target=self._run, daemon=True,
+                                name=f'mail-worker-{len(self._threads)}')
+                thread.start()
+                self._threads.append(thread)
+
+    def stop(self):
+        self._stop.set()
+        self._wakeup.set()
+
+    def pending(self):
+        conn = self._connect()
+        try:
+            return conn.execute('SELECT count(*) FROM mail_queue '
+                                'WHERE failed_at IS NULL').fetchone()[0]
+        finally:
+            conn.close()
+
+    def _claim(self, conn):
+        token = uuid4().hex
+        now = time()
+        lease = now - 10 * 60
+        conn.execute(
+            'UPDATE mail_queue SET claimed_by = ?, claimed_at = ? WHERE id IN ('
+            ' SELECT id FROM mail_queue WHERE failed_at IS NULL'
+            ' AND next_attempt_at <= ? AND (claimed_at IS NULL OR claimed_at < ?)'
+            ' ORDER BY next_attempt_at LIMIT ?)',
+            (token, now, now, lease, self.batch_size))
+        return conn.execute('SELECT id, message, attempts FROM mail_queue '
+                            'WHERE claimed_by = ? ORDER BY id', (token,)).fetchall()
+
+    def _run(self):
+        conn = self._connect()
+        while not self._stop.is_set():
+            try:
+                batch = self._claim(conn)
+            except sqlite3.OperationalError:
+                self.app.logger.exception('Could not read the mail queue')
+                batch = []
+            if not batch:
+                self._wakeup.wait(timeout=self.backoff)
+                self._wakeup.clear()
+                continue
+            self.deliver(conn, batch)
+        conn.close()
+
+    def deliver(self, conn, batch):
+        from flask_mail import Message
+        sent, current = 0, None
+        with self.app.app_context():
+            try:
+                with self.mail.connect() as smtp:
+                    for current in batch:
+                        id, message, attempts = current
+                        smtp.send(Message(**json.loads(message)))
+                        conn.execute('DELETE FROM mail_queue WHERE id = ?', (id,))
+                        sent += 1
+                    current = None
+            except Exception as e:
+                self.app.logger.warning(f'Mail delivery failed: {e!r}')
+                if current is None:
+                    # never got a connection: the whole batch backs off
+                    failed, released = batch[sent:], []
+                else:
+                    failed, released = [current], batch[sent + 1:]
+                for id, message, attempts in failed:
+                    self._retry(conn, id, attempts + 1, repr(e))
+                conn.executemany('UPDATE mail_queue SET claimed_by = NULL, '
+                                 'claimed_at = NULL WHERE id = ?',
+                                 [(id,) for id, _, _ in released])
+        return sent
+
+    def _retry(self, conn, id, attempts, error):
+        if attempts >= self.max_attempts:
+            self.app.logger.error(f'Giving up on queued mail {id}: {error}')
+            conn.execute('UPDATE mail_queue SET attempts = ?, failed_at = ?, '
+                         'last_error = ?, claimed_by = NULL, claimed_at = NULL '
+                         'WHERE id = ?', (attempts, time(), error, id))
+        else:
+            delay = self.backoff * 2 ** (attempts - 1)
+            conn.execute('UPDATE mail_queue SET attempts = ?, next_attempt_at = ?, '
+                         'last_error = ?, claimed_by = NULL, claimed_at = NULL '
+                         'WHERE id = ?', (attempts, time() + delay, error, id))
+
+
+class MailQueue(object):
+    """Outgoing mail spooled in a small SQLite file and delivered by a fixed
+    pool of worker threads. Each worker claims a batch of due messages and
+    sends them over one SMTP connection; failures are retried with
+    exponential backoff, so a burst of requests never means a burst of
+    threads or connections. Flask-Mail itself is only imported and set up
+    once there is something to deliver. Every app has its own spool in
+    ``app.extensions['mail_queue']``."""
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.extensions['mail_queue'] = MailSpool(app)
+        # pick up whatever was left in the spool by the previous process
+        app.before_first_request(self.start)
+
+    @property
+    def spool(self):
+        return current_app.extensions['mail_queue']
+
+    def enqueue(self, msg):
+        self.spool.enqueue(msg)
+
+    def start(self):
+        self.spool.start()
+
+    def stop(self):
+        self.spool.stop()
+
+    def pending(self):
+        return self.spool.pending()
+
+
+mail_queue = MailQueue()
+
 
 def send_email(subject, sender, recipients, text_body, html_body):
+    from flask_mail import Message
     msg = Message(subject, sender=sender, recipients=recipients)
     msg.body = text_body
     msg.html = html_body
-    mail.send(msg)
+    mail_queue.enqueue(msg)
 
 
 def send_password_reset_email(user):
     token = user.get_reset_password_token()
     send_email('[ProjApp] Reset Your Password',
-               sender=app.config['ADMINS'][0],
+               sender=current_app.config['ADMINS'][0],
                recipients=[user.email],
                text_body=render_template('email/reset_password.txt',
                                          user=user, token=token),
                html_body=render_template('email/reset_password.html',
                                          user=user, token=token))
-
-
-def send_async_email(app, msg):
-    with app.app_context():
-        mail.send(msg)
-
-
-def send_email(subject, sender, recipients, text_body, html_body):
-    msg = Message(subject, sender=sender, recipients=recipients)
-    msg.body = text_body
-    msg.html = html_body
-    Thread(target=send_async_email, args=(app, msg)).start()
\ No newline at end of file
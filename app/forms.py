@@ -4,7 +4,6 @@ from wtforms import StringField, PasswordField, BooleanField, \
 from wtforms.validators import DataRequired, Email, EqualTo, ValidationError, Length
 from app.models import User, Project
 from wtforms.fields.html5 import DateField
-from wtforms_components import DateRange
 from datetime import date, datetime
 from flask_login import current_user
 from flask_wtf.file import FileField, FileAllowed, FileRequired
@@ -100,7 +99,7 @@ class EditProjectForm(FlaskForm):
 
     def validate_title(self, title):
         if title.data != self.original_title:
-            project = Project.query.filter_by(title=self.title.data, user_id=current_user.get_id()).first()
+            project = Project.live().filter_by(title=self.title.data, user_id=current_user.get_id()).first()
             if project is not None:
                 raise ValidationError('Please use a different project title.')
 
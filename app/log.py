@@ -0,0 +1,182 @@
+import atexit
+import json
+import logging
+import os
+from datetime import datetime
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler, SMTPHandler
+from queue import SimpleQueue
+from threading import Lock
+from time import monotonic, perf_counter
+from uuid import uuid4
+from flask import _request_ctx_stack, g, has_request_context, request
+
+# attributes every LogRecord has; anything else came in through `extra`
+RESERVED = set(vars(logging.makeLogRecord({}))) | {'message', 'asctime'}
+
+
+class RequestContextFilter(logging.Filter):
+    """Stamps records with the request they were logged from. It runs on
+    the QueueHandler, in the request thread, because by the time the
+    listener thread formats the record the request is long gone."""
+
+    def filter(self, record):
+        if has_request_context():
+            record.request_id = g.get('request_id')
+            record.method = request.method
+            record.path = request.path
+            record.remote_addr = request.remote_addr
+            if 'request_started' in g:
+                record.latency_ms = round((perf_counter() - g.request_started) * 1000, 1)
+            # only if flask-login already loaded it; logging must not query
+            user = getattr(_request_ctx_stack.top, 'user', None)
+            record.user_id = user.id if user is not None and user.is_authenticated else None
+        return True
+
+
+class ContextQueueHandler(QueueHandler):
+    listener = None  # the QueueListener setup_logging() started for it
+
+    def prepare(self, record):
+        # keep the traceback separate from the message so the JSON formatter
+        # can put it in its own field
+        record = logging.makeLogRecord(vars(record))
+        record.message = record.getMessage()
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+        record.msg, record.args, record.exc_info = record.message, None, None
+        return record
+
+
+class JSONFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            'time': datetime.utcfromtimestamp(record.created).isoformat() + 'Z',
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+            'where': f'{record.pathname}:{record.lineno}',
+        }
+        entry.update((key, value) for key, value in vars(record).items()
+                     if key not in RESERVED)
+        if record.exc_text:
+            entry['exception'] = record.exc_text
+        return json.dumps(entry, default=str)
+
+
+class DedupSMTPHandler(SMTPHandler):
+    """Emails at most one copy of the same error (same logger, level and
+    call site) per `interval` seconds and at most `limit` emails in total
+    per interval; the next email that does go out says how many were
+    swallowed in between."""
+
+    def __init__(self, *args, interval=600, limit=10, timer=monotonic, **kwargs):
+        super(DedupSMTPHandler, self).__init__(*args, **kwargs)
+        self.interval = interval
+        self.limit = limit
+        self.timer = timer
+        self._sent = {}
+        self._window = (0, 0)
+        self._suppressed = 0
+        self._lock = Lock()
+
+    def allow(self, record):
+        now = self.timer()
+        key = (record.name, record.levelno, record.pathname, record.lineno)
+        with self._lock:
+            started, count = self._window
+            if now - started >= self.interval:
+                started, count = now, 0
+            last = self._sent.get(key)
+            if (last is not None and now - last < self.interval) or count >= self.limit:
+                self._suppressed += 1
+                return False
+            self._sent[key] = now
+            self._window = (started, count + 1)
+            record.suppressed, self._suppressed = self._suppressed, 0
+            return True
+
+    def emit(self, record):
+        if self.allow(record):
+            super(DedupSMTPHandler, self).emit(record)
+
+    def getSubject(self, record):
+        subject = f'{self.subject}: {record.getMessage().splitlines()[0][:80]}'
+        if getattr(record, 'suppressed', 0):
+            subject += f' (+{record.suppressed} suppressed)'
+        return subject
+
+
+def mail_handler(app):
+    auth = None
+    if app.config['MAIL_USERNAME'] or app.config['MAIL_PASSWORD']:
+        auth = (app.config['MAIL_USERNAME'], app.config['MAIL_PASSWORD'])
+    secure = None
+    if app.config['MAIL_USE_TLS']:
+        secure = ()
+    handler = DedupSMTPHandler(
+        mailhost=(app.config['MAIL_SERVER'], app.config['MAIL_PORT']),
+        fromaddr='no-reply@' + app.config['MAIL_SERVER'],
+        toaddrs=app.config['ADMINS'], subject='ProjApp Failure',
+        credentials=auth, secure=secure, timeout=10,
+        interval=app.config['LOG_MAIL_INTERVAL'], limit=app.config['LOG_MAIL_LIMIT'])
+    handler.setLevel(logging.ERROR)
+    return handler
+
+
+def file_handler(app):
+    directory = os.path.dirname(app.config['LOG_FILE'])
+    if directory and not os.path.exists(directory):
+        os.makedirs(directory)
+    handler = RotatingFileHandler(app.config['LOG_FILE'],
+                                  maxBytes=app.config['LOG_MAX_BYTES'],
+                                  backupCount=app.config['LOG_BACKUP_COUNT'])
+    if app.config['LOG_FORMAT'] == 'json':
+        handler.setFormatter(JSONFormatter())
+    else:
+        handler.setFormatter(logging.Formatter(
+            '%(asctime)s %(levelname)s: %(message)s [in %(pathname)s:%(lineno)d]'))
+    handler.setLevel(logging.INFO)
+    return handler
+
+
+def setup_logging(app):
+    """Route app.logger through a queue: request threads only enqueue, and
+    one listener thread does the file writes and SMTP round-trips. Apps
+    of the same package share one logger, so building another app
+    replaces the previous app's handler and listener."""
+    for previous in [h for h in app.logger.handlers if isinstance(h, ContextQueueHandler)]:
+        app.logger.removeHandler(previous)
+        if previous.listener is not None:
+            atexit.unregister(previous.listener.stop)
+            previous.listener.stop()
+            for handler in previous.listener.handlers:
+                handler.close()
+    handlers = [file_handler(app)]
+    if app.config['MAIL_SERVER']:
+        handlers.append(mail_handler(app))
+    queue = SimpleQueue()
+    listener = QueueListener(queue, *handlers, respect_handler_level=True)
+    handler = ContextQueueHandler(queue)
+    handler.listener = listener
+    handler.addFilter(RequestContextFilter())
+    app.logger.addHandler(handler)
+    app.logger.setLevel(logging.INFO)
+    listener.start()
+    atexit.register(listener.stop)
+    return listener
+
+
+def track_requests(app):
+    """Give every request an id (the caller's X-Request-ID if it sent one)
+    and a start time for the records logged while it runs."""
+    @app.before_request
+    def start_request_log():
+        g.request_started = perf_counter()
+        g.request_id = request.headers.get('X-Request-ID') or uuid4().hex
+
+    @app.after_request
+    def finish_request_log(response):
+        response.headers.setdefault('X-Request-ID', g.get('request_id', ''))
+        if app.config['LOG_REQUESTS']:
+            app.logger.info('request', extra={'status': response.status_code})
+        return response
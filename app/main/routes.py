@@ -0,0 +1,374 @@
+from app import db, last_seen, fragment_cache, profiler, tasks
+from flask import render_template, flash, redirect, url_for, request, send_file, \
+    Response, stream_with_context, abort, jsonify, make_response, session, current_app
+from markupsafe import Markup
+from app.main import bp
+from app.forms import EditProfileForm, ProjectForm, EditProjectForm, CommentForm, \
+    TodoForm, ArtifactForm
+from app.models import User, Project, Comment, Todo, Artifact, Blob, ProjectDetail, user_cache
+from app.search import search as search_documents
+from app.timeline import remove_projects
+from app.reaper import reap_project
+from app.pagination import decode_cursor, keyset_page, seek_before
+from app.database import use_primary
+from flask_login import current_user, login_required
+from funcs import save_file, keep_blob, blob_path
+from datetime import datetime
+from functools import lru_cache
+from hashlib import md5
+from time import time
+import mimetypes
+import os
+
+
+@lru_cache(maxsize=None)
+def templates_version(folder):
+    # redeploying new templates must not leave browsers on 304s of old pages
+    return max(os.path.getmtime(os.path.join(root, name))
+               for root, _, names in os.walk(folder) for name in names)
+
+
+def stream_template(template_name, **context):
+    current_app.update_template_context(context)
+    template = current_app.jinja_env.get_template(template_name)
+    stream = template.stream(context)
+    stream.enable_buffering(5)
+    return Response(stream_with_context(stream))
+
+
+def conditional_page(stamp, render):
+    """Answer 304 when the browser's copy was rendered from the same
+    version stamp, otherwise call ``render`` and tag the response with a
+    weak ETag. Pages with a pending flash are always rendered."""
+    etag = None
+    if request.method == 'GET' and not session.get('_flashes'):
+        # forms embed a CSRF token that expires, so pages go stale with it
+        limit = current_app.config.get('WTF_CSRF_TIME_LIMIT', 3600)
+        folder = os.path.join(current_app.root_path, current_app.template_folder)
+        parts = (current_app.config['PAGE_ETAG_SALT'], templates_version(folder),
+                 current_user.get_id(), current_user.updated_at,
+                 int(time() // (limit / 2)) if limit else 0, stamp)
+        etag = md5(repr(parts).encode('utf-8')).hexdigest()
+        if request.if_none_match.contains_weak(etag):
+            rv = Response(status=304)
+        else:
+            rv = make_response(render())
+        rv.set_etag(etag, weak=True)
+    else:
+        rv = make_response(render())
+    rv.cache_control.private = True
+    rv.cache_control.no_cache = True
+    return rv
+
+
+@bp.app_template_global()
+def project_card(project):
+    author = project.author
+    return Markup(fragment_cache.get_or_render(
+        f'project-card:{project.id}',
+        (project.updated_at, author.id, author.updated_at),
+        lambda: render_template('_project_card.html', project=project)))
+
+
+@bp.before_app_request
+def before_request():
+    if current_user.is_authenticated:
+        last_seen.touch(current_user)
+
+@bp.route('/')
+@bp.route('/index')
+@login_required
+def index():
+    def render():
+        after = decode_cursor(request.args.get('cursor'))
+        page = keyset_page(
+            current_user.followed_projects(after).options(
+                db.joinedload(Project.author)),
+            current_app.config['PROJECTS_PER_PAGE'])
+        next_url = url_for('main.index', cursor=page.next_cursor) \
+            if page.has_next else None
+        return render_template('index.html', title='Home', projects=page.items,
+                               next_url=next_url)
+    return conditional_page(current_user.feed_version(), render)
+
+@bp.route('/user/<username>')
+@login_required
+def user(username):
+    # on one's own page the identity map hands back current_user, which may
+    # be a cached snapshot from before a change; overwrite it from the row
+    user = User.query.populate_existing().filter_by(username=username).first_or_404()
+
+    def render():
+        projects = user.projects.filter(Project.deleted_at == None) \
+            .order_by(Project.created_at.desc())
+        return render_template('user.html', title='Profile', user=user, projects=projects)
+    return conditional_page((user.id, user.updated_at, user.last_seen), render)
+
+@bp.route('/edit_profile', methods=['GET', 'POST'])
+@login_required
+def edit_profile():
+    form = EditProfileForm(current_user.username)
+    if form.validate_on_submit():
+        current_user.username = form.username.data
+        current_user.about_me = form.about_me.data
+        db.session.commit()
+        user_cache.pop(current_user.id)
+        flash('Your changes have been saved.')
+        return redirect(url_for('main.user', username=current_user.username))
+    elif request.method == 'GET':
+        form.username.data = current_user.username
+        form.about_me.data = current_user.about_me
+    return render_template('edit_profile.html', title='Edit Profile',
+                           form=form)
+
+@bp.route('/follow/<username>')
+@use_primary
+@login_required
+def follow(username):
+    user = User.query.filter_by(username=username).first()
+    if user is None:
+        flash(f'User {username} not found.')
+        return redirect(url_for('main.index'))
+    if user == current_user:
+        flash('You cannot follow yourself!')
+        return redirect(url_for('main.user', username=username))
+    current_user.follow(user)
+    db.session.commit()
+    user_cache.pop(current_user.id)
+    user_cache.pop(user.id)
+    flash(f'You are following {username}!')
+    return redirect(url_for('main.user', username=username))
+
+@bp.route('/unfollow/<username>')
+@use_primary
+@login_required
+def unfollow(username):
+    user = User.query.filter_by(username=username).first()
+    if user is None:
+        flash(f'User {username} not found.')
+        return redirect(url_for('main.index'))
+    if user == current_user:
+        flash('You cannot unfollow yourself!')
+        return redirect(url_for('main.user', username=username))
+    current_user.unfollow(user)
+    db.session.commit()
+    user_cache.pop(current_user.id)
+    user_cache.pop(user.id)
+    flash(f'You are not following {username}.')
+    return redirect(url_for('main.user', username=username))
+
+@bp.route('/explore')
+@login_required
+def explore():
+    def render():
+        query = Project.live().options(db.joinedload(Project.author))
+        after = decode_cursor(request.args.get('cursor'))
+        if after is not None:
+            query = query.filter(seek_before(Project.created_at, Project.id, after))
+        page = keyset_page(
+            query.order_by(Project.created_at.desc(), Project.id.desc()),
+            current_app.config['PROJECTS_PER_PAGE'])
+        next_url = url_for('main.explore', cursor=page.next_cursor) \
+            if page.has_next else None
+        render = stream_template if current_app.config['STREAM_TEMPLATES'] \
+            else render_template
+        return render('explore.html', title='Explore', projects=page.items,
+                      next_url=next_url)
+    return conditional_page(User.site_version(), render)
+
+@bp.route('/search')
+@login_required
+def search():
+    q = request.args.get('q', '').strip()
+    page = request.args.get('page', 1, type=int)
+    hits, has_next = search_documents(q, current_user, max(page, 1),
+                                  current_app.config['SEARCH_RESULTS_PER_PAGE']) if q else ([], False)
+    next_url = url_for('main.search', q=q, page=page + 1) if has_next else None
+    prev_url = url_for('main.search', q=q, page=page - 1) if page > 1 else None
+    return render_template('search.html', title='Search', q=q, hits=hits,
+                           next_url=next_url, prev_url=prev_url)
+
+@bp.route('/projects/new', methods=['GET', 'POST'])
+@login_required
+def new_project():
+    form = ProjectForm()
+    if form.validate_on_submit():
+        project = Project(
+            title = form.title.data,
+            body = form.body.data,
+            status = form.status.data,
+            sdate = form.sdate.data,
+            edate = form.edate.data,
+            author = current_user
+        )
+        db.session.add(project)
+        db.session.flush()
+        new_id = project.id
+        db.session.commit()
+        flash('Project created successfully')
+        return redirect(url_for('main.view_project', id=new_id))
+    return render_template('new_project.html', title='New project', form=form)
+
+@bp.route('/projects/<id>', methods=['GET', 'POST'])
+@login_required
+def view_project(id):
+    form = CommentForm()
+    aform = ArtifactForm()
+    if request.method == 'GET':
+        project = Project.live().options(db.joinedload(Project.author)) \
+            .filter_by(id=id).first()
+        if project is None:
+            abort(404)
+        # todos, comments and artifacts bump the project's updated_at
+        return conditional_page(
+            (project.id, project.updated_at, project.author.updated_at),
+            lambda: render_project(ProjectDetail.of(project), form,
+                                   TodoForm(pid=project.id), aform))
+    detail = ProjectDetail.load(id)
+    if detail is None:
+        abort(404)
+    project = detail.project
+    tform = TodoForm(pid = project.id)
+    if form.csubmit.data and form.validate():
+        comment = Comment(
+            body = form.body.data,
+            user_id = current_user.get_id()
+        )
+        project.add_comment(comment)
+        db.session.commit()
+        flash('Your comment has been submitted successfully')
+        return redirect(url_for('main.view_project', id=project.id))
+    if tform.tsubmit.data and tform.validate():
+        todo = Todo(
+            task = tform.task.data,
+            edate = tform.edate.data,
+            is_done = tform.is_done.data
+        )
+        project.add_todo(todo)
+        db.session.commit()
+        flash('Task has been added successfully')
+        return redirect(url_for('main.view_project', id=project.id))
+
+    if aform.asubmit.data and aform.validate():
+        file = request.files['file']
+        upload, filename = save_file(file)
+        try:
+            blob = Blob.acquire(upload.hexdigest(), upload.size)
+            # only now that the blob's row is ours: the reaper removes
+            # files under that row's lock, so this one cannot vanish
+            keep_blob(upload)
+        finally:
+            upload.close()
+        artifact = Artifact(
+            name = aform.name.data,
+            blob = blob,
+            filename = filename,
+            project_id = project.id
+        )
+        db.session.add(artifact)
+        db.session.commit()
+        flash('Artifact saved successfully')
+        return redirect(url_for('main.view_project', id=project.id))
+    return render_project(detail, form, tform, aform)
+
+def render_project(detail, form, tform, aform):
+    return render_template('view_project.html', title=detail.project.title,
+                           project=detail.project, detail=detail,
+                           form=form, tform=tform, aform=aform)
+
+@bp.route('/projects/<id>/edit', methods=['GET', 'POST'])
+@login_required
+def edit_project(id):
+    project = Project.live().filter_by(id=id).first_or_404()
+    form = EditProjectForm(project.title)
+    if request.method == 'GET':
+        form.title.data = project.title
+        form.body.data = project.body
+        form.status.data = project.status
+        form.sdate.data = project.sdate
+        form.edate.data = project.edate
+    elif form.validate_on_submit():
+        project.title = form.title.data
+        project.body = form.body.data
+        project.status = form.status.data
+        project.sdate = form.sdate.data
+        project.edate = form.edate.data
+        db.session.commit()
+        fragment_cache.delete(f'project-card:{project.id}')
+        flash('Project updated successfully!')
+        return redirect(url_for('main.view_project', id=project.id))
+    return render_template('edit_project.html', title='Edit project', form=form)
+
+@bp.route('/projects/<id>/delete', methods=['GET', 'POST'])
+@use_primary
+@login_required
+def delete_project(id):
+    project = Project.live().filter_by(id=id).first_or_404()
+    if project.user_id != current_user.id:
+        abort(403)
+    # hide it now; its comments, todos and artifacts go in the background
+    project.deleted_at = datetime.utcnow()
+    remove_projects(db.session, [project.id])
+    db.session.commit()
+    fragment_cache.delete(f'project-card:{project.id}')
+    tasks.submit(reap_project, project.id)
+    flash('Project deleted successfully!')
+    return redirect(url_for('main.index'))
+
+@bp.route('/todos/<id>', methods=['GET', 'POST'])
+@use_primary
+@login_required
+def update_todos(id):
+    task = Todo.query.get_or_404(id)
+    if task.project.deleted_at is not None:
+        abort(404)
+    task.toggle()
+    db.session.commit()
+    flash('Task updated successfully')
+    return redirect(url_for('main.view_project', id=task.project.id))
+
+@bp.route('/download_file/<file>')
+@login_required
+def download_file(file):
+    blob = Blob.query.get_or_404(file)
+    artifact = blob.artifacts.join(Project).filter(
+        Project.deleted_at == None).first_or_404()
+    filename = artifact.filename or file
+    mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+    path = blob_path(blob.sha256)
+    sendfile = current_app.config['ARTIFACT_SENDFILE']
+    if sendfile == 'x-accel-redirect':
+        rv = Response(mimetype=mimetype)
+        rv.headers['X-Accel-Redirect'] = current_app.config['ARTIFACT_ACCEL_PREFIX'] + \
+            os.path.relpath(path, current_app.config['BLOB_FOLDER']).replace(os.sep, '/')
+    elif sendfile == 'x-sendfile':
+        rv = Response(mimetype=mimetype)
+        rv.headers['X-Sendfile'] = path
+    else:
+        rv = send_file(path, mimetype=mimetype, add_etags=False,
+                       cache_timeout=current_app.config['ARTIFACT_CACHE_TIMEOUT'])
+    rv.headers.set('Content-Disposition', 'inline', filename=filename)
+    rv.cache_control.public = False
+    rv.cache_control.private = True
+    rv.cache_control.max_age = current_app.config['ARTIFACT_CACHE_TIMEOUT']
+    # content never changes under a hash, so the hash is a strong validator
+    rv.set_etag(blob.sha256)
+    rv.last_modified = blob.created_at
+    if sendfile:
+        # the front-end server answers Range requests itself
+        return rv.make_conditional(request)
+    return rv.make_conditional(request, accept_ranges=True,
+                               complete_length=blob.size)
+
+@bp.route('/admin/stats')
+@login_required
+def admin_stats():
+    if current_user.email not in current_app.config['ADMINS']:
+        abort(403)
+    if not profiler.enabled:
+        abort(404)
+    if request.args.get('format') == 'prometheus':
+        return Response(profiler.prometheus(),
+                        mimetype='text/plain; version=0.0.4')
+    return jsonify(endpoints=profiler.stats(), user_cache=user_cache.stats(),
+                   fragment_cache=fragment_cache.backend.stats())
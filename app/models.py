@@ -1,17 +1,47 @@
-from app import db, login, app
+from app import db, login
+from app.pagination import seek_before
 from time import time
-import jwt
 from hashlib import md5
 from datetime import datetime
+from functools import lru_cache
+from flask import current_app
 from flask_login import UserMixin
+from sqlalchemy import event
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import make_transient_to_detached, validates
+from sqlalchemy.orm.exc import StaleDataError
+from werkzeug.local import LocalProxy
 from werkzeug.security import generate_password_hash, check_password_hash
 
 followers = db.Table(
     'followers',
-    db.Column('follower_id', db.Integer, db.ForeignKey('user.id')),
-    db.Column('followed_id', db.Integer, db.ForeignKey('user.id'))
+    db.Column('follower_id', db.Integer, db.ForeignKey('user.id'), primary_key=True),
+    db.Column('followed_id', db.Integer, db.ForeignKey('user.id'), primary_key=True),
+    # the primary key serves "who does X follow"; this serves "who follows X"
+    db.Index('ix_followers_followed_follower', 'followed_id', 'follower_id')
 )
 
+# materialized home feed: one row per (reader, project), written when a
+# project is published (fan-out on write, see app/timeline.py)
+timeline = db.Table(
+    'timeline',
+    db.Column('user_id', db.Integer, db.ForeignKey('user.id'), primary_key=True),
+    db.Column('created_at', db.DateTime, primary_key=True),
+    db.Column('project_id', db.Integer, db.ForeignKey('project.id'), primary_key=True),
+    db.Column('author_id', db.Integer, db.ForeignKey('user.id'), nullable=False),
+    db.Index('ix_timeline_user_author', 'user_id', 'author_id'),
+    db.Index('ix_timeline_project', 'project_id'),
+)
+
+def email_digest(email):
+    return md5(email.lower().encode('utf-8')).hexdigest()
+
+
+@lru_cache(maxsize=4096)
+def avatar_url(digest, size):
+    return f'https://www.gravatar.com/avatar/{digest}?d=identicon&s={size}'
+
+
 class TimestampMixin(object):
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, onupdate=datetime.utcnow)
@@ -21,11 +51,19 @@ class User(UserMixin, TimestampMixin, db.Model):
     id = db.Column(db.Integer, primary_key=True)
     username = db.Column(db.String(64), index=True, unique=True)
     email = db.Column(db.String(120), index=True, unique=True)
+    email_hash = db.Column(db.String(32))
     password_hash = db.Column(db.String(128))
     projects = db.relationship('Project', backref='author', lazy='dynamic')
     about_me = db.Column(db.String(140))
     last_seen = db.Column(db.DateTime, default=datetime.utcnow)
     comments = db.relationship('Comment', backref='user', lazy='dynamic')
+    follower_count = db.Column(db.Integer, default=0, server_default='0', nullable=False)
+    following_count = db.Column(db.Integer, default=0, server_default='0', nullable=False)
+
+    __table_args__ = (
+        # newest change anywhere: the version stamp of the explore page
+        db.Index('ix_user_updated_at', 'updated_at'),
+    )
 
     followed = db.relationship(
         'User', secondary=followers,
@@ -36,49 +74,171 @@ class User(UserMixin, TimestampMixin, db.Model):
     def __repr__(self):
         return f'<User {self.username}>'
 
+    def snapshot(self):
+        return {attr.key: getattr(self, attr.key)
+                for attr in db.inspect(User).column_attrs}
+
+    @staticmethod
+    def from_snapshot(snapshot):
+        """Attach a cached snapshot to the current session without a query."""
+        user = User(**snapshot)
+        make_transient_to_detached(user)
+        return db.session.merge(user, load=False)
+
     def set_password(self, password):
         self.password_hash = generate_password_hash(password)
 
     def check_password(self, password):
         return check_password_hash(self.password_hash, password)
 
+    @validates('email')
+    def validate_email(self, key, email):
+        self.email_hash = email_digest(email) if email else None
+        return email
+
     def avatar(self, size):
-        digest = md5(self.email.lower().encode('utf-8')).hexdigest()
-        return f'https://www.gravatar.com/avatar/{digest}?d=identicon&s={size}'
+        return avatar_url(self.email_hash or email_digest(self.email), size)
 
     def follow(self, user):
         if not self.is_following(user):
+            if not user.is_celebrity():
+                self._backfill_timeline(user)
             self.followed.append(user)
+            # bump in SQL so concurrent follows don't lose updates
+            self.following_count = User.following_count + 1
+            user.follower_count = User.follower_count + 1
 
     def unfollow(self, user):
         if self.is_following(user):
+            limit = current_app.config['TIMELINE_FANOUT_LIMIT']
+            count = db.session.query(User.follower_count).filter_by(id=user.id).scalar()
+            if count - 1 < limit <= count:
+                # no longer a celebrity: the feed stops pulling their
+                # projects, so fan out the recent ones once this commits
+                db.session.info.setdefault('fan_out', []).extend(
+                    id for id, in db.session.query(Project.id)
+                    .filter(Project.user_id == user.id, Project.deleted_at == None)
+                    .order_by(Project.created_at.desc(), Project.id.desc())
+                    .limit(current_app.config['TIMELINE_BACKFILL']))
             self.followed.remove(user)
+            self.following_count = User.following_count - 1
+            user.follower_count = User.follower_count - 1
+            db.session.execute(timeline.delete().where(db.and_(
+                timeline.c.user_id == self.id, timeline.c.author_id == user.id)))
+
+    def is_celebrity(self):
+        """Too many followers to fan out to; their projects are merged
+        into followers' feeds at read time instead."""
+        return (self.follower_count or 0) >= current_app.config['TIMELINE_FANOUT_LIMIT']
+
+    def _backfill_timeline(self, user):
+        # the newest projects of someone just followed, skipping any that a
+        # fan-out job already delivered
+        recent = db.select([db.literal(self.id), Project.created_at, Project.id, Project.user_id]) \
+            .where(Project.user_id == user.id) \
+            .where(Project.deleted_at == None) \
+            .where(~db.exists().where(db.and_(timeline.c.user_id == self.id,
+                                              timeline.c.project_id == Project.id))) \
+            .order_by(Project.created_at.desc(), Project.id.desc()) \
+            .limit(current_app.config['TIMELINE_BACKFILL'])
+        db.session.execute(timeline.insert().from_select(
+            ['user_id', 'created_at', 'project_id', 'author_id'], recent))
 
     def is_following(self, user):
-        return self.followed.filter(
-            followers.c.followed_id == user.id).count() > 0
+        return db.session.query(db.exists().where(db.and_(
+            followers.c.follower_id == self.id,
+            followers.c.followed_id == user.id))).scalar()
+
+    def followed_celebrities(self):
+        return [id for id, in db.session.query(User.id).join(
+            followers, followers.c.followed_id == User.id).filter(
+                followers.c.follower_id == self.id,
+                User.follower_count >= current_app.config['TIMELINE_FANOUT_LIMIT'])]
 
-    def followed_projects(self):
-        followed = Project.query.join(
-            followers, (followers.c.followed_id == Project.user_id)).filter(
-                followers.c.follower_id == self.id)
-        own = Project.query.filter_by(user_id=self.id)
-        return followed.union(own).order_by(Project.created_at.desc())
+    def feed_version(self):
+        """Changes whenever the feed's content can: the newest row of this
+        user's timeline, which fan-out jobs write after the publishing
+        commit, the newest project of each followed celebrity, and the
+        newest change by this user or anyone they follow, which covers
+        edits and deletes."""
+        followed = db.select([followers.c.followed_id]).where(
+            followers.c.follower_id == self.id)
+        changed = db.session.query(db.func.max(db.func.coalesce(
+            User.updated_at, User.created_at))).filter(
+                db.or_(User.id == self.id, User.id.in_(followed))).scalar()
+        # a probe down the (user_id, created_at, project_id) primary key
+        newest = db.session.query(timeline.c.created_at, timeline.c.project_id) \
+            .filter(timeline.c.user_id == self.id) \
+            .order_by(timeline.c.created_at.desc(), timeline.c.project_id.desc()) \
+            .first()
+        celebrities = self.followed_celebrities()
+        pulled = db.session.query(Project.user_id, db.func.max(Project.id)) \
+            .filter(Project.user_id.in_(celebrities), Project.deleted_at == None) \
+            .group_by(Project.user_id).order_by(Project.user_id).all() \
+            if celebrities else []
+        return changed, tuple(newest or ()), tuple(map(tuple, pulled))
+
+    @staticmethod
+    def site_version():
+        # two scalar subqueries, each an index lookup; selecting both
+        # max() from the bare tables would scan their cross join
+        return db.session.query(
+            db.select([db.func.max(User.updated_at)]).as_scalar(),
+            db.select([db.func.max(Project.id)]).as_scalar()).one()
+
+    def followed_projects(self, after=None):
+        """The home feed: a range scan of this user's timeline rows, plus
+        the projects of followed celebrities, which are never fanned out."""
+        # deleted projects lose their rows at once, but a backfill or
+        # fan-out racing the delete may have written one since
+        feed = Project.live().join(timeline, timeline.c.project_id == Project.id) \
+            .filter(timeline.c.user_id == self.id)
+        if after is not None:
+            feed = feed.filter(seek_before(timeline.c.created_at,
+                                           timeline.c.project_id, after))
+        celebrities = self.followed_celebrities()
+        if not celebrities:
+            return feed.order_by(timeline.c.created_at.desc(),
+                                 timeline.c.project_id.desc())
+        pulled = Project.live().filter(Project.user_id.in_(celebrities))
+        if after is not None:
+            pulled = pulled.filter(seek_before(Project.created_at, Project.id, after))
+        return feed.union(pulled).order_by(
+            Project.created_at.desc(), Project.id.desc())
 
     def get_reset_password_token(self, expires_in=600):
+        import jwt
         return jwt.encode(
             {'reset_password': self.id, 'exp': time() + expires_in},
-            app.config['SECRET_KEY'], algorithm='HS256').decode('utf-8')
+            current_app.config['SECRET_KEY'], algorithm='HS256').decode('utf-8')
 
     @staticmethod
     def verify_reset_password_token(token):
+        import jwt
         try:
-            id = jwt.decode(token, app.config['SECRET_KEY'],
+            id = jwt.decode(token, current_app.config['SECRET_KEY'],
                             algorithms=['HS256'])['reset_password']
         except:
             return
         return User.query.get(id)
 
+    def get_api_token(self, expires_in):
+        # its claim differs from the reset token's, so neither passes for the other
+        import jwt
+        return jwt.encode(
+            {'api': self.id, 'exp': time() + expires_in},
+            current_app.config['SECRET_KEY'], algorithm='HS256').decode('utf-8')
+
+    @staticmethod
+    def verify_api_token(token):
+        import jwt
+        try:
+            id = jwt.decode(token, current_app.config['SECRET_KEY'],
+                            algorithms=['HS256'])['api']
+        except:
+            return
+        return load_user(id)
+
 
 class Project(TimestampMixin, db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -91,10 +251,105 @@ class Project(TimestampMixin, db.Model):
     comments = db.relationship('Comment', backref='project', lazy='dynamic')
     todos = db.relationship('Todo', backref='project', lazy='dynamic')
     artifacts = db.relationship("Artifact", backref='project', lazy='dynamic')
+    comment_count = db.Column(db.Integer, default=0, server_default='0', nullable=False)
+    open_todo_count = db.Column(db.Integer, default=0, server_default='0', nullable=False)
+    # set when the author deletes the project; app/reaper.py removes it later
+    deleted_at = db.Column(db.DateTime, index=True)
+
+    __table_args__ = (
+        db.Index('ix_project_created', 'created_at', 'id'),
+        db.Index('ix_project_user_created', 'user_id', 'created_at', 'id'),
+    )
 
     def __repr__(self):
         return f'<Project {self.title}>'
 
+    @staticmethod
+    def live():
+        """Projects that have not been deleted. Deleted ones stay in the
+        table, hidden, until the reaper has removed their rows."""
+        return Project.query.filter(Project.deleted_at == None)
+
+    def add_comment(self, comment):
+        self.comments.append(comment)
+        self.comment_count = Project.comment_count + 1
+
+    def add_todo(self, todo):
+        self.todos.append(todo)
+        if not todo.is_done:
+            self.open_todo_count = Project.open_todo_count + 1
+
+    def add_todos(self, tasks, edate):
+        todos = [Todo(task=task, edate=edate, is_done=False) for task in tasks]
+        for todo in todos:
+            self.todos.append(todo)
+        self.open_todo_count = Project.open_todo_count + len(todos)
+        return todos
+
+    def mark_todos(self, ids, done):
+        """Mark this project's todos in ``ids`` done (or open again) with
+        one UPDATE; returns the ids whose state changed."""
+        is_open = db.or_(Todo.is_done == False, Todo.is_done == None)
+        todos = Todo.query.filter(Todo.project_id == self.id, Todo.id.in_(ids),
+                                  is_open if done else Todo.is_done == True)
+        changed = [id for id, in todos.with_entities(Todo.id)]
+        if changed:
+            count = todos.update({'is_done': done}, synchronize_session=False)
+            self.open_todo_count = Project.open_todo_count + (-count if done else count)
+        return changed
+
+    def delete_todos(self, ids):
+        """Delete this project's todos in ``ids``; returns the ids deleted."""
+        is_open = db.or_(Todo.is_done == False, Todo.is_done == None)
+        todos = Todo.query.filter(Todo.project_id == self.id, Todo.id.in_(ids))
+        deleted = [id for id, in todos.with_entities(Todo.id)]
+        if deleted:
+            # the open ones go first, so the counter drops by exactly their rowcount
+            removed_open = todos.filter(is_open).delete(synchronize_session=False)
+            todos.delete(synchronize_session=False)
+            self.open_todo_count = Project.open_todo_count - removed_open
+            # bulk deletes skip the hooks that bump the version stamps
+            self.updated_at = datetime.utcnow()
+        return deleted
+
+
+class ProjectDetail(object):
+    """Everything view_project.html renders, loaded up front in a fixed
+    number of queries so the template never touches a dynamic relationship."""
+
+    def __init__(self, project, todos, comments, artifacts):
+        self.project = project
+        self.todos = todos
+        self.comments = comments
+        self.artifacts = artifacts
+
+    @property
+    def comment_count(self):
+        return len(self.comments)
+
+    @property
+    def todo_count(self):
+        return len(self.todos)
+
+    @property
+    def artifact_count(self):
+        return len(self.artifacts)
+
+    @classmethod
+    def load(cls, id):
+        project = Project.live().options(db.joinedload(Project.author)) \
+            .filter_by(id=id).first()
+        return cls.of(project) if project is not None else None
+
+    @classmethod
+    def of(cls, project):
+        """The detail of a project the caller has already loaded."""
+        todos = project.todos.order_by(Todo.id).all()
+        comments = project.comments.options(db.joinedload(Comment.user)) \
+            .order_by(Comment.created_at, Comment.id).all()
+        artifacts = project.artifacts.order_by(Artifact.id).all()
+        return cls(project, todos, comments, artifacts)
+
 
 class Comment(TimestampMixin, db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -102,6 +357,10 @@ class Comment(TimestampMixin, db.Model):
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'))
     project_id = db.Column(db.Integer, db.ForeignKey('project.id'))
 
+    __table_args__ = (
+        db.Index('ix_comment_project_created', 'project_id', 'created_at', 'id'),
+    )
+
     def __repr__(self):
         out = (self.body[:50] + '...') if len(self.body) > 50 else self.body
         return f'<Comment {out}>'
@@ -114,20 +373,103 @@ class Todo(TimestampMixin, db.Model):
     is_done = db.Column(db.Boolean, default=False)
     project_id = db.Column(db.Integer, db.ForeignKey('project.id'))
 
+    __table_args__ = (
+        db.Index('ix_todo_project_created', 'project_id', 'created_at', 'id'),
+    )
+
     def __repr__(self):
         out = (self.task[:50] + '...') if len(self.task) > 50 else self.task
         return f'<Todo {out}>'
 
+    def toggle(self):
+        self.is_done = not self.is_done
+        self.project.open_todo_count = Project.open_todo_count + \
+            (-1 if self.is_done else 1)
+
+
+class Blob(TimestampMixin, db.Model):
+    sha256 = db.Column(db.String(64), primary_key=True)
+    size = db.Column(db.Integer, nullable=False)
+    refcount = db.Column(db.Integer, default=0, server_default='0', nullable=False)
+    artifacts = db.relationship('Artifact', backref='blob', lazy='dynamic')
+
+    def __repr__(self):
+        return f'<Blob {self.sha256[:12]}>'
+
+    @staticmethod
+    def acquire(digest, size):
+        """Take a reference on the blob for ``digest``, creating its row
+        the first time this content is stored. The change is flushed at
+        once, so the row stays locked until the caller commits. Should a
+        concurrent upload create the row first, or the reaper delete it,
+        the session is rolled back and the reference taken again; call
+        this before adding anything else to the session."""
+        for attempt in range(2):
+            blob = Blob.query.get(digest)
+            if blob is None:
+                blob = Blob(sha256=digest, size=size, refcount=1)
+                db.session.add(blob)
+            else:
+                blob.refcount = Blob.refcount + 1
+            try:
+                db.session.flush()
+                return blob
+            except (IntegrityError, StaleDataError):
+                if attempt:
+                    raise
+                db.session.rollback()
+
+    def release(self):
+        self.refcount = Blob.refcount - 1
+
 
 class Artifact(TimestampMixin, db.Model):
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(140), index=True, nullable=False)
-    file = db.Column(db.String(60), index=True, nullable=False)
+    file = db.Column(db.String(64), db.ForeignKey('blob.sha256'), index=True, nullable=False)
+    filename = db.Column(db.String(140))
     project_id = db.Column(db.Integer, db.ForeignKey('project.id'))
 
+    __table_args__ = (
+        db.Index('ix_artifact_project_created', 'project_id', 'created_at', 'id'),
+    )
+
     def __repr__(self):
         return f'<Artifact: {self.name}>'
 
+@event.listens_for(db.session, 'before_flush')
+def touch_owners(session, flush_context, instances):
+    """Bump updated_at up the ownership chain, so a project's stamp covers
+    its todos, comments and artifacts and an author's stamp covers their
+    projects. Pages use these stamps as cheap ETags."""
+    now = datetime.utcnow()
+    projects, authors = set(), set()
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        if obj in session.dirty and not session.is_modified(obj):
+            continue
+        if isinstance(obj, (Todo, Comment, Artifact)) and obj.project is not None:
+            projects.add(obj.project)
+        elif isinstance(obj, Project):
+            projects.add(obj)
+    for project in projects:
+        if project not in session.deleted and project not in session.new:
+            project.updated_at = now
+        if project.author is not None:
+            authors.add(project.author)
+    for author in authors:
+        author.updated_at = now
+
+
+# each app's own cache, sized from USER_CACHE_SIZE / USER_CACHE_TTL by create_app()
+user_cache = LocalProxy(lambda: current_app.extensions['user_cache'])
+
+
 @login.user_loader
 def load_user(id):
-    return User.query.get(int(id))
\ No newline at end of file
+    snapshot = user_cache.get(int(id))
+    if snapshot is not None:
+        return User.from_snapshot(snapshot)
+    user = User.query.get(int(id))
+    if user is not None:
+        user_cache.set(user.id, user.snapshot())
+    return user
\ No newline at end of file
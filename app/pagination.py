@@ -0,0 +1,53 @@
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from datetime import datetime
+from sqlalchemy import and_, or_
+
+CURSOR_DATE_FORMAT = '%Y-%m-%dT%H:%M:%S.%f'
+
+
+def encode_cursor(created_at, id):
+    raw = f'{created_at.strftime(CURSOR_DATE_FORMAT)}|{id}'
+    return urlsafe_b64encode(raw.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor):
+    """Turn a cursor from the query string back into a (created_at, id)
+    seek key. Malformed cursors are treated as "start from the top"."""
+    if not cursor:
+        return None
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        created_at, id = urlsafe_b64decode(padded).decode('utf-8').split('|')
+        return datetime.strptime(created_at, CURSOR_DATE_FORMAT), int(id)
+    except (ValueError, TypeError):
+        return None
+
+
+def seek_before(created_at_column, id_column, key):
+    """Filter for rows strictly after ``key`` in (created_at, id) DESC order."""
+    created_at, id = key
+    return or_(created_at_column < created_at,
+               and_(created_at_column == created_at, id_column < id))
+
+
+class KeysetPage(object):
+    def __init__(self, items, next_cursor):
+        self.items = items
+        self.next_cursor = next_cursor
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+
+def keyset_page(query, per_page):
+    """Fetch one page from a query already ordered by (created_at, id) DESC
+    and filtered past the previous cursor. One extra row is read to know
+    whether a next page exists, so no COUNT is ever issued."""
+    rows = query.limit(per_page + 1).all()
+    next_cursor = None
+    if len(rows) > per_page:
+        rows = rows[:per_page]
+        last = rows[-1]
+        next_cursor = encode_cursor(last.created_at, last.id)
+    return KeysetPage(rows, next_cursor)
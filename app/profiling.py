@@ -0,0 +1,185 @@
+import re
+from bisect import bisect_left
+from threading import Lock
+from time import perf_counter
+from flask import current_app, g, has_app_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# request latency buckets (seconds) for the Prometheus histogram
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def fingerprint(statement):
+    """Collapse literals and IN lists so the same query shape groups together."""
+    statement = re.sub(r"'(?:[^']|'')*'", '?', statement)
+    statement = re.sub(r'\b\d+(?:\.\d+)?\b', '?', statement)
+    statement = re.sub(r'\(\s*\?(?:\s*,\s*\?)*\s*\)', '(?)', statement)
+    return re.sub(r'\s+', ' ', statement).strip()
+
+
+class RequestStats(object):
+    def __init__(self, keep):
+        self.started = perf_counter()
+        self.queries = 0
+        self.db_time = 0.0
+        self.slowest = []
+        self.keep = keep
+
+    def record(self, statement, elapsed):
+        self.queries += 1
+        self.db_time += elapsed
+        if len(self.slowest) < self.keep or elapsed > self.slowest[-1][0]:
+            self.slowest.append((elapsed, statement))
+            self.slowest.sort(key=lambda item: item[0], reverse=True)
+            del self.slowest[self.keep:]
+
+
+class EndpointStats(object):
+    def __init__(self):
+        self.requests = 0
+        self.total_time = 0.0
+        self.db_time = 0.0
+        self.queries = 0
+        self.max_time = 0.0
+        self.max_queries = 0
+        self.buckets = [0] * len(BUCKETS)
+
+    def add(self, elapsed, stats):
+        self.requests += 1
+        self.total_time += elapsed
+        self.db_time += stats.db_time
+        self.queries += stats.queries
+        self.max_time = max(self.max_time, elapsed)
+        self.max_queries = max(self.max_queries, stats.queries)
+        index = bisect_left(BUCKETS, elapsed)
+        if index < len(BUCKETS):
+            self.buckets[index] += 1
+
+    def as_dict(self):
+        return {
+            'requests': self.requests,
+            'mean_ms': self.total_time / self.requests * 1000,
+            'max_ms': self.max_time * 1000,
+            'mean_db_ms': self.db_time / self.requests * 1000,
+            'mean_queries': self.queries / self.requests,
+            'max_queries': self.max_queries,
+        }
+
+
+class EndpointTable(object):
+    """The per-endpoint totals of one application."""
+
+    def __init__(self):
+        self.endpoints = {}
+        self.lock = Lock()
+
+
+class RequestProfiler(object):
+    """Counts and times every SQL statement a request runs, adds a
+    Server-Timing header, logs slow requests with their slowest query
+    shapes and keeps per-endpoint totals for /admin/stats. The engine
+    hooks are installed once per process; whether a request is profiled
+    is decided from its app's PROFILE_REQUESTS, and each app keeps its
+    totals in ``app.extensions['profiler']``."""
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.extensions['profiler'] = EndpointTable()
+        for name, hook in (('before_cursor_execute', self._before_execute),
+                           ('after_cursor_execute', self._after_execute)):
+            if not event.contains(Engine, name, hook):
+                event.listen(Engine, name, hook)
+        app.before_request(self._start)
+        app.after_request(self._finish)
+
+    @property
+    def enabled(self):
+        return current_app.config['PROFILE_REQUESTS']
+
+    @property
+    def table(self):
+        return current_app.extensions['profiler']
+
+    def _start(self):
+        if self.enabled:
+            g.profile = RequestStats(current_app.config['PROFILE_SLOWEST_QUERIES'])
+
+    @staticmethod
+    def _current():
+        return g.get('profile') if has_app_context() else None
+
+    def _before_execute(self, conn, cursor, statement, parameters, context, executemany):
+        if self._current() is not None:
+            conn.info.setdefault('query_started', []).append(perf_counter())
+
+    def _after_execute(self, conn, cursor, statement, parameters, context, executemany):
+        stats = self._current()
+        if stats is not None:
+            stats.record(statement, perf_counter() - conn.info['query_started'].pop())
+
+    def _finish(self, response):
+        stats = g.pop('profile', None)
+        if stats is None:
+            return response
+        elapsed = perf_counter() - stats.started
+        endpoint = request.endpoint or 'unknown'
+        table = self.table
+        with table.lock:
+            table.endpoints.setdefault(endpoint, EndpointStats()).add(elapsed, stats)
+        response.headers.add('Server-Timing',
+                             f'db;dur={stats.db_time * 1000:.1f};desc="{stats.queries} queries", '
+                             f'app;dur={elapsed * 1000:.1f}')
+        if elapsed >= current_app.config['SLOW_REQUEST_THRESHOLD'] / 1000:
+            slowest = '\n'.join(f'  {seconds * 1000:.1f}ms {fingerprint(statement)}'
+                                for seconds, statement in stats.slowest)
+            current_app.logger.warning(
+                f'Slow request {request.method} {request.path} ({endpoint}): '
+                f'{elapsed * 1000:.0f}ms, {stats.queries} queries, '
+                f'{stats.db_time * 1000:.0f}ms in the database\n{slowest}')
+        return response
+
+    def stats(self):
+        table = self.table
+        with table.lock:
+            return {endpoint: s.as_dict() for endpoint, s in sorted(table.endpoints.items())}
+
+    def reset(self):
+        table = self.table
+        with table.lock:
+            table.endpoints = {}
+
+    def prometheus(self):
+        """The per-endpoint totals in Prometheus text exposition format."""
+        lines = [
+            '# HELP projapp_request_duration_seconds Request latency by endpoint.',
+            '# TYPE projapp_request_duration_seconds histogram',
+        ]
+        table = self.table
+        with table.lock:
+            endpoints = sorted(table.endpoints.items())
+            for endpoint, s in endpoints:
+                cumulative = 0
+                for bound, count in zip(BUCKETS, s.buckets):
+                    cumulative += count
+                    lines.append(f'projapp_request_duration_seconds_bucket'
+                                 f'{{endpoint="{endpoint}",le="{bound}"}} {cumulative}')
+                lines.append(f'projapp_request_duration_seconds_bucket'
+                             f'{{endpoint="{endpoint}",le="+Inf"}} {s.requests}')
+                lines.append(f'projapp_request_duration_seconds_sum'
+                             f'{{endpoint="{endpoint}"}} {s.total_time}')
+                lines.append(f'projapp_request_duration_seconds_count'
+                             f'{{endpoint="{endpoint}"}} {s.requests}')
+            for name, kind, help, attr in (
+                    ('projapp_db_seconds_total', 'counter',
+                     'Time spent in SQL statements by endpoint.', 'db_time'),
+                    ('projapp_db_queries_total', 'counter',
+                     'SQL statements executed by endpoint.', 'queries')):
+                lines.append(f'# HELP {name} {help}')
+                lines.append(f'# TYPE {name} {kind}')
+                for endpoint, s in endpoints:
+                    lines.append(f'{name}{{endpoint="{endpoint}"}} {getattr(s, attr)}')
+        return '\n'.join(lines) + '\n'
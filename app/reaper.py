@@ -0,0 +1,108 @@
+import os
+from flask import current_app
+from app import db
+from app.models import Project, Comment, Todo, Artifact, Blob
+from app.search import INDEXED, doc_id, remove_documents
+from app.timeline import remove_projects
+from funcs import blob_path
+
+# removed in this order; the project row goes last, once nothing points at it
+CHILDREN = [('comment', Comment), ('todo', Todo), ('artifact', Artifact)]
+
+
+def reap_batch(project_id, batch_size):
+    """Remove up to ``batch_size`` rows of a deleted project in one short
+    transaction. Returns (table, rows removed), ('project', 1) once the
+    project row itself is gone, or None if there is nothing (left) to reap."""
+    buried = []
+    try:
+        with db.engine.begin() as conn:
+            result = reap_rows(conn, project_id, batch_size, buried)
+    except Exception:
+        # the blob rows are back, and so must be their files
+        for path, tomb in buried:
+            os.replace(tomb, path)
+        raise
+    for _, tomb in buried:
+        os.remove(tomb)
+    return result
+
+
+def reap_rows(conn, project_id, batch_size, buried):
+    # a no-op write: takes the project's lock first, so two reapers of
+    # the same project take turns instead of deleting the same rows
+    claimed = conn.execute(
+        Project.__table__.update()
+        .where(Project.id == project_id).where(Project.deleted_at != None)
+        .values(deleted_at=Project.deleted_at, updated_at=Project.updated_at)).rowcount
+    if not claimed:
+        return None
+    for table, model in CHILDREN:
+        columns = [model.id, model.file] if model is Artifact else [model.id]
+        rows = conn.execute(db.select(columns).where(model.project_id == project_id)
+                            .order_by(model.id).limit(batch_size)).fetchall()
+        if not rows:
+            continue
+        ids = [row[0] for row in rows]
+        kind = INDEXED[model][0]
+        remove_documents(conn, [doc_id(kind, id) for id in ids])
+        conn.execute(model.__table__.delete().where(model.id.in_(ids)))
+        if model is Artifact:
+            bury_files(release_blobs(conn, [row[1] for row in rows]), buried)
+        return table, len(ids)
+    remove_documents(conn, [doc_id(INDEXED[Project][0], project_id)])
+    remove_projects(conn, [project_id])
+    conn.execute(Project.__table__.delete().where(Project.id == project_id))
+    return 'project', 1
+
+
+def release_blobs(conn, digests):
+    """Drop one reference per artifact; returns the digests whose last
+    reference this was, after deleting their rows."""
+    counts = {}
+    for digest in digests:
+        counts[digest] = counts.get(digest, 0) + 1
+    conn.execute(Blob.__table__.update().where(Blob.sha256 == db.bindparam('digest'))
+                 .values(refcount=Blob.refcount - db.bindparam('n')),
+                 [{'digest': digest, 'n': n} for digest, n in counts.items()])
+    unreferenced = Blob.__table__.c.sha256.in_(list(counts)) & (Blob.refcount <= 0)
+    gone = [digest for digest, in conn.execute(db.select([Blob.sha256]).where(unreferenced))]
+    if gone:
+        conn.execute(Blob.__table__.delete().where(Blob.sha256.in_(gone)))
+    return gone
+
+
+def bury_files(digests, buried):
+    """Move the files of deleted blobs aside while their rows are still
+    locked. An upload of the same content waits on that lock and, once it
+    holds a new row, finds no file and writes it again (see Blob.acquire);
+    the moved files are removed after the commit, or put back on rollback."""
+    for digest in digests:
+        path = blob_path(digest)
+        tomb = path + '.reaped'
+        try:
+            os.replace(path, tomb)
+        except FileNotFoundError:
+            continue
+        buried.append((path, tomb))
+
+
+def reap_project(project_id):
+    """Delete a soft-deleted project's comments, todos and artifacts, then
+    the project. Submitted once as a background job, it loops over
+    REAPER_BATCH-sized batches, each its own transaction, so that no web
+    request ever waits on the write lock for long."""
+    batch_size = current_app.config['REAPER_BATCH']
+    removed = {}
+    while True:
+        result = reap_batch(project_id, batch_size)
+        if result is None:
+            return
+        table, count = result
+        removed[table] = removed.get(table, 0) + count
+        if table == 'project':
+            current_app.logger.info(f'Reaped project {project_id}: ' +
+                                    ', '.join(f'{n} {t}(s)' for t, n in removed.items()))
+            return
+        # progress for large projects, the same lines `flask projapp reap` prints
+        current_app.logger.info(f'Reaping project {project_id}: removed {count} {table} row(s)')
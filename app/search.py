@@ -0,0 +1,265 @@
+import os
+import re
+import zipfile
+from functools import lru_cache
+from xml.etree import ElementTree
+from flask import current_app
+from markupsafe import Markup, escape
+from sqlalchemy import event
+from app import db, tasks
+from app.models import Project, Comment, Todo, Artifact
+from funcs import blob_path
+
+# what gets indexed for each model: (kind code, title attribute, body attribute)
+INDEXED = {
+    Project: (1, 'title', 'body'),
+    Comment: (2, None, 'body'),
+    Todo: (3, 'task', None),
+    Artifact: (4, 'name', None),
+}
+KINDS = {code: model for model, (code, _, _) in INDEXED.items()}
+# todos and artifacts are only shown to the project's author
+PRIVATE_KINDS = (3, 4)
+MAX_EXTRACTED_TEXT = 1024 * 1024
+# snippet() highlights with control characters that cannot come from user
+# text, so the snippet can be escaped first and marked up afterwards
+MARK_START, MARK_END = '\x02', '\x03'
+
+FTS_DDL = ("CREATE VIRTUAL TABLE IF NOT EXISTS search_document USING fts5("
+           "title, body, kind UNINDEXED, project_id UNINDEXED, "
+           "tokenize='porter unicode61')")
+
+search_document = db.Table(
+    'search_document', db.MetaData(),
+    db.Column('rowid', db.Integer, primary_key=True, autoincrement=False),
+    db.Column('title', db.Text),
+    db.Column('body', db.Text),
+    db.Column('kind', db.Integer),
+    db.Column('project_id', db.Integer, index=True),
+)
+
+
+def doc_id(kind, ref_id):
+    # one row per object, addressable by rowid without scanning the index
+    return ref_id * 8 + kind
+
+
+def uses_fts(bind):
+    return bind.dialect.name == 'sqlite'
+
+
+def create_table(bind):
+    if uses_fts(bind):
+        bind.execute(FTS_DDL)
+    else:
+        search_document.create(bind, checkfirst=True)
+
+
+def drop_table(bind):
+    bind.execute('DROP TABLE IF EXISTS search_document')
+
+
+event.listen(db.Model.metadata, 'after_create',
+             lambda target, connection, **kw: create_table(connection))
+event.listen(db.Model.metadata, 'before_drop',
+             lambda target, connection, **kw: drop_table(connection))
+
+
+def document(obj):
+    kind, title, body = INDEXED[type(obj)]
+    project_id = obj.id if isinstance(obj, Project) else obj.project_id
+    return {'rowid': doc_id(kind, obj.id), 'kind': kind, 'project_id': project_id,
+            'title': getattr(obj, title) if title else None,
+            'body': getattr(obj, body) if body else None}
+
+
+def remove_documents(conn, ids):
+    if ids:
+        conn.execute(search_document.delete().where(
+            search_document.c.rowid.in_(ids)))
+
+
+def add_documents(conn, docs):
+    if docs:
+        remove_documents(conn, [doc['rowid'] for doc in docs])
+        conn.execute(search_document.insert(), docs)
+
+
+def changed(obj):
+    _, title, body = INDEXED[type(obj)]
+    state = db.inspect(obj)
+    return any(state.attrs[attr].history.has_changes()
+               for attr in (title, body) if attr)
+
+
+@event.listens_for(db.session, 'after_flush')
+def index_flushed_objects(session, flush_context):
+    """Keep the index in the same transaction as the rows it describes."""
+    docs, removed = [], []
+    for obj in session.new:
+        if type(obj) in INDEXED:
+            docs.append(document(obj))
+    for obj in session.dirty:
+        if type(obj) in INDEXED and changed(obj):
+            docs.append(document(obj))
+    for obj in session.deleted:
+        if type(obj) in INDEXED:
+            removed.append(doc_id(INDEXED[type(obj)][0], obj.id))
+    if not docs and not removed:
+        return
+    conn = session.connection()
+    remove_documents(conn, removed)
+    add_documents(conn, docs)
+    artifacts = [obj.id for obj in session.new if isinstance(obj, Artifact)]
+    if artifacts:
+        session.info.setdefault('extract_artifacts', []).extend(artifacts)
+
+
+@event.listens_for(db.session, 'after_commit')
+def queue_text_extraction(session):
+    for id in session.info.pop('extract_artifacts', []):
+        tasks.submit(index_artifact_text, id)
+
+
+@event.listens_for(db.session, 'after_rollback')
+def forget_text_extraction(session):
+    session.info.pop('extract_artifacts', None)
+
+
+def docx_text(path):
+    with zipfile.ZipFile(path) as docx:
+        xml = docx.read('word/document.xml')
+    paragraphs = []
+    for paragraph in ElementTree.fromstring(xml).iter(
+            '{http://schemas.openxmlformats.org/wordprocessingml/2006/main}p'):
+        paragraphs.append(''.join(node.text or '' for node in paragraph.iter(
+            '{http://schemas.openxmlformats.org/wordprocessingml/2006/main}t')))
+    return '\n'.join(paragraphs)
+
+
+@lru_cache(maxsize=None)
+def pdf_extractor():
+    """pdfminer.six's extract_text, or None (said once) when it is missing."""
+    try:
+        from pdfminer.high_level import extract_text
+    except ImportError:
+        current_app.logger.warning('pdfminer.six is not installed; PDFs are indexed by name only')
+        return None
+    return extract_text
+
+
+def pdf_text(path):
+    extract = pdf_extractor()
+    return extract(path) if extract is not None else ''
+
+
+def extract_text(path, filename):
+    extension = os.path.splitext(filename or '')[1].lower()
+    try:
+        if extension == '.docx':
+            return docx_text(path)[:MAX_EXTRACTED_TEXT]
+        if extension == '.pdf':
+            return pdf_text(path)[:MAX_EXTRACTED_TEXT]
+    except Exception:
+        current_app.logger.exception(f'Could not extract text from {filename}')
+    return ''
+
+
+def index_artifact_text(id):
+    # runs outside any request, possibly from an after_commit hook, so it
+    # talks to the engine directly instead of borrowing the session
+    with db.engine.connect() as conn:
+        row = conn.execute(db.select([Artifact.file, Artifact.filename])
+                           .where(Artifact.id == id)).fetchone()
+    if row is None:
+        return
+    text = extract_text(blob_path(row.file), row.filename)
+    if text:
+        with db.engine.begin() as conn:
+            conn.execute(search_document.update()
+                         .where(search_document.c.rowid == doc_id(4, id))
+                         .values(body=text))
+
+
+def fts_query(text):
+    """Quote every word so user input can never be FTS5 syntax; the last
+    word also matches as a prefix for search-as-you-type."""
+    words = re.findall(r'\w+', text)
+    if not words:
+        return None
+    terms = [f'"{word}"' for word in words]
+    terms[-1] += '*'
+    return ' '.join(terms)
+
+
+class SearchHit(object):
+    def __init__(self, kind, ref_id, project, title, snippet):
+        self.kind = kind
+        self.ref_id = ref_id
+        self.project = project
+        self.title = title
+        self.snippet = Markup(str(escape(snippet or '')).replace(
+            MARK_START, '<mark>').replace(MARK_END, '</mark>'))
+
+    @property
+    def kind_name(self):
+        return KINDS[self.kind].__name__.lower()
+
+
+def search(text, user, page=1, per_page=20):
+    """Ranked hits for ``text``, plus whether another page exists."""
+    if uses_fts(db.engine):
+        match = fts_query(text)
+        if match is None:
+            return [], False
+        rows = db.session.execute(
+            'SELECT rowid, kind, project_id, title, '
+            ' snippet(search_document, 1, :mark_start, :mark_end, \'…\', 16) '
+            'FROM search_document WHERE search_document MATCH :match '
+            ' AND (kind NOT IN (3, 4) OR project_id IN '
+            '  (SELECT id FROM project WHERE user_id = :user_id)) '
+            'ORDER BY rank LIMIT :limit OFFSET :offset',
+            {'match': match, 'user_id': user.id,
+             'mark_start': MARK_START, 'mark_end': MARK_END,
+             'limit': per_page + 1, 'offset': (page - 1) * per_page}).fetchall()
+    else:
+        pattern = f'%{text.strip()}%'
+        s = search_document.c
+        own_projects = db.select([Project.id]).where(Project.user_id == user.id)
+        rows = db.session.execute(
+            db.select([s.rowid, s.kind, s.project_id, s.title, db.func.substr(s.body, 1, 200)])
+            .where(db.or_(s.title.ilike(pattern), s.body.ilike(pattern)))
+            .where(db.or_(s.kind.notin_(PRIVATE_KINDS), s.project_id.in_(own_projects)))
+            .order_by(s.rowid.desc())
+            .limit(per_page + 1).offset((page - 1) * per_page)).fetchall()
+    has_next = len(rows) > per_page
+    rows = rows[:per_page]
+    projects = {p.id: p for p in Project.live().options(db.joinedload(Project.author))
+                .filter(Project.id.in_({row[2] for row in rows}))}
+    hits = [SearchHit(kind, rowid // 8, projects[project_id], title, snippet)
+            for rowid, kind, project_id, title, snippet in rows
+            if project_id in projects]
+    return hits, has_next
+
+
+def reindex(batch_size=1000):
+    """Rebuild the whole index from the database; returns documents written."""
+    total = 0
+    with db.engine.begin() as conn:
+        conn.execute(search_document.delete())
+    for model in INDEXED:
+        batch = []
+        for obj in model.query.order_by(model.id).yield_per(batch_size):
+            batch.append(document(obj))
+            if len(batch) == batch_size:
+                with db.engine.begin() as conn:
+                    conn.execute(search_document.insert(), batch)
+                total += len(batch)
+                batch = []
+        if batch:
+            with db.engine.begin() as conn:
+                conn.execute(search_document.insert(), batch)
+            total += len(batch)
+    for (id,) in db.session.query(Artifact.id).order_by(Artifact.id):
+        tasks.submit(index_artifact_text, id)
+    return total
@@ -0,0 +1,77 @@
+from queue import Queue
+from threading import Lock, Thread
+from flask import current_app
+
+
+class JobQueue(object):
+    """The queue and worker threads of one application."""
+
+    def __init__(self, app, db):
+        self.app = app
+        self.db = db
+        self.threads = app.config['BACKGROUND_WORKERS']
+        self.sync = app.config['BACKGROUND_JOBS_SYNC']
+        self._queue = Queue()
+        self._threads = []
+        self._lock = Lock()
+
+    def submit(self, fn, *args, **kwargs):
+        if self.sync:
+            fn(*args, **kwargs)
+            return
+        self._start()
+        self._queue.put((fn, args, kwargs))
+
+    def join(self):
+        self._queue.join()
+
+    def _start(self):
+        with self._lock:
+            self._threads = [t for t in self._threads if t.is_alive()]
+            while len(self._threads) < self.threads:
+                thread = Thread(target=self._run, daemon=True,
+                                name=f'background-{len(self._threads)}')
+                thread.start()
+                self._threads.append(thread)
+
+    def _run(self):
+        while True:
+            fn, args, kwargs = self._queue.get()
+            try:
+                with self.app.app_context():
+                    try:
+                        fn(*args, **kwargs)
+                    finally:
+                        self.db.session.remove()
+            except Exception:
+                self.app.logger.exception(f'Background job {fn.__name__} failed')
+            finally:
+                self._queue.task_done()
+
+
+class BackgroundWorker(object):
+    """A fixed pool of daemon threads running jobs inside an application
+    context, for work that must not hold up the request that caused it.
+    With BACKGROUND_JOBS_SYNC set, jobs run inline instead (tests, CLI).
+    Every app gets its own queue in ``app.extensions['tasks']``; jobs go
+    to the queue of the current app."""
+
+    def __init__(self, app=None, db=None):
+        self.db = db
+        if app is not None:
+            self.init_app(app, db)
+
+    def init_app(self, app, db=None):
+        self.db = db or self.db
+        app.extensions['tasks'] = JobQueue(app, self.db)
+
+    @property
+    def queue(self):
+        return current_app.extensions['tasks']
+
+    def submit(self, fn, *args, **kwargs):
+        self.queue.submit(fn, *args, **kwargs)
+
+    def join(self):
+        """Block until every job submitted so far has finished."""
+        self.queue.join()
@@ -0,0 +1,108 @@
+from sqlalchemy import event
+from sqlalchemy.exc import IntegrityError
+from flask import current_app
+from app import db, tasks
+from app.models import User, Project, followers, timeline
+
+
+@event.listens_for(db.session, 'after_flush')
+def publish_flushed_projects(session, flush_context):
+    """Authors see their own project at once; everyone else gets it from
+    a fan-out job once the transaction has committed."""
+    new = [obj for obj in session.new if isinstance(obj, Project)]
+    deleted = [obj.id for obj in session.deleted if isinstance(obj, Project)]
+    if not new and not deleted:
+        return
+    conn = session.connection()
+    if deleted:
+        remove_projects(conn, deleted)
+    if new:
+        conn.execute(timeline.insert(), [
+            {'user_id': p.user_id, 'created_at': p.created_at,
+             'project_id': p.id, 'author_id': p.user_id} for p in new if p.user_id])
+        session.info.setdefault('fan_out', []).extend(p.id for p in new if p.user_id)
+
+
+@event.listens_for(db.session, 'after_commit')
+def queue_fan_out(session):
+    for id in session.info.pop('fan_out', []):
+        tasks.submit(fan_out, id)
+
+
+@event.listens_for(db.session, 'after_rollback')
+def forget_fan_out(session):
+    session.info.pop('fan_out', None)
+
+
+def remove_projects(conn, ids):
+    conn.execute(timeline.delete().where(timeline.c.project_id.in_(ids)))
+
+
+def fan_out(project_id, after=0):
+    """Copy a project into its author's followers' timelines, one batch of
+    TIMELINE_FANOUT_BATCH followers per job. Like the other background
+    jobs it talks to the engine directly, as it may run from a commit hook."""
+    batch_size = current_app.config['TIMELINE_FANOUT_BATCH']
+    with db.engine.connect() as conn:
+        project = conn.execute(db.select([Project.id, Project.user_id, Project.created_at])
+                               .where(Project.id == project_id)
+                               .where(Project.deleted_at == None)).fetchone()
+        if project is None:
+            return
+        author_followers = conn.execute(db.select([User.follower_count])
+                                        .where(User.id == project.user_id)).scalar()
+        if (author_followers or 0) >= current_app.config['TIMELINE_FANOUT_LIMIT']:
+            return
+        batch = [id for id, in conn.execute(
+            db.select([followers.c.follower_id])
+            .where(followers.c.followed_id == project.user_id)
+            .where(followers.c.follower_id > after)
+            .order_by(followers.c.follower_id).limit(batch_size))]
+    if not batch:
+        return
+    rows = db.select([followers.c.follower_id, db.literal(project.created_at),
+                      db.literal(project.id), db.literal(project.user_id)]) \
+        .where(followers.c.followed_id == project.user_id) \
+        .where(followers.c.follower_id.in_(batch)) \
+        .where(~db.exists().where(db.and_(timeline.c.user_id == followers.c.follower_id,
+                                          timeline.c.project_id == project.id)))
+    insert = timeline.insert().from_select(
+        ['user_id', 'created_at', 'project_id', 'author_id'], rows)
+    try:
+        with db.engine.begin() as conn:
+            conn.execute(insert)
+    except IntegrityError:
+        # a follow backfilled some of these rows at the same moment; the
+        # NOT EXISTS guard skips them on the second try
+        with db.engine.begin() as conn:
+            conn.execute(insert)
+    if len(batch) == batch_size:
+        tasks.submit(fan_out, project_id, batch[-1])
+
+
+def rebuild(batch_size=1000):
+    """Regenerate every timeline from the follow graph; returns rows written."""
+    limit = current_app.config['TIMELINE_FANOUT_LIMIT']
+    with db.engine.begin() as conn:
+        conn.execute(timeline.delete())
+    total, last = 0, 0
+    columns = ['user_id', 'created_at', 'project_id', 'author_id']
+    while True:
+        with db.engine.begin() as conn:
+            ids = [id for id, in conn.execute(
+                db.select([Project.id]).where(Project.id > last)
+                .where(Project.deleted_at == None).order_by(Project.id).limit(batch_size))]
+            if not ids:
+                return total
+            own = db.select([Project.user_id, Project.created_at, Project.id,
+                             Project.user_id.label('author_id')]) \
+                .where(Project.id.in_(ids)).where(Project.user_id != None)
+            fanned = db.select([followers.c.follower_id, Project.created_at,
+                                Project.id, Project.user_id]) \
+                .select_from(Project.__table__
+                             .join(followers, followers.c.followed_id == Project.user_id)
+                             .join(User.__table__, User.id == Project.user_id)) \
+                .where(Project.id.in_(ids)).where(User.follower_count < limit)
+            total += conn.execute(timeline.insert().from_select(columns, own)).rowcount
+            total += conn.execute(timeline.insert().from_select(columns, fanned)).rowcount
+        last = ids[-1]
@@ -0,0 +1,112 @@
+"""Follow-graph lookups on the legacy heap table vs. the keyed table.
+
+Builds a synthetic graph with a skewed (power-law-ish) followed side at
+several sizes and times the three queries that dominate profile and feed
+pages: the is_following probe, the follower count and the feed join.
+
+    python -m benchmarks.followers --edges 10000 100000 1000000
+"""
+import argparse
+import random
+import sqlite3
+from time import perf_counter
+from sqlalchemy.dialects import sqlite
+from sqlalchemy.schema import CreateIndex, CreateTable
+
+from app.models import followers
+
+LEGACY_DDL = ['CREATE TABLE followers (follower_id INTEGER, followed_id INTEGER)']
+
+QUERIES = {
+    # what is_following() used to run and what it runs now
+    'is_following (COUNT)': 'SELECT count(*) FROM followers '
+                            'WHERE follower_id = ? AND followed_id = ?',
+    'is_following (EXISTS)': 'SELECT EXISTS (SELECT 1 FROM followers '
+                             'WHERE follower_id = ? AND followed_id = ?)',
+    'follower count': 'SELECT count(*) FROM followers WHERE followed_id = ?',
+    'feed join': 'SELECT count(*) FROM project JOIN followers '
+                 'ON followers.followed_id = project.user_id '
+                 'WHERE followers.follower_id = ?',
+}
+
+
+def keyed_ddl():
+    dialect = sqlite.dialect()
+    ddl = [str(CreateTable(followers).compile(dialect=dialect))]
+    ddl += [str(CreateIndex(index).compile(dialect=dialect))
+            for index in followers.indexes]
+    return ddl
+
+
+def synthetic_edges(n_edges, seed=0):
+    rng = random.Random(seed)
+    n_users = max(n_edges // 20, 100)
+    edges = set()
+    while len(edges) < n_edges:
+        follower = rng.randint(1, n_users)
+        # Pareto-distributed target: a few users attract most followers
+        followed = min(int(rng.paretovariate(1.2)), n_users)
+        if follower != followed:
+            edges.add((follower, followed))
+    return n_users, list(edges)
+
+
+def build(ddl, n_users, edges):
+    conn = sqlite3.connect(':memory:')
+    for statement in ddl:
+        conn.execute(statement)
+    conn.execute('CREATE TABLE project (id INTEGER PRIMARY KEY, user_id INTEGER)')
+    conn.execute('CREATE INDEX ix_project_user ON project (user_id)')
+    conn.executemany('INSERT INTO followers VALUES (?, ?)', edges)
+    conn.executemany('INSERT INTO project (user_id) VALUES (?)',
+                     [((i % n_users) + 1,) for i in range(n_users * 2)])
+    conn.commit()
+    return conn
+
+
+def time_query(conn, sql, params, repeat):
+    start = perf_counter()
+    for args in params[:repeat]:
+        conn.execute(sql, args).fetchone()
+    return (perf_counter() - start) / repeat * 1e6
+
+
+def run(sizes, repeat):
+    results = []
+    for n_edges in sizes:
+        n_users, edges = synthetic_edges(n_edges)
+        rng = random.Random(1)
+        probes = [rng.choice(edges) for _ in range(repeat)]
+        for layout, ddl in (('legacy', LEGACY_DDL), ('keyed', keyed_ddl())):
+            conn = build(ddl, n_users, edges)
+            for name, sql in QUERIES.items():
+                if name.endswith('(COUNT)') and layout == 'keyed':
+                    continue
+                if name.endswith('(EXISTS)') and layout == 'legacy':
+                    continue
+                if name == 'follower count':
+                    params = [(followed,) for _, followed in probes]
+                elif name == 'feed join':
+                    params = [(follower,) for follower, _ in probes]
+                else:
+                    params = probes
+                results.append((n_edges, layout, name,
+                                time_query(conn, sql, params, repeat)))
+            conn.close()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--edges', type=int, nargs='+',
+                        default=[10000, 100000, 1000000])
+    parser.add_argument('--repeat', type=int, default=50,
+                        help='queries timed per measurement')
+    args = parser.parse_args()
+    print(f'{"edges":>9}  {"layout":<7} {"query":<22} {"us/query":>10}')
+    for n_edges, layout, name, micros in run(args.edges, args.repeat):
+        print(f'{n_edges:>9}  {layout:<7} {name:<22} {micros:>10.1f}')
+
+
+if __name__ == '__main__':
+    main()
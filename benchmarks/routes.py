@@ -0,0 +1,285 @@
+"""Latency and query counts for the main web routes on a synthetic dataset.
+
+Seeds a fresh database with users, a power-law follow graph, projects,
+todos, comments and artifacts, then drives the routes through the Flask
+test client as a handful of logged-in users and writes p50/p95/p99
+latency and SQL query counts per route to a JSON report. Reports from two
+commits can be compared to catch regressions:
+
+    python -m benchmarks.routes --users 2000 --output before.json
+    python -m benchmarks.routes --users 2000 --compare before.json
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+from collections import defaultdict
+from datetime import datetime, timedelta
+from time import perf_counter
+
+ROUTES = ['index', 'explore', 'user', 'view_project', 'follow', 'update_todos']
+PASSWORD = 'benchmark'
+
+
+def configure(database):
+    """Point the app at a throwaway database; must run before importing it."""
+    workdir = tempfile.mkdtemp(prefix='projapp-bench-')
+    os.environ['DATABASE_URL'] = database or \
+        'sqlite:///' + os.path.join(workdir, 'bench.db')
+    os.environ.setdefault('BLOB_FOLDER', os.path.join(workdir, 'blobs'))
+    os.environ.setdefault('MAIL_QUEUE_PATH', os.path.join(workdir, 'mail_queue.db'))
+    os.environ.setdefault('BACKGROUND_JOBS_SYNC', '1')
+
+
+def follow_edges(rng, n_users, per_user):
+    # everyone follows about the same number of people, but who they follow
+    # is Pareto-distributed, so a few users end up with most of the followers
+    edges = set()
+    for follower in range(1, n_users + 1):
+        for _ in range(rng.randint(0, per_user * 2)):
+            followed = min(int(rng.paretovariate(1.2)), n_users)
+            if followed != follower:
+                edges.add((follower, followed))
+    return sorted(edges)
+
+
+def seed(args):
+    """Fill the database and return the number of rows written per table."""
+    from app import db
+    from app.models import User, Project, Todo, Comment, Artifact, Blob, followers
+    from funcs import store_blob
+    from io import BytesIO
+
+    rng = random.Random(args.seed)
+    now = datetime.utcnow()
+    db.drop_all()
+    db.create_all()
+    # hashing is deliberately slow; one hash shared by everyone keeps seeding fast
+    password_hash = User(username='', email='')
+    password_hash.set_password(PASSWORD)
+    password_hash = password_hash.password_hash
+
+    edges = follow_edges(rng, args.users, args.follows)
+    follower_count, following_count = defaultdict(int), defaultdict(int)
+    for follower, followed in edges:
+        following_count[follower] += 1
+        follower_count[followed] += 1
+    db.session.bulk_insert_mappings(User, [
+        {'id': i, 'username': f'user{i}', 'email': f'user{i}@example.com',
+         'password_hash': password_hash, 'about_me': f'Synthetic user {i}',
+         'follower_count': follower_count[i], 'following_count': following_count[i],
+         'created_at': now, 'last_seen': now}
+        for i in range(1, args.users + 1)])
+    db.session.execute(followers.insert(), [
+        {'follower_id': a, 'followed_id': b} for a, b in edges])
+
+    blobs = [store_blob(BytesIO(os.urandom(rng.randint(1024, 64 * 1024))))
+             for _ in range(20)]
+    db.session.bulk_insert_mappings(Blob, [
+        {'sha256': digest, 'size': size, 'refcount': 0, 'created_at': now}
+        for digest, size in blobs])
+
+    projects, todos, comments, artifacts = [], [], [], []
+    refcount = defaultdict(int)
+    project_id = todo_id = 0
+    for user_id in range(1, args.users + 1):
+        for _ in range(rng.randint(0, args.projects * 2)):
+            project_id += 1
+            created = now - timedelta(minutes=rng.randint(0, 60 * 24 * 365))
+            open_todos = 0
+            for t in range(rng.randint(0, args.todos * 2)):
+                todo_id += 1
+                done = rng.random() < 0.5
+                open_todos += not done
+                todos.append({'id': todo_id, 'task': f'Task {t} of project {project_id}',
+                              'is_done': done, 'project_id': project_id,
+                              'edate': created, 'created_at': created})
+            n_comments = rng.randint(0, args.comments * 2)
+            for c in range(n_comments):
+                comments.append({'body': f'Comment {c} on project {project_id}',
+                                 'user_id': rng.randint(1, args.users),
+                                 'project_id': project_id, 'created_at': created})
+            for a in range(rng.randint(0, args.artifacts * 2)):
+                digest, _ = rng.choice(blobs)
+                refcount[digest] += 1
+                artifacts.append({'name': f'Artifact {a}', 'file': digest,
+                                  'filename': f'artifact-{a}.bin',
+                                  'project_id': project_id, 'created_at': created})
+            projects.append({'id': project_id, 'title': f'Project {project_id}',
+                             'body': f'Synthetic project {project_id} ' * 8,
+                             'status': rng.randint(0, 2), 'user_id': user_id,
+                             'sdate': created, 'edate': created, 'created_at': created,
+                             'comment_count': n_comments, 'open_todo_count': open_todos})
+    for model, rows in ((Project, projects), (Todo, todos),
+                        (Comment, comments), (Artifact, artifacts)):
+        for start in range(0, len(rows), 5000):
+            db.session.bulk_insert_mappings(model, rows[start:start + 5000])
+    db.session.bulk_update_mappings(Blob, [
+        {'sha256': digest, 'refcount': count} for digest, count in refcount.items()])
+    db.session.commit()
+    # bulk inserts skip the session hooks that fan projects out
+    from app.timeline import rebuild
+    rebuild()
+    return {'users': args.users, 'followers': len(edges), 'projects': len(projects),
+            'todos': len(todos), 'comments': len(comments), 'artifacts': len(artifacts)}
+
+
+class QueryCounter(object):
+    def __init__(self, engine):
+        from sqlalchemy import event
+        self.count = 0
+        event.listen(engine, 'before_cursor_execute', self)
+
+    def __call__(self, *args):
+        self.count += 1
+
+
+def request_paths(rng, viewer, counts):
+    """Yield (route, path) pairs for one viewer, forever."""
+    users, projects, todos = counts['users'], counts['projects'], counts['todos']
+    next_followed = iter(rng.sample(range(1, users + 1), users))
+    while True:
+        route = rng.choice(ROUTES)
+        if route == 'index':
+            yield route, '/index'
+        elif route == 'explore':
+            yield route, '/explore'
+        elif route == 'user':
+            yield route, f'/user/user{rng.randint(1, users)}'
+        elif route == 'view_project' and projects:
+            yield route, f'/projects/{rng.randint(1, projects)}'
+        elif route == 'follow':
+            target = next(next_followed, None)
+            if target is not None and target != viewer:
+                yield route, f'/follow/user{target}'
+        elif route == 'update_todos' and todos:
+            yield route, f'/todos/{rng.randint(1, todos)}'
+
+
+def drive(app, counts, args):
+    from app import db
+
+    app.config['WTF_CSRF_ENABLED'] = False
+    rng = random.Random(args.seed + 1)
+    queries = QueryCounter(db.engine)
+    clients = []
+    for viewer in rng.sample(range(1, counts['users'] + 1), min(args.viewers, counts['users'])):
+        client = app.test_client()
+        client.post('/login', data={'username': f'user{viewer}', 'password': PASSWORD})
+        clients.append((client, request_paths(rng, viewer, counts)))
+
+    samples = defaultdict(lambda: {'ms': [], 'queries': []})
+    for i in range(args.warmup + args.requests):
+        client, paths = clients[i % len(clients)]
+        route, path = next(paths)
+        before = queries.count
+        started = perf_counter()
+        response = client.get(path)
+        elapsed = (perf_counter() - started) * 1000
+        if response.status_code >= 400:
+            raise RuntimeError(f'GET {path} returned {response.status_code}')
+        if i >= args.warmup:
+            samples[route]['ms'].append(elapsed)
+            samples[route]['queries'].append(queries.count - before)
+    return samples
+
+
+def summarize(samples):
+    report = {}
+    for route in ROUTES:
+        ms, qs = samples[route]['ms'], samples[route]['queries']
+        if len(ms) < 2:
+            continue
+        cuts = statistics.quantiles(ms, n=100, method='inclusive')
+        report[route] = {'requests': len(ms), 'p50_ms': round(cuts[49], 3),
+                         'p95_ms': round(cuts[94], 3), 'p99_ms': round(cuts[98], 3),
+                         'mean_ms': round(statistics.mean(ms), 3),
+                         'queries_median': statistics.median(qs), 'queries_max': max(qs)}
+    return report
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'],
+                                       stderr=subprocess.DEVNULL, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(old, new, tolerance):
+    """Print per-route deltas; return the routes that got slower or chattier."""
+    print(f'{"route":<14} {"p95 before":>11} {"p95 after":>10} {"change":>8}  queries')
+    regressions = []
+    for route, after in new['routes'].items():
+        before = old['routes'].get(route)
+        if before is None:
+            continue
+        change = (after['p95_ms'] - before['p95_ms']) / before['p95_ms'] * 100
+        slower = change > tolerance
+        chattier = after['queries_median'] > before['queries_median']
+        if slower or chattier:
+            regressions.append(route)
+        print(f'{route:<14} {before["p95_ms"]:>11.2f} {after["p95_ms"]:>10.2f} '
+              f'{change:>+7.1f}%  {before["queries_median"]:g} -> {after["queries_median"]:g}'
+              f'{"  <-- regression" if slower or chattier else ""}')
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--follows', type=int, default=20,
+                        help='average people followed per user')
+    parser.add_argument('--projects', type=int, default=5, help='average per user')
+    parser.add_argument('--todos', type=int, default=5, help='average per project')
+    parser.add_argument('--comments', type=int, default=5, help='average per project')
+    parser.add_argument('--artifacts', type=int, default=1, help='average per project')
+    parser.add_argument('--viewers', type=int, default=5,
+                        help='logged-in users issuing requests')
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--warmup', type=int, default=200)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--database', help='SQLAlchemy URL (default: temp SQLite file)')
+    parser.add_argument('--output', default='benchmark-routes.json')
+    parser.add_argument('--compare', metavar='REPORT',
+                        help='earlier report to diff against; exits 1 on regressions')
+    parser.add_argument('--tolerance', type=float, default=10.0,
+                        help='allowed p95 slowdown in percent when comparing')
+    args = parser.parse_args()
+
+    configure(args.database)
+    from app import create_app
+    app = create_app()
+    with app.app_context():
+        started = perf_counter()
+        counts = seed(args)
+        print(f'Seeded {counts} in {perf_counter() - started:.1f}s')
+        samples = drive(app, counts, args)
+
+    report = {'revision': git_revision(), 'python': platform.python_version(),
+              'created_at': datetime.utcnow().isoformat(), 'dataset': counts,
+              'settings': {k: v for k, v in vars(args).items()
+                           if k not in ('output', 'compare', 'tolerance', 'database')},
+              'routes': summarize(samples)}
+    with open(args.output, 'w') as out:
+        json.dump(report, out, indent=2)
+    print(f'{"route":<14} {"n":>5} {"p50 ms":>8} {"p95 ms":>8} {"p99 ms":>8} {"queries":>8}')
+    for route, stats in report['routes'].items():
+        print(f'{route:<14} {stats["requests"]:>5} {stats["p50_ms"]:>8.2f} '
+              f'{stats["p95_ms"]:>8.2f} {stats["p99_ms"]:>8.2f} {stats["queries_median"]:>8g}')
+    print(f'Report written to {args.output}')
+
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(json.load(f), report, args.tolerance)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
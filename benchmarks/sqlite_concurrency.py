@@ -0,0 +1,102 @@
+"""Concurrent read/write throughput on SQLite, default vs. tuned engine.
+
+Runs reader and writer threads against a file database for a fixed time,
+once with the engine Flask-SQLAlchemy used to build (NullPool, rollback
+journal) and once with the options from config.engine_options() plus the
+pragmas from app/database.py, and reports operations per second and
+"database is locked" failures.
+
+    python -m benchmarks.sqlite_concurrency --readers 8 --writers 2 --seconds 5
+"""
+import argparse
+import os
+import random
+import tempfile
+import threading
+from time import perf_counter
+from sqlalchemy import create_engine
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.pool import NullPool
+
+from config import Config, engine_options
+from app.database import use_sqlite_pragmas
+
+SCHEMA = ['CREATE TABLE project (id INTEGER PRIMARY KEY, user_id INTEGER, '
+          'title TEXT, body TEXT, comment_count INTEGER DEFAULT 0)',
+          'CREATE INDEX ix_project_user ON project (user_id)']
+
+
+def make_engine(path, tuned):
+    uri = 'sqlite:///' + path
+    if not tuned:
+        return create_engine(uri, poolclass=NullPool)
+    engine = create_engine(uri, **engine_options(uri))
+    use_sqlite_pragmas(engine, vars(Config))
+    return engine
+
+
+def populate(path, rows):
+    engine = create_engine('sqlite:///' + path, poolclass=NullPool)
+    with engine.begin() as conn:
+        for statement in SCHEMA:
+            conn.execute(statement)
+        conn.execute('INSERT INTO project (user_id, title, body) VALUES (?, ?, ?)',
+                     [(i % 500, f'project {i}', 'x' * 200) for i in range(rows)])
+    engine.dispose()
+
+
+def worker(engine, write, rows, deadline, results, seed):
+    rng = random.Random(seed)
+    done = errors = 0
+    while perf_counter() < deadline:
+        try:
+            if write:
+                with engine.begin() as conn:
+                    conn.execute('UPDATE project SET comment_count = comment_count + 1 '
+                                 'WHERE id = ?', rng.randint(1, rows))
+            else:
+                with engine.connect() as conn:
+                    conn.execute('SELECT id, title FROM project WHERE user_id = ? '
+                                 'ORDER BY id DESC LIMIT 20', rng.randint(0, 499)).fetchall()
+            done += 1
+        except OperationalError:
+            errors += 1
+    results.append((write, done, errors))
+
+
+def run(tuned, args):
+    directory = tempfile.mkdtemp(prefix='projapp-sqlite-')
+    path = os.path.join(directory, 'bench.db')
+    populate(path, args.rows)
+    engine = make_engine(path, tuned)
+    results = []
+    deadline = perf_counter() + args.seconds
+    threads = [threading.Thread(target=worker, args=(
+        engine, i < args.writers, args.rows, deadline, results, i))
+        for i in range(args.writers + args.readers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    engine.dispose()
+    reads = sum(done for write, done, _ in results if not write)
+    writes = sum(done for write, done, _ in results if write)
+    errors = sum(failed for _, _, failed in results)
+    return reads / args.seconds, writes / args.seconds, errors
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--readers', type=int, default=8)
+    parser.add_argument('--writers', type=int, default=2)
+    parser.add_argument('--seconds', type=float, default=5)
+    parser.add_argument('--rows', type=int, default=20000)
+    args = parser.parse_args()
+    print(f'{"engine":<8} {"reads/s":>10} {"writes/s":>10} {"locked":>7}')
+    for name, tuned in (('default', False), ('tuned', True)):
+        reads, writes, errors = run(tuned, args)
+        print(f'{name:<8} {reads:>10,.0f} {writes:>10,.0f} {errors:>7}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,155 @@
+"""Cold-start cost: import time, app creation and time to first response.
+
+Every sample runs in a fresh interpreter, the way a pre-fork server spawns
+workers and every `flask` CLI call starts: it imports the app package,
+calls create_app() and serves GET /login through the test client. The
+report has the median of each phase over --runs processes, the slowest
+top-level imports according to `python -X importtime`, and the wall time
+of a `flask projapp --help` call. Reports can be compared like those of
+benchmarks.routes:
+
+    python -m benchmarks.startup --output before.json
+    python -m benchmarks.startup --compare before.json
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+from datetime import datetime
+from time import perf_counter
+
+from benchmarks.routes import git_revision
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# runs in the child; prints the phases in milliseconds as JSON
+CHILD = '''
+import json
+from time import perf_counter
+started = perf_counter()
+from app import create_app
+imported = perf_counter()
+app = create_app()
+created = perf_counter()
+response = app.test_client().get('/login')
+assert response.status_code == 200, response.status_code
+served = perf_counter()
+print(json.dumps({'import_ms': (imported - started) * 1000,
+                  'create_app_ms': (created - imported) * 1000,
+                  'first_response_ms': (served - created) * 1000}))
+'''
+
+
+def environment():
+    workdir = tempfile.mkdtemp(prefix='projapp-startup-')
+    return dict(os.environ, FLASK_APP='projapp.py',
+                DATABASE_URL='sqlite:///' + os.path.join(workdir, 'startup.db'),
+                BLOB_FOLDER=os.path.join(workdir, 'blobs'),
+                MAIL_QUEUE_PATH=os.path.join(workdir, 'mail_queue.db'),
+                LOG_FILE=os.path.join(workdir, 'logs', 'projapp.log'))
+
+
+def sample(env):
+    """One cold start; the phases plus the wall time of the whole process."""
+    started = perf_counter()
+    out = subprocess.check_output([sys.executable, '-c', CHILD], cwd=ROOT, env=env,
+                                  stderr=subprocess.DEVNULL, text=True)
+    phases = json.loads(out.strip().splitlines()[-1])
+    phases['process_ms'] = (perf_counter() - started) * 1000
+    return phases
+
+
+def cli_sample(env):
+    started = perf_counter()
+    subprocess.check_call([sys.executable, '-m', 'flask', 'projapp', '--help'],
+                          cwd=ROOT, env=env, stdout=subprocess.DEVNULL,
+                          stderr=subprocess.DEVNULL)
+    return (perf_counter() - started) * 1000
+
+
+def slowest_imports(env, top):
+    """The modules the app package and create_app() import directly, by
+    cumulative import time (ms) as reported by `python -X importtime`."""
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', 'from app import create_app; create_app()'],
+        cwd=ROOT, env=env, capture_output=True, text=True, check=True)
+    modules, nested = [], []
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        # one space after the bar, then two per level of nesting
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        entry = (int(cumulative) / 1000, name.strip())
+        # a module is listed after everything it imported
+        if depth == 2:
+            nested.append(entry)
+        elif depth == 1:
+            modules.extend(nested if entry[1] == 'app' else [entry])
+            nested = []
+    total = sum(ms for ms, _ in modules)
+    modules.sort(reverse=True)
+    return {name: round(ms, 1) for ms, name in modules[:top]}, round(total, 1)
+
+
+def compare(old, new, tolerance):
+    """Print per-phase deltas; return the phases that got slower."""
+    print(f'{"phase":<18} {"before":>8} {"after":>8} {"change":>8}')
+    regressions = []
+    for phase, after in new['phases'].items():
+        before = old['phases'].get(phase)
+        if not before:
+            continue
+        change = (after - before) / before * 100
+        if change > tolerance:
+            regressions.append(phase)
+        print(f'{phase:<18} {before:>8.1f} {after:>8.1f} {change:>+7.1f}%'
+              f'{"  <-- regression" if change > tolerance else ""}')
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--runs', type=int, default=7)
+    parser.add_argument('--top', type=int, default=15,
+                        help='slowest top-level imports to report')
+    parser.add_argument('--output', default='benchmark-startup.json')
+    parser.add_argument('--compare', metavar='REPORT',
+                        help='earlier report to diff against; exits 1 on regressions')
+    parser.add_argument('--tolerance', type=float, default=10.0,
+                        help='allowed slowdown in percent when comparing')
+    args = parser.parse_args()
+
+    env = environment()
+    sample(env)  # let the first run write the bytecode caches
+    samples = [sample(env) for _ in range(args.runs)]
+    phases = {phase: round(statistics.median(s[phase] for s in samples), 1)
+              for phase in samples[0]}
+    phases['cli_help_ms'] = round(statistics.median(cli_sample(env) for _ in range(args.runs)), 1)
+    imports, import_total = slowest_imports(env, args.top)
+
+    report = {'revision': git_revision(), 'python': platform.python_version(),
+              'created_at': datetime.utcnow().isoformat(), 'runs': args.runs,
+              'phases': phases, 'import_total_ms': import_total, 'slowest_imports': imports}
+    with open(args.output, 'w') as out:
+        json.dump(report, out, indent=2)
+    for phase, ms in phases.items():
+        print(f'{phase:<18} {ms:>8.1f} ms')
+    print(f'\n{"import (-X importtime)":<32} {"ms":>8}')
+    for name, ms in imports.items():
+        print(f'{name:<32} {ms:>8.1f}')
+    print(f'Report written to {args.output}')
+
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(json.load(f), report, args.tolerance)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
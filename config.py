@@ -3,11 +3,48 @@ import os
 basedir = os.path.abspath(os.path.dirname(__file__))
 skey = 'Jkiy061QVDfLcCu9VS0sYRjGWljaBSG-MFNAktGSwy2J9ThNUOcm9BtmVDrOXk92n4LS59WZuUSHQAlT6e3R_w'
 
+
+def engine_options(uri):
+    """SQLAlchemy create_engine() options for the configured database."""
+    if uri.startswith('sqlite'):
+        if uri in ('sqlite://', 'sqlite:///:memory:'):
+            return {}
+        # keep connections open between requests instead of the NullPool
+        # SQLAlchemy picks for SQLite files; the pool hands a connection to
+        # one thread at a time, so the same-thread check can go
+        from sqlalchemy.pool import QueuePool
+        return {
+            'poolclass': QueuePool,
+            'pool_size': int(os.environ.get('DATABASE_POOL_SIZE') or 10),
+            'max_overflow': int(os.environ.get('DATABASE_MAX_OVERFLOW') or 20),
+            'connect_args': {'check_same_thread': False,
+                             'timeout': int(os.environ.get('SQLITE_BUSY_TIMEOUT') or 5000) / 1000},
+        }
+    return {
+        'pool_size': int(os.environ.get('DATABASE_POOL_SIZE') or 10),
+        'max_overflow': int(os.environ.get('DATABASE_MAX_OVERFLOW') or 20),
+        'pool_timeout': int(os.environ.get('DATABASE_POOL_TIMEOUT') or 30),
+        # drop connections before the server (or a proxy) times them out
+        'pool_recycle': int(os.environ.get('DATABASE_POOL_RECYCLE') or 1800),
+        'pool_pre_ping': True,
+    }
+
+
 class Config(object):
     SECRET_KEY = os.environ.get('SECRET_KEY') or skey
     SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL') or \
         'sqlite:///' + os.path.join(basedir, 'app.db')
     SQLALCHEMY_TRACK_MODIFICATIONS = False
+    SQLALCHEMY_ENGINE_OPTIONS = engine_options(SQLALCHEMY_DATABASE_URI)
+    # comma separated; reads from GET requests are spread over these
+    SQLALCHEMY_REPLICA_URIS = [uri for uri in
+                               (os.environ.get('DATABASE_REPLICA_URLS') or '').split(',') if uri]
+    # applied to every new SQLite connection, see app/database.py
+    SQLITE_JOURNAL_MODE = os.environ.get('SQLITE_JOURNAL_MODE') or 'WAL'
+    SQLITE_SYNCHRONOUS = os.environ.get('SQLITE_SYNCHRONOUS') or 'NORMAL'
+    SQLITE_BUSY_TIMEOUT = int(os.environ.get('SQLITE_BUSY_TIMEOUT') or 5000)  # ms
+    SQLITE_MMAP_SIZE = int(os.environ.get('SQLITE_MMAP_SIZE') or 256 * 1024 * 1024)
+    SQLITE_CACHE_SIZE = int(os.environ.get('SQLITE_CACHE_SIZE') or 64 * 1024)  # KiB
     # email config
     MAIL_SERVER = os.environ.get('MAIL_SERVER')
     MAIL_PORT = int(os.environ.get('MAIL_PORT') or 25)
@@ -15,8 +52,83 @@ class Config(object):
     MAIL_USERNAME = os.environ.get('MAIL_USERNAME')
     MAIL_PASSWORD = os.environ.get('MAIL_PASSWORD')
     ADMINS = ['superuser-or-admin-email@example.com']
+    # logging: 'json' or 'text' lines, rotated at LOG_MAX_BYTES; the same
+    # error is emailed at most once per LOG_MAIL_INTERVAL seconds, and at
+    # most LOG_MAIL_LIMIT error emails go out per interval
+    LOG_FILE = os.environ.get('LOG_FILE') or os.path.join('logs', 'projapp.log')
+    LOG_FORMAT = os.environ.get('LOG_FORMAT') or 'json'
+    LOG_MAX_BYTES = int(os.environ.get('LOG_MAX_BYTES') or 10 * 1024 * 1024)
+    LOG_BACKUP_COUNT = int(os.environ.get('LOG_BACKUP_COUNT') or 10)
+    LOG_MAIL_INTERVAL = int(os.environ.get('LOG_MAIL_INTERVAL') or 600)
+    LOG_MAIL_LIMIT = int(os.environ.get('LOG_MAIL_LIMIT') or 10)
+    # one access record per request, with status and latency
+    LOG_REQUESTS = os.environ.get('LOG_REQUESTS') is not None
+    # outgoing mail is spooled here and delivered by a small worker pool
+    MAIL_QUEUE_PATH = os.environ.get('MAIL_QUEUE_PATH') or \
+        os.path.join(basedir, 'mail_queue.db')
+    MAIL_WORKERS = int(os.environ.get('MAIL_WORKERS') or 2)
+    MAIL_BATCH_SIZE = int(os.environ.get('MAIL_BATCH_SIZE') or 20)
+    MAIL_MAX_ATTEMPTS = int(os.environ.get('MAIL_MAX_ATTEMPTS') or 5)
+    MAIL_RETRY_BACKOFF = int(os.environ.get('MAIL_RETRY_BACKOFF') or 30)
 
     # file storage
     UPLOAD_FOLDER = basedir + '/app/static/docs'
+    # uploads live here content-addressed, outside the public static tree
+    BLOB_FOLDER = os.environ.get('BLOB_FOLDER') or os.path.join(basedir, 'blobs')
+    # let the front-end server stream downloads once Flask has checked access:
+    # None, 'x-sendfile' (Apache/lighttpd) or 'x-accel-redirect' (nginx)
+    ARTIFACT_SENDFILE = os.environ.get('ARTIFACT_SENDFILE')
+    # nginx 'internal' location that maps onto BLOB_FOLDER
+    ARTIFACT_ACCEL_PREFIX = os.environ.get('ARTIFACT_ACCEL_PREFIX') or '/_blobs/'
+    ARTIFACT_CACHE_TIMEOUT = int(os.environ.get('ARTIFACT_CACHE_TIMEOUT') or 3600)
     ALLOWED_EXTENSIONS = {'doc', 'docx', 'pdf'}
-    MAX_CONTENT_LENGTH  = 16 * 1024 * 1024
\ No newline at end of file
+    MAX_CONTENT_LENGTH  = 16 * 1024 * 1024
+
+    # record a user's last_seen at most once per granularity, written in bulk
+    LAST_SEEN_GRANULARITY = int(os.environ.get('LAST_SEEN_GRANULARITY') or 300)
+    LAST_SEEN_FLUSH_INTERVAL = int(os.environ.get('LAST_SEEN_FLUSH_INTERVAL') or 60)
+
+    # flask-login identity cache; entries are dropped on profile changes
+    USER_CACHE_SIZE = int(os.environ.get('USER_CACHE_SIZE') or 1024)
+    USER_CACHE_TTL = int(os.environ.get('USER_CACHE_TTL') or 60)
+
+    # rendered project cards; 'memory' is per process, 'file' is shared by
+    # every worker on the host
+    FRAGMENT_CACHE_BACKEND = os.environ.get('FRAGMENT_CACHE_BACKEND') or 'memory'
+    FRAGMENT_CACHE_SIZE = int(os.environ.get('FRAGMENT_CACHE_SIZE') or 4096)
+    FRAGMENT_CACHE_DIR = os.environ.get('FRAGMENT_CACHE_DIR') or \
+        os.path.join(basedir, 'cache', 'fragments')
+
+    # background jobs (artifact text extraction, ...); sync runs them inline
+    BACKGROUND_WORKERS = int(os.environ.get('BACKGROUND_WORKERS') or 2)
+    BACKGROUND_JOBS_SYNC = os.environ.get('BACKGROUND_JOBS_SYNC') is not None
+
+    # per-request SQL profiling: Server-Timing headers, slow request log
+    # and per-endpoint stats at /admin/stats (admins only)
+    PROFILE_REQUESTS = os.environ.get('PROFILE_REQUESTS') is not None
+    SLOW_REQUEST_THRESHOLD = int(os.environ.get('SLOW_REQUEST_THRESHOLD') or 500)  # ms
+    PROFILE_SLOWEST_QUERIES = int(os.environ.get('PROFILE_SLOWEST_QUERIES') or 5)
+
+    # home feed: projects are copied into each follower's timeline when
+    # published, except for authors with at least TIMELINE_FANOUT_LIMIT
+    # followers, whose projects are merged in when the feed is read
+    TIMELINE_FANOUT_LIMIT = int(os.environ.get('TIMELINE_FANOUT_LIMIT') or 5000)
+    TIMELINE_FANOUT_BATCH = int(os.environ.get('TIMELINE_FANOUT_BATCH') or 1000)
+    # how many of an author's recent projects a new follower gets
+    TIMELINE_BACKFILL = int(os.environ.get('TIMELINE_BACKFILL') or 200)
+
+    # rows a deleted project's reaper removes per transaction, so the
+    # write lock is only ever held for one short batch
+    REAPER_BATCH = int(os.environ.get('REAPER_BATCH') or 1000)
+
+    # pagination
+    PROJECTS_PER_PAGE = int(os.environ.get('PROJECTS_PER_PAGE') or 20)
+    # flush list pages to the client while they are still rendering
+    STREAM_TEMPLATES = os.environ.get('STREAM_TEMPLATES') is not None
+    SEARCH_RESULTS_PER_PAGE = int(os.environ.get('SEARCH_RESULTS_PER_PAGE') or 20)
+    # change to invalidate every page ETag at once (e.g. on deploy)
+    PAGE_ETAG_SALT = os.environ.get('PAGE_ETAG_SALT') or ''
+    # JSON API (/api/v1): largest page a client may ask for with ?limit=
+    API_MAX_PAGE_SIZE = int(os.environ.get('API_MAX_PAGE_SIZE') or 100)
+    # lifetime of the bearer tokens machine clients get from /api/v1/tokens
+    API_TOKEN_EXPIRES = int(os.environ.get('API_TOKEN_EXPIRES') or 3600)  # s
\ No newline at end of file
@@ -1,16 +1,91 @@
-import os, binascii
-from config import Config
+import os, tempfile
+from hashlib import sha256
+from flask import Request, current_app
 from werkzeug.utils import secure_filename
 
+CHUNK_SIZE = 64 * 1024
+
 def allowed_file(filename):
     return '.' in filename and \
-        filename.rsplit('.', 1)[1].lower() in Config.ALLOWED_EXTENSIONS
+        filename.rsplit('.', 1)[1].lower() in current_app.config['ALLOWED_EXTENSIONS']
+
+def blob_path(digest):
+    return os.path.join(current_app.config['BLOB_FOLDER'], digest[:2], digest[2:4], digest)
+
+
+class HashingFile(object):
+    """Upload sink handed to Werkzeug's form parser: the body is written
+    straight to a temp file inside the blob store and hashed on the way,
+    so keeping it later is a rename rather than another copy. The temp
+    file is removed on close unless it was promoted to a blob."""
+
+    def __init__(self, directory):
+        os.makedirs(directory, exist_ok=True)
+        fd, self.name = tempfile.mkstemp(dir=directory, prefix='.upload-')
+        self._file = os.fdopen(fd, 'w+b')
+        self._sha = sha256()
+        self.size = 0
+        self.kept = False
+
+    def write(self, data):
+        self._sha.update(data)
+        self.size += len(data)
+        return self._file.write(data)
+
+    def hexdigest(self):
+        return self._sha.hexdigest()
+
+    def keep(self, path):
+        self._file.close()
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        os.replace(self.name, path)
+        self.kept = True
+
+    def close(self):
+        self._file.close()
+        if not self.kept and os.path.exists(self.name):
+            os.remove(self.name)
+
+    def __getattr__(self, name):
+        return getattr(self._file, name)
+
+    def __iter__(self):
+        return iter(self._file)
+
+
+class UploadRequest(Request):
+    def _get_file_stream(self, total_content_length, content_type,
+                         filename=None, content_length=None):
+        return HashingFile(current_app.config['BLOB_FOLDER'])
+
+
+def receive_blob(stream):
+    """Hash an upload into a temp file inside the blob store. The returned
+    HashingFile is put in place by keep_blob() once its Blob row is held."""
+    if not isinstance(stream, HashingFile):
+        sink = HashingFile(current_app.config['BLOB_FOLDER'])
+        for chunk in iter(lambda: stream.read(CHUNK_SIZE), b''):
+            sink.write(chunk)
+        stream = sink
+    stream.flush()
+    return stream
+
+def keep_blob(stream):
+    """Move a received upload to its content address; returns (sha256, size).
+    Identical content is only ever stored once."""
+    digest = stream.hexdigest()
+    path = blob_path(digest)
+    try:
+        if not os.path.exists(path):
+            stream.keep(path)
+    finally:
+        stream.close()
+    return digest, stream.size
+
+def store_blob(stream):
+    """Move an upload into content-addressed storage; returns (sha256, size)."""
+    return keep_blob(receive_blob(stream))
 
 def save_file(file):
     if file and allowed_file(file.filename):
-        random_hex = binascii.b2a_hex(os.urandom(8))
-        filename = secure_filename(file.filename)
-        _, f_ext = os.path.splitext(filename)
-        filename = str(random_hex)+ os.path.splitext(filename)[0] + str(f_ext)
-        file.save(os.path.join(Config.UPLOAD_FOLDER, filename))
-        return filename
+        return receive_blob(file.stream), secure_filename(file.filename)
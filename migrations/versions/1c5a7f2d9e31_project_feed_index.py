@@ -0,0 +1,29 @@
+"""project feed index
+
+Revision ID: 1c5a7f2d9e31
+Revises: fd3321e5217b
+Create Date: 2026-10-18 09:12:40.118204
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '1c5a7f2d9e31'
+down_revision = 'fd3321e5217b'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # rows created before the timestamp mixin have no created_at; give them
+    # one so they have a stable position in (created_at, id) keyset order
+    op.execute('UPDATE project SET created_at = COALESCE(sdate, CURRENT_TIMESTAMP) '
+               'WHERE created_at IS NULL')
+    op.create_index('ix_project_user_created', 'project',
+                    ['user_id', 'created_at', 'id'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_project_user_created', table_name='project')
@@ -0,0 +1,24 @@
+"""project created index
+
+Revision ID: 5e0b3d8a47c2
+Revises: 1c5a7f2d9e31
+Create Date: 2026-10-18 10:02:17.530911
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5e0b3d8a47c2'
+down_revision = '1c5a7f2d9e31'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index('ix_project_created', 'project', ['created_at', 'id'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_project_created', table_name='project')
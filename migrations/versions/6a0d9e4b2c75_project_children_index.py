@@ -0,0 +1,27 @@
+"""project children index
+
+Revision ID: 6a0d9e4b2c75
+Revises: 7b3e5f0c9a12
+Create Date: 2026-10-18 23:05:41.218734
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '6a0d9e4b2c75'
+down_revision = '7b3e5f0c9a12'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    for table in ('todo', 'comment', 'artifact'):
+        op.create_index(f'ix_{table}_project_created', table,
+                        ['project_id', 'created_at', 'id'], unique=False)
+
+
+def downgrade():
+    for table in ('todo', 'comment', 'artifact'):
+        op.drop_index(f'ix_{table}_project_created', table_name=table)
@@ -0,0 +1,27 @@
+"""project soft delete
+
+Revision ID: 7b3e5f0c9a12
+Revises: d4a7c2e9b613
+Create Date: 2026-10-18 21:12:44.530192
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '7b3e5f0c9a12'
+down_revision = 'd4a7c2e9b613'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('project', sa.Column('deleted_at', sa.DateTime(), nullable=True))
+    op.create_index(op.f('ix_project_deleted_at'), 'project', ['deleted_at'], unique=False)
+
+
+def downgrade():
+    op.drop_index(op.f('ix_project_deleted_at'), table_name='project')
+    with op.batch_alter_table('project') as batch_op:
+        batch_op.drop_column('deleted_at')
@@ -0,0 +1,41 @@
+"""denormalized counters
+
+Revision ID: 8d2f6c1b0a94
+Revises: 5e0b3d8a47c2
+Create Date: 2026-10-18 11:24:05.406712
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8d2f6c1b0a94'
+down_revision = '5e0b3d8a47c2'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('user', sa.Column('follower_count', sa.Integer(), server_default='0', nullable=False))
+    op.add_column('user', sa.Column('following_count', sa.Integer(), server_default='0', nullable=False))
+    op.add_column('project', sa.Column('comment_count', sa.Integer(), server_default='0', nullable=False))
+    op.add_column('project', sa.Column('open_todo_count', sa.Integer(), server_default='0', nullable=False))
+
+    # backfill; `flask projapp counters` runs the same recount on demand
+    op.execute('UPDATE "user" SET '
+               'follower_count = (SELECT count(*) FROM followers WHERE followers.followed_id = "user".id), '
+               'following_count = (SELECT count(*) FROM followers WHERE followers.follower_id = "user".id)')
+    op.execute('UPDATE project SET '
+               'comment_count = (SELECT count(*) FROM comment WHERE comment.project_id = project.id), '
+               'open_todo_count = (SELECT count(*) FROM todo WHERE todo.project_id = project.id '
+               'AND (todo.is_done IS NULL OR NOT todo.is_done))')
+
+
+def downgrade():
+    with op.batch_alter_table('project') as batch_op:
+        batch_op.drop_column('open_todo_count')
+        batch_op.drop_column('comment_count')
+    with op.batch_alter_table('user') as batch_op:
+        batch_op.drop_column('following_count')
+        batch_op.drop_column('follower_count')
@@ -0,0 +1,54 @@
+"""followers primary key
+
+Revision ID: a3e91b7c5d60
+Revises: 8d2f6c1b0a94
+Create Date: 2026-10-18 12:40:51.227390
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a3e91b7c5d60'
+down_revision = '8d2f6c1b0a94'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # SQLite can't add a primary key in place, so copy the distinct edges
+    # into a new table and swap it in. Duplicate and half-empty rows go.
+    op.create_table('_followers_new',
+    sa.Column('follower_id', sa.Integer(), nullable=False),
+    sa.Column('followed_id', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['followed_id'], ['user.id'], ),
+    sa.ForeignKeyConstraint(['follower_id'], ['user.id'], ),
+    sa.PrimaryKeyConstraint('follower_id', 'followed_id')
+    )
+    op.execute('INSERT INTO _followers_new (follower_id, followed_id) '
+               'SELECT DISTINCT follower_id, followed_id FROM followers '
+               'WHERE follower_id IS NOT NULL AND followed_id IS NOT NULL')
+    op.drop_table('followers')
+    op.rename_table('_followers_new', 'followers')
+    op.create_index('ix_followers_followed_follower', 'followers',
+                    ['followed_id', 'follower_id'], unique=False)
+
+    # duplicates were counted twice by the counter backfill
+    op.execute('UPDATE "user" SET '
+               'follower_count = (SELECT count(*) FROM followers WHERE followers.followed_id = "user".id), '
+               'following_count = (SELECT count(*) FROM followers WHERE followers.follower_id = "user".id)')
+
+
+def downgrade():
+    op.drop_index('ix_followers_followed_follower', table_name='followers')
+    op.create_table('_followers_old',
+    sa.Column('follower_id', sa.Integer(), nullable=True),
+    sa.Column('followed_id', sa.Integer(), nullable=True),
+    sa.ForeignKeyConstraint(['followed_id'], ['user.id'], ),
+    sa.ForeignKeyConstraint(['follower_id'], ['user.id'], )
+    )
+    op.execute('INSERT INTO _followers_old (follower_id, followed_id) '
+               'SELECT follower_id, followed_id FROM followers')
+    op.drop_table('followers')
+    op.rename_table('_followers_old', 'followers')
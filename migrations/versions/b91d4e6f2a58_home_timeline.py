@@ -0,0 +1,46 @@
+"""home timeline
+
+Revision ID: b91d4e6f2a58
+Revises: f2c6a4e81b37
+Create Date: 2026-10-18 19:20:12.504117
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b91d4e6f2a58'
+down_revision = 'f2c6a4e81b37'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('timeline',
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('created_at', sa.DateTime(), nullable=False),
+    sa.Column('project_id', sa.Integer(), nullable=False),
+    sa.Column('author_id', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['author_id'], ['user.id'], ),
+    sa.ForeignKeyConstraint(['project_id'], ['project.id'], ),
+    sa.ForeignKeyConstraint(['user_id'], ['user.id'], ),
+    sa.PrimaryKeyConstraint('user_id', 'created_at', 'project_id')
+    )
+    op.create_index('ix_timeline_user_author', 'timeline', ['user_id', 'author_id'], unique=False)
+    op.create_index('ix_timeline_project', 'timeline', ['project_id'], unique=False)
+    # every existing project goes to its author and all of their followers;
+    # run `flask projapp timeline` afterwards to apply the fan-out limit
+    op.execute('INSERT INTO timeline (user_id, created_at, project_id, author_id) '
+               'SELECT user_id, created_at, id, user_id FROM project '
+               'WHERE user_id IS NOT NULL AND created_at IS NOT NULL')
+    op.execute('INSERT INTO timeline (user_id, created_at, project_id, author_id) '
+               'SELECT followers.follower_id, project.created_at, project.id, project.user_id '
+               'FROM project JOIN followers ON followers.followed_id = project.user_id '
+               'WHERE project.created_at IS NOT NULL AND followers.follower_id != project.user_id')
+
+
+def downgrade():
+    op.drop_index('ix_timeline_project', table_name='timeline')
+    op.drop_index('ix_timeline_user_author', table_name='timeline')
+    op.drop_table('timeline')
@@ -0,0 +1,46 @@
+"""user email hash
+
+Revision ID: c47e2a9f13b8
+Revises: a3e91b7c5d60
+Create Date: 2026-10-18 13:51:32.664018
+
+"""
+from hashlib import md5
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c47e2a9f13b8'
+down_revision = 'a3e91b7c5d60'
+branch_labels = None
+depends_on = None
+
+BATCH_SIZE = 1000
+
+
+def upgrade():
+    op.add_column('user', sa.Column('email_hash', sa.String(length=32), nullable=True))
+
+    conn = op.get_bind()
+    user = sa.table('user', sa.column('id', sa.Integer), sa.column('email', sa.String),
+                    sa.column('email_hash', sa.String))
+    update = user.update().where(user.c.id == sa.bindparam('user_id')) \
+        .values(email_hash=sa.bindparam('digest'))
+    last_id = 0
+    while True:
+        rows = conn.execute(sa.select([user.c.id, user.c.email])
+                            .where(user.c.id > last_id)
+                            .order_by(user.c.id).limit(BATCH_SIZE)).fetchall()
+        if not rows:
+            break
+        params = [{'user_id': id, 'digest': md5(email.lower().encode('utf-8')).hexdigest()}
+                  for id, email in rows if email]
+        if params:
+            conn.execute(update, params)
+        last_id = rows[-1][0]
+
+
+def downgrade():
+    with op.batch_alter_table('user') as batch_op:
+        batch_op.drop_column('email_hash')
@@ -0,0 +1,24 @@
+"""user updated_at index
+
+Revision ID: d4a7c2e9b613
+Revises: b91d4e6f2a58
+Create Date: 2026-10-18 19:41:07.218664
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd4a7c2e9b613'
+down_revision = 'b91d4e6f2a58'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index('ix_user_updated_at', 'user', ['updated_at'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_user_updated_at', table_name='user')
@@ -0,0 +1,96 @@
+"""content addressed blobs
+
+Revision ID: e5b8d03a7f21
+Revises: c47e2a9f13b8
+Create Date: 2026-10-18 14:36:09.870153
+
+"""
+import os
+import re
+from hashlib import sha256
+from alembic import op
+import sqlalchemy as sa
+from flask import current_app
+
+
+# revision identifiers, used by Alembic.
+revision = 'e5b8d03a7f21'
+down_revision = 'c47e2a9f13b8'
+branch_labels = None
+depends_on = None
+
+CHUNK_SIZE = 64 * 1024
+# legacy names were str(random_hex) + secure_filename, i.e. "b'0123456789abcdef'name.pdf"
+LEGACY_PREFIX = re.compile(r"^b'[0-9a-f]{16}'")
+DIGEST = re.compile(r'^[0-9a-f]{64}$')
+
+
+def move_into_store(path, blob_folder):
+    digest, size = sha256(), 0
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+            digest.update(chunk)
+            size += len(chunk)
+    digest = digest.hexdigest()
+    target = os.path.join(blob_folder, digest[:2], digest[2:4], digest)
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    if os.path.exists(target):
+        os.remove(path)
+    else:
+        os.replace(path, target)
+    return digest, size
+
+
+def upgrade():
+    op.create_table('blob',
+    sa.Column('created_at', sa.DateTime(), nullable=True),
+    sa.Column('updated_at', sa.DateTime(), nullable=True),
+    sa.Column('sha256', sa.String(length=64), nullable=False),
+    sa.Column('size', sa.Integer(), nullable=False),
+    sa.Column('refcount', sa.Integer(), server_default='0', nullable=False),
+    sa.PrimaryKeyConstraint('sha256')
+    )
+    op.add_column('artifact', sa.Column('filename', sa.String(length=140), nullable=True))
+
+    # move every existing upload into the blob store and point its artifact at it
+    conn = op.get_bind()
+    upload_folder = current_app.config['UPLOAD_FOLDER']
+    blob_folder = current_app.config['BLOB_FOLDER']
+    artifact = sa.table('artifact', sa.column('id', sa.Integer), sa.column('file', sa.String),
+                        sa.column('filename', sa.String))
+    blob = sa.table('blob', sa.column('sha256', sa.String), sa.column('size', sa.Integer),
+                    sa.column('refcount', sa.Integer))
+    refs, moved = {}, {}
+    for id, file in conn.execute(sa.select([artifact.c.id, artifact.c.file])).fetchall():
+        path = os.path.join(upload_folder, file)
+        stored = os.path.join(blob_folder, file[:2], file[2:4], file)
+        if file in moved:
+            digest, size = moved[file]
+        elif DIGEST.match(file) and os.path.exists(stored):
+            # already moved by an earlier upgrade that was downgraded again
+            digest, size = file, os.path.getsize(stored)
+        elif os.path.exists(path):
+            digest, size = moved[file] = move_into_store(path, blob_folder)
+        else:
+            # the upload is already gone; keep the row, pointing at empty content
+            digest, size = sha256().hexdigest(), 0
+        refs.setdefault(digest, [size, 0])[1] += 1
+        conn.execute(artifact.update().where(artifact.c.id == id).values(
+            file=digest, filename=None if digest == file else LEGACY_PREFIX.sub('', file)))
+    if refs:
+        conn.execute(blob.insert(), [{'sha256': digest, 'size': size, 'refcount': count}
+                                     for digest, (size, count) in refs.items()])
+
+    with op.batch_alter_table('artifact') as batch_op:
+        batch_op.alter_column('file', existing_type=sa.String(length=60),
+                              type_=sa.String(length=64), existing_nullable=False)
+        batch_op.create_foreign_key('fk_artifact_file_blob', 'blob', ['file'], ['sha256'])
+
+
+def downgrade():
+    # not data-reversible: blobs stay in BLOB_FOLDER and artifacts keep
+    # referencing them by hash, so the wider file column stays as well
+    with op.batch_alter_table('artifact') as batch_op:
+        batch_op.drop_constraint('fk_artifact_file_blob', type_='foreignkey')
+        batch_op.drop_column('filename')
+    op.drop_table('blob')
@@ -0,0 +1,39 @@
+"""search index
+
+Revision ID: f2c6a4e81b37
+Revises: e5b8d03a7f21
+Create Date: 2026-10-18 15:58:44.301562
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f2c6a4e81b37'
+down_revision = 'e5b8d03a7f21'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    if op.get_bind().dialect.name == 'sqlite':
+        op.execute("CREATE VIRTUAL TABLE search_document USING fts5("
+                   "title, body, kind UNINDEXED, project_id UNINDEXED, "
+                   "tokenize='porter unicode61')")
+    else:
+        op.create_table('search_document',
+        sa.Column('rowid', sa.Integer(), autoincrement=False, nullable=False),
+        sa.Column('title', sa.Text(), nullable=True),
+        sa.Column('body', sa.Text(), nullable=True),
+        sa.Column('kind', sa.Integer(), nullable=True),
+        sa.Column('project_id', sa.Integer(), nullable=True),
+        sa.PrimaryKeyConstraint('rowid')
+        )
+        op.create_index(op.f('ix_search_document_project_id'), 'search_document',
+                        ['project_id'], unique=False)
+    # fill it with `flask projapp reindex`
+
+
+def downgrade():
+    op.drop_table('search_document')
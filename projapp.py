@@ -1,6 +1,9 @@
-from app import app, db
-from app.models import User, Project
+from app import create_app, db, cli
+from app.models import User, Project, user_cache
+
+app = create_app()
+cli.register(app)
 
 @app.shell_context_processor
 def make_shell_context():
-    return {'db':db, 'User': User, 'Project': Project}
\ No newline at end of file
+    return {'db':db, 'User': User, 'Project': Project, 'user_cache': user_cache}
@@ -0,0 +1,1225 @@
+import os
+import tempfile
+os.environ['DATABASE_URL'] = 'sqlite://'
+os.environ['MAIL_QUEUE_PATH'] = os.path.join(tempfile.mkdtemp(), 'mail_queue.db')
+os.environ['BLOB_FOLDER'] = tempfile.mkdtemp()
+os.environ['BACKGROUND_JOBS_SYNC'] = '1'
+os.environ['PROFILE_REQUESTS'] = '1'
+
+from datetime import datetime, timedelta
+from hashlib import md5
+from base64 import b64encode
+from io import BytesIO
+import re
+import socketserver
+import threading
+import time
+import unittest
+import zipfile
+from flask import Flask
+from sqlalchemy import event
+from sqlalchemy.exc import IntegrityError
+from flask_mail import Message
+from app import cli, create_app, db, fragment_cache, last_seen, profiler, tasks
+from app.activity import LastSeenTracker
+from app.cache import FileCache, FragmentCache
+from app.cli import EXPORT_TABLES, table_of
+from app.email import MailSpool
+from app.profiling import RequestProfiler, fingerprint
+from app.log import ContextQueueHandler, DedupSMTPHandler, JSONFormatter, \
+    RequestContextFilter, setup_logging
+from app.search import search, search_document
+from app.reaper import reap_batch, reap_project
+from app.timeline import fan_out, rebuild, remove_projects
+from app.models import User, Project, Comment, Todo, Artifact, Blob, load_user, user_cache, \
+    followers, timeline
+from funcs import blob_path, keep_blob, receive_blob, store_blob
+from app.pagination import decode_cursor, keyset_page
+from config import Config
+
+
+class TestConfig(Config):
+    TESTING = True
+
+
+app = create_app(TestConfig)
+cli.register(app)
+
+
+def probe_app(**config):
+    """A bare app for exercising an extension without rebinding the
+    module-level ones, which stay on ``app``."""
+    probe = Flask('probe')
+    probe.config.from_object(TestConfig)
+    probe.config.update(config)
+    return probe
+
+
+class UserModelCase(unittest.TestCase):
+    def setUp(self):
+        self.app_context = app.app_context()
+        self.app_context.push()
+        db.create_all()
+        user_cache.clear()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def test_follow_projects_keyset(self):
+        u1 = User(username='john', email='john@example.com')
+        u2 = User(username='susan', email='susan@example.com')
+        u3 = User(username='mary', email='mary@example.com')
+        db.session.add_all([u1, u2, u3])
+        now = datetime.utcnow()
+        # identical timestamps on purpose: the id breaks the tie
+        projects = [Project(title=f'project {i}', author=[u1, u2, u3][i % 3],
+                            created_at=now - timedelta(seconds=i // 2))
+                    for i in range(9)]
+        db.session.add_all(projects)
+        u1.follow(u2)
+        db.session.commit()
+
+        expected = [p for p in sorted(projects, key=lambda p: (p.created_at, p.id),
+                                      reverse=True) if p.author != u3]
+        seen, after = [], None
+        while True:
+            page = keyset_page(u1.followed_projects(after), 2)
+            seen.extend(page.items)
+            if not page.has_next:
+                break
+            after = decode_cursor(page.next_cursor)
+        self.assertEqual(seen, expected)
+        self.assertEqual(u1.followed_projects().all(), expected)
+
+    def test_counters(self):
+        u1 = User(username='john', email='john@example.com')
+        u2 = User(username='susan', email='susan@example.com')
+        project = Project(title='project', author=u2)
+        db.session.add_all([u1, u2, project])
+        db.session.commit()
+        u1.follow(u2)
+        u1.follow(u2)
+        project.add_comment(Comment(body='hello', user=u1))
+        project.add_todo(Todo(task='open'))
+        project.add_todo(Todo(task='done', is_done=True))
+        db.session.commit()
+        self.assertEqual((u1.following_count, u1.follower_count), (1, 0))
+        self.assertEqual((u2.following_count, u2.follower_count), (0, 1))
+        self.assertEqual(project.comment_count, 1)
+        self.assertEqual(project.open_todo_count, 1)
+
+        project.todos.filter_by(task='open').first().toggle()
+        u1.unfollow(u2)
+        db.session.commit()
+        self.assertEqual(project.open_todo_count, 0)
+        self.assertEqual((u1.following_count, u2.follower_count), (0, 0))
+
+    def test_avatar_uses_the_stored_digest(self):
+        app.config['WTF_CSRF_ENABLED'] = False
+        app.test_client().post('/register', data={
+            'username': 'john', 'email': 'John@Example.com',
+            'password': 'cat', 'password2': 'cat'})
+        u = User.query.filter_by(username='john').one()
+        self.assertEqual(u.email_hash, md5(b'john@example.com').hexdigest())
+        self.assertEqual(u.avatar(128), 'https://www.gravatar.com/avatar/'
+                         f'{u.email_hash}?d=identicon&s=128')
+        u.email = 'susan@example.com'
+        db.session.commit()
+        self.assertEqual(u.email_hash, md5(b'susan@example.com').hexdigest())
+        # the stored digest is used as is; the address is not hashed again
+        u.email_hash = 'f' * 32
+        self.assertIn('/avatar/' + 'f' * 32 + '?', u.avatar(36))
+
+    def test_follow_rows_are_unique(self):
+        u1 = User(username='john', email='john@example.com')
+        u2 = User(username='susan', email='susan@example.com')
+        db.session.add_all([u1, u2])
+        db.session.commit()
+        self.assertFalse(u1.is_following(u2))
+        u1.follow(u2)
+        db.session.commit()
+        u1.follow(u2)
+        db.session.commit()
+        self.assertTrue(u1.is_following(u2))
+        self.assertFalse(u2.is_following(u1))
+        self.assertEqual(db.session.query(followers).count(), 1)
+        # the (follower_id, followed_id) primary key refuses a second row
+        with self.assertRaises(IntegrityError):
+            db.session.execute(followers.insert().values(
+                follower_id=u1.id, followed_id=u2.id))
+        db.session.rollback()
+
+        u1.unfollow(u2)
+        db.session.commit()
+        self.assertFalse(u1.is_following(u2))
+        self.assertEqual(db.session.query(followers).count(), 0)
+
+    def test_last_seen_is_buffered(self):
+        u = User(username='john', email='john@example.com',
+                 last_seen=datetime(2020, 1, 1))
+        db.session.add(u)
+        db.session.commit()
+        updated_at = u.updated_at
+        last_seen = LastSeenTracker(app, db)
+        now = datetime.utcnow()
+        self.assertTrue(last_seen.touch(u, now))
+        self.assertFalse(last_seen.touch(u, now + timedelta(seconds=1)))
+        self.assertEqual(u.last_seen, datetime(2020, 1, 1))
+
+        self.assertEqual(last_seen.flush(), 1)
+        db.session.expire_all()
+        self.assertEqual(u.last_seen, now)
+        self.assertEqual(u.updated_at, updated_at)
+        self.assertEqual(last_seen.flush(), 0)
+
+    def test_last_seen_exit_flush_is_registered_once(self):
+        import atexit
+        import app.activity as activity
+
+        class Exits(list):
+            register = list.append
+
+            def unregister(self, fn):
+                while fn in self:
+                    self.remove(fn)
+        exits = activity.atexit = Exits()
+        probe = probe_app()
+        try:
+            tracker = LastSeenTracker(probe, db)
+            tracker.init_app(probe, db)
+            tracker.init_app(app, db)
+        finally:
+            activity.atexit = atexit
+        buffers = probe.extensions['last_seen'], app.extensions['last_seen']
+        self.assertEqual(exits, [buffer.flush for buffer in buffers])
+        self.assertEqual([buffer.app for buffer in buffers], [probe, app])
+
+    def test_user_loader_cache(self):
+        u = User(username='john', email='john@example.com')
+        db.session.add(u)
+        db.session.commit()
+        self.assertEqual(load_user(str(u.id)), u)
+        db.session.remove()
+
+        statements = []
+        record = lambda conn, cursor, statement, *args: statements.append(statement)
+        event.listen(db.engine, 'before_cursor_execute', record)
+        try:
+            cached = load_user(str(u.id))
+            self.assertEqual(cached.username, 'john')
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', record)
+        self.assertEqual(statements, [])
+        self.assertEqual(user_cache.stats()['hits'], 1)
+
+        cached.about_me = 'changed'
+        db.session.commit()
+        user_cache.pop(u.id)
+        db.session.remove()
+        self.assertEqual(load_user(str(u.id)).about_me, 'changed')
+
+    def test_search(self):
+        u1 = User(username='john', email='john@example.com')
+        u2 = User(username='susan', email='susan@example.com')
+        project = Project(title='Solar panels', body='Install panels on the roof',
+                          author=u1)
+        db.session.add_all([u1, u2, project])
+        db.session.commit()
+        project.add_comment(Comment(body='What about <b>batteries</b>?', user=u2))
+        project.add_todo(Todo(task='Order batteries'))
+        db.session.commit()
+
+        hits, has_next = search('batteries', u1)
+        self.assertEqual(sorted(hit.kind_name for hit in hits), ['comment', 'todo'])
+        self.assertFalse(has_next)
+        comment = [hit for hit in hits if hit.kind_name == 'comment'][0]
+        self.assertIn('&lt;b&gt;<mark>batteries</mark>&lt;/b&gt;', comment.snippet)
+        # tasks are only visible to the project's author
+        self.assertEqual([hit.kind_name for hit in search('batteries', u2)[0]],
+                         ['comment'])
+        self.assertEqual(search('pan', u2)[0][0].project, project)
+
+        project.title = 'Wind turbine'
+        db.session.commit()
+        self.assertEqual(search('solar', u1)[0], [])
+        self.assertEqual(len(search('turbine', u1)[0]), 1)
+        self.assertEqual(search('"* :', u1), ([], False))
+
+    def test_artifact_text_is_indexed(self):
+        u = User(username='john', email='john@example.com')
+        project = Project(title='Solar', author=u)
+        db.session.add_all([u, project])
+        db.session.commit()
+        docx = BytesIO()
+        with zipfile.ZipFile(docx, 'w') as z:
+            z.writestr('word/document.xml',
+                       '<w:document xmlns:w="http://schemas.openxmlformats.org/'
+                       'wordprocessingml/2006/main"><w:body><w:p><w:r>'
+                       '<w:t>Inverter datasheet</w:t></w:r></w:p></w:body></w:document>')
+        docx.seek(0)
+        digest, size = store_blob(docx)
+        db.session.add(Artifact(name='Spec', blob=Blob.acquire(digest, size),
+                                filename='spec.docx', project=project))
+        db.session.commit()
+        hits = search('inverter', u)[0]
+        self.assertEqual([(hit.kind_name, hit.title) for hit in hits],
+                         [('artifact', 'Spec')])
+
+    def test_pdf_text_is_indexed(self):
+        u = User(username='john', email='john@example.com')
+        project = Project(title='Solar', author=u)
+        db.session.add_all([u, project])
+        db.session.commit()
+        stream = b'BT /F1 12 Tf 72 720 Td (Photovoltaic inverter manual) Tj ET'
+        objects = [
+            b'<< /Type /Catalog /Pages 2 0 R >>',
+            b'<< /Type /Pages /Kids [3 0 R] /Count 1 >>',
+            b'<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] '
+            b'/Resources << /Font << /F1 5 0 R >> >> /Contents 4 0 R >>',
+            b'<< /Length %d >>\nstream\n%s\nendstream' % (len(stream), stream),
+            b'<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>',
+        ]
+        pdf, offsets = BytesIO(b'%PDF-1.4\n'), []
+        pdf.seek(0, os.SEEK_END)
+        for n, body in enumerate(objects, 1):
+            offsets.append(pdf.tell())
+            pdf.write(b'%d 0 obj\n%s\nendobj\n' % (n, body))
+        xref = pdf.tell()
+        pdf.write(b'xref\n0 %d\n0000000000 65535 f \n' % (len(objects) + 1))
+        pdf.write(b''.join(b'%010d 00000 n \n' % offset for offset in offsets))
+        pdf.write(b'trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n'
+                  % (len(objects) + 1, xref))
+        pdf.seek(0)
+        digest, size = store_blob(pdf)
+        db.session.add(Artifact(name='Manual', blob=Blob.acquire(digest, size),
+                                filename='manual.pdf', project=project))
+        db.session.commit()
+        hits = search('photovoltaic', u)[0]
+        self.assertEqual([(hit.kind_name, hit.title) for hit in hits],
+                         [('artifact', 'Manual')])
+
+    def test_timeline_fan_out(self):
+        john = User(username='john', email='john@example.com')
+        susan = User(username='susan', email='susan@example.com')
+        mary = User(username='mary', email='mary@example.com')
+        db.session.add_all([john, susan, mary])
+        john.follow(susan)
+        mary.follow(susan)
+        db.session.commit()
+
+        first = Project(title='first', author=susan)
+        db.session.add(first)
+        db.session.commit()
+        self.assertEqual(john.followed_projects().all(), [first])
+        self.assertEqual(mary.followed_projects().all(), [first])
+        self.assertEqual(susan.followed_projects().all(), [first])
+
+        john.unfollow(susan)
+        db.session.commit()
+        self.assertEqual(john.followed_projects().all(), [])
+        john.follow(susan)  # backfilled from susan's recent projects
+        db.session.commit()
+        self.assertEqual(john.followed_projects().all(), [first])
+
+        # above the limit nothing is fanned out; the feed pulls instead
+        app.config['TIMELINE_FANOUT_LIMIT'] = 2
+        try:
+            second = Project(title='second', author=susan,
+                             created_at=first.created_at + timedelta(seconds=1))
+            db.session.add(second)
+            db.session.commit()
+            self.assertEqual(db.session.query(timeline).filter_by(
+                project_id=second.id).count(), 1)
+            self.assertEqual(john.followed_projects().all(), [second, first])
+            self.assertEqual(rebuild(batch_size=1), 2)  # own rows only
+            self.assertEqual(john.followed_projects().all(), [second, first])
+            # back below the limit: the projects the feed pulled are fanned out
+            mary.unfollow(susan)
+            db.session.commit()
+            self.assertEqual(db.session.query(timeline).filter_by(
+                user_id=john.id).count(), 2)
+            self.assertEqual(john.followed_projects().all(), [second, first])
+        finally:
+            app.config['TIMELINE_FANOUT_LIMIT'] = 5000
+
+        Project.query.filter_by(id=first.id).delete()
+        remove_projects(db.session, [first.id])
+        db.session.commit()
+        self.assertEqual(db.session.query(timeline).filter_by(project_id=first.id).count(), 0)
+        self.assertNotIn(first, john.followed_projects().all())
+
+    def test_feed_version_follows_the_timeline(self):
+        john = User(username='john', email='john@example.com')
+        susan = User(username='susan', email='susan@example.com')
+        db.session.add_all([john, susan])
+        john.follow(susan)
+        db.session.commit()
+        project = Project(title='news', author=susan)
+        db.session.add(project)
+        db.session.commit()
+        # as if the fan-out job had not run yet
+        db.session.execute(timeline.delete().where(db.and_(
+            timeline.c.user_id == john.id, timeline.c.project_id == project.id)))
+        db.session.commit()
+        before = john.feed_version()
+        self.assertEqual(john.followed_projects().all(), [])
+        fan_out(project.id)
+        self.assertEqual(john.followed_projects().all(), [project])
+        self.assertNotEqual(john.feed_version(), before)
+
+    def test_deleted_projects_stay_out_of_feeds(self):
+        john = User(username='john', email='john@example.com')
+        susan = User(username='susan', email='susan@example.com')
+        now = datetime.utcnow()
+        live = Project(title='live', author=susan, created_at=now)
+        gone = Project(title='gone', author=susan, created_at=now - timedelta(minutes=1))
+        db.session.add_all([john, susan, live, gone])
+        db.session.commit()
+        # deleted, but not reaped yet
+        gone.deleted_at = datetime.utcnow()
+        remove_projects(db.session, [gone.id])
+        db.session.commit()
+        john.follow(susan)
+        db.session.commit()
+        self.assertEqual(john.followed_projects().all(), [live])
+        # a fan-out that read the project just before it was deleted
+        db.session.execute(timeline.insert().values(
+            user_id=john.id, created_at=gone.created_at, project_id=gone.id,
+            author_id=susan.id))
+        db.session.commit()
+        self.assertEqual(john.followed_projects().all(), [live])
+
+    def test_engine_configuration(self):
+        from config import engine_options
+        from sqlalchemy.pool import QueuePool
+        self.assertEqual(engine_options('sqlite://'), {})
+        self.assertIs(engine_options('sqlite:////tmp/app.db')['poolclass'], QueuePool)
+        self.assertTrue(engine_options('postgresql://db/projapp')['pool_pre_ping'])
+        self.assertEqual(db.session.execute('PRAGMA busy_timeout').scalar(),
+                         app.config['SQLITE_BUSY_TIMEOUT'])
+
+    def test_reads_are_routed_to_replicas(self):
+        from sqlalchemy import create_engine
+        replica = os.path.join(tempfile.mkdtemp(), 'replica.db')
+        db.session.add(User(username='john', email='john@example.com'))
+        db.session.commit()
+        db.session.remove()
+        engine = create_engine('sqlite:///' + replica)
+        db.Model.metadata.create_all(engine)
+        engine.dispose()
+        app.config['SQLALCHEMY_REPLICA_URIS'] = ['sqlite:///' + replica]
+        try:
+            with app.test_request_context('/explore'):
+                # the replica has not caught up yet
+                self.assertIsNone(User.query.filter_by(username='john').first())
+                db.session.add(User(username='susan', email='susan@example.com'))
+                db.session.flush()
+                # once the request has written, it reads its own writes
+                self.assertEqual(User.query.count(), 2)
+            db.session.remove()
+            with app.test_request_context('/follow/john'):
+                self.assertIsNotNone(User.query.filter_by(username='john').first())
+            db.session.remove()
+            with app.test_request_context('/explore', method='POST'):
+                self.assertIsNotNone(User.query.filter_by(username='john').first())
+            db.session.remove()
+            with db.read_only():
+                self.assertIsNone(User.query.filter_by(username='john').first())
+        finally:
+            app.config['SQLALCHEMY_REPLICA_URIS'] = []
+            db.session.remove()
+
+
+class CommandCase(unittest.TestCase):
+    def setUp(self):
+        self.app_context = app.app_context()
+        self.app_context.push()
+        db.create_all()
+        user_cache.clear()
+        self.runner = app.test_cli_runner()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def test_export_import_round_trip(self):
+        john = User(username='john', email='john@example.com')
+        susan = User(username='susan', email='susan@example.com')
+        mary = User(username='mary', email='mary@example.com')
+        db.session.add_all([john, susan, mary])
+        john.follow(susan)
+        mary.follow(susan)
+        mary.follow(john)
+        db.session.commit()
+        now = datetime.utcnow()
+        for i, author in enumerate([susan, john, susan]):
+            project = Project(title=f'project {i}', author=author,
+                              created_at=now - timedelta(minutes=i))
+            db.session.add(project)
+            db.session.commit()
+            project.add_todo(Todo(task='task'))
+            project.add_comment(Comment(body='nice work', user=mary))
+            db.session.commit()
+        digest, size = store_blob(BytesIO(os.urandom(64)))
+        db.session.add(Artifact(name='spec', blob=Blob.acquire(digest, size), project=project))
+        db.session.commit()
+
+        def snapshot():
+            counts = {table_of(source).name: db.session.query(table_of(source)).count()
+                      for source in EXPORT_TABLES}
+            feeds = {u.username: [p.title for p in u.followed_projects()]
+                     for u in User.query.order_by(User.id)}
+            return counts, feeds
+        before = snapshot()
+        path = os.path.join(tempfile.mkdtemp(), 'dump.ndjson.gz')
+        result = self.runner.invoke(args=['projapp', 'export', path])
+        self.assertEqual(result.exit_code, 0, result.output)
+
+        db.session.remove()
+        db.drop_all()
+        db.create_all()
+        result = self.runner.invoke(args=['projapp', 'import', path])
+        self.assertEqual(result.exit_code, 0, result.output)
+        self.assertIn('timeline:', result.output)
+        self.assertEqual(snapshot(), before)
+        self.assertEqual(before[1]['mary'], ['project 0', 'project 1', 'project 2'])
+
+    def test_counters_command_repairs_drift(self):
+        john = User(username='john', email='john@example.com')
+        susan = User(username='susan', email='susan@example.com')
+        project = Project(title='project', author=susan)
+        db.session.add_all([john, susan, project])
+        db.session.commit()
+        john.follow(susan)
+        project.add_comment(Comment(body='hello', user=john))
+        db.session.commit()
+        db.session.execute(Project.__table__.update().values(comment_count=7))
+        db.session.execute(User.__table__.update().where(User.id == susan.id)
+                           .values(follower_count=0))
+        db.session.commit()
+
+        result = self.runner.invoke(args=['projapp', 'counters', '--verify'])
+        self.assertEqual(result.exit_code, 1)
+        self.assertIn('project.comment_count: 1 row(s) out of date', result.output)
+        result = self.runner.invoke(args=['projapp', 'counters'])
+        self.assertEqual(result.exit_code, 0, result.output)
+        self.assertIn('user.follower_count: fixed 1 row(s)', result.output)
+        self.assertEqual((Project.query.get(project.id).comment_count,
+                          User.query.get(susan.id).follower_count), (1, 1))
+        self.assertEqual(self.runner.invoke(args=['projapp', 'counters', '--verify']).exit_code, 0)
+
+
+class FragmentCacheCase(unittest.TestCase):
+    def test_version_mismatch_rerenders(self):
+        probe = probe_app()
+        cache = FragmentCache(probe)
+        renders = []
+        render = lambda: renders.append(1) or f'<p>{len(renders)}</p>'
+        with probe.app_context():
+            self.assertEqual(cache.get_or_render('card:1', (1,), render), '<p>1</p>')
+            self.assertEqual(cache.get_or_render('card:1', (1,), render), '<p>1</p>')
+            self.assertEqual(cache.get_or_render('card:1', (2,), render), '<p>2</p>')
+            cache.delete('card:1')
+            self.assertEqual(cache.get_or_render('card:1', (2,), render), '<p>3</p>')
+
+    def test_file_backend_evicts_least_recently_used(self):
+        with tempfile.TemporaryDirectory() as directory:
+            cache = FileCache(directory, maxsize=2, evict_every=1)
+            cache.set('a', 1)
+            cache.set('b', 2)
+            os.utime(cache._path('a'), (0, 0))
+            cache.set('c', 3)
+            self.assertIsNone(cache.get('a'))
+            self.assertEqual((cache.get('b'), cache.get('c')), (2, 3))
+
+
+class ExtensionStateCase(unittest.TestCase):
+    def test_a_second_app_keeps_its_own_state(self):
+        class OtherConfig(TestConfig):
+            BACKGROUND_JOBS_SYNC = False
+            FRAGMENT_CACHE_SIZE = 1
+            USER_CACHE_SIZE = 1
+        other = create_app(OtherConfig)
+        with app.app_context():
+            self.assertTrue(tasks.queue.sync)
+            self.assertIs(tasks.queue.app, app)
+            self.assertIs(last_seen.buffer.app, app)
+            self.assertEqual(fragment_cache.backend.maxsize, app.config['FRAGMENT_CACHE_SIZE'])
+            self.assertEqual(user_cache.maxsize, app.config['USER_CACHE_SIZE'])
+        with other.app_context():
+            self.assertFalse(tasks.queue.sync)
+            self.assertIs(last_seen.buffer.app, other)
+            self.assertEqual(fragment_cache.backend.maxsize, 1)
+            self.assertEqual(user_cache.maxsize, 1)
+
+
+class DebugSMTPServer(socketserver.ThreadingTCPServer):
+    """Just enough SMTP to accept mail from smtplib and remember it."""
+    allow_reuse_address = True
+    daemon_threads = True
+
+    def __init__(self):
+        self.messages = []
+        self.connections = 0
+        super().__init__(('127.0.0.1', 0), DebugSMTPHandler)
+        self.port = self.server_address[1]
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+
+
+class DebugSMTPHandler(socketserver.StreamRequestHandler):
+    def reply(self, line):
+        self.wfile.write(line.encode('ascii') + b'\r\n')
+
+    def handle(self):
+        self.server.connections += 1
+        self.reply('220 localhost debug SMTP')
+        while True:
+            line = self.rfile.readline().decode('utf-8').strip()
+            command = line[:4].upper()
+            if not line or command == 'QUIT':
+                self.reply('221 bye')
+                return
+            if command == 'DATA':
+                self.reply('354 end with <CRLF>.<CRLF>')
+                data = []
+                for raw in iter(self.rfile.readline, b'.\r\n'):
+                    data.append(raw.decode('utf-8'))
+                self.server.messages.append(''.join(data))
+            self.reply('250 OK')
+
+
+class MailQueueCase(unittest.TestCase):
+    def setUp(self):
+        self.server = DebugSMTPServer()
+        self.directory = tempfile.TemporaryDirectory()
+        app.config['MAIL_QUEUE_PATH'] = os.path.join(self.directory.name, 'q.db')
+        self.queue = MailSpool(app)
+        self.queue.workers = 0  # the tests drive delivery themselves
+        self.state = self.queue.mail.state
+        self.saved = self.state.server, self.state.port, self.state.suppress
+        self.state.server, self.state.port = '127.0.0.1', self.server.port
+        self.state.suppress = False
+
+    def tearDown(self):
+        self.queue.stop()
+        self.server.shutdown()
+        self.server.server_close()
+        self.state.server, self.state.port, self.state.suppress = self.saved
+        app.config['MAIL_QUEUE_PATH'] = os.environ['MAIL_QUEUE_PATH']
+        self.directory.cleanup()
+
+    def message(self, n):
+        return Message(f'message {n}', sender='admin@example.com',
+                       recipients=['user@example.com'], body='hello')
+
+    def test_batch_shares_one_connection(self):
+        for n in range(3):
+            self.queue.enqueue(self.message(n))
+        conn = self.queue._connect()
+        self.assertEqual(self.queue.deliver(conn, self.queue._claim(conn)), 3)
+        self.assertEqual(self.queue.pending(), 0)
+        self.assertEqual(len(self.server.messages), 3)
+        self.assertEqual(self.server.connections, 1)
+
+    def test_failed_delivery_is_retried_later(self):
+        self.queue.enqueue(self.message(0))
+        self.state.port = 1  # nothing listens there
+        conn = self.queue._connect()
+        self.assertEqual(self.queue.deliver(conn, self.queue._claim(conn)), 0)
+        attempts, due = conn.execute(
+            'SELECT attempts, next_attempt_at FROM mail_queue').fetchone()
+        self.assertEqual(attempts, 1)
+        self.assertGreater(due, time.time())
+        self.assertEqual(self.queue._claim(conn), [])
+
+
+class LoggingCase(unittest.TestCase):
+    def test_records_carry_request_context_as_json(self):
+        import logging, json, queue
+        records = queue.SimpleQueue()
+        handler = ContextQueueHandler(records)
+        handler.addFilter(RequestContextFilter())
+        logger = logging.getLogger('projapp.test')
+        logger.addHandler(handler)
+        try:
+            with app.test_request_context('/explore', headers={'X-Request-ID': 'abc'}):
+                app.preprocess_request()
+                try:
+                    1 / 0
+                except ZeroDivisionError:
+                    logger.exception('boom %s', 42)
+        finally:
+            logger.removeHandler(handler)
+        entry = json.loads(JSONFormatter().format(records.get_nowait()))
+        self.assertEqual(entry['message'], 'boom 42')
+        self.assertEqual(entry['request_id'], 'abc')
+        self.assertEqual(entry['path'], '/explore')
+        self.assertIsNone(entry['user_id'])
+        self.assertIn('latency_ms', entry)
+        self.assertIn('ZeroDivisionError', entry['exception'])
+
+    def test_error_emails_are_deduplicated_and_rate_limited(self):
+        import logging
+        now = [0]
+        handler = DedupSMTPHandler('localhost', 'from@example.com', ['to@example.com'],
+                                   'Failure', interval=60, limit=2, timer=lambda: now[0])
+
+        def record(line):
+            return logging.makeLogRecord({'name': 'app', 'levelno': logging.ERROR,
+                                          'pathname': 'routes.py', 'lineno': line,
+                                          'msg': 'failed'})
+        self.assertTrue(handler.allow(record(1)))
+        self.assertFalse(handler.allow(record(1)))
+        self.assertTrue(handler.allow(record(2)))
+        self.assertFalse(handler.allow(record(3)))  # over the limit
+        now[0] = 61
+        late = record(1)
+        self.assertTrue(handler.allow(late))
+        self.assertEqual(handler.getSubject(late), 'Failure: failed (+1 suppressed)')
+
+    def test_setting_up_logging_again_replaces_the_handler(self):
+        import atexit
+        path = os.path.join(tempfile.mkdtemp(), 'probe.log')
+        probe = probe_app(LOG_FILE=path, MAIL_SERVER=None)
+        setup_logging(probe)
+        listener = setup_logging(probe)
+        handlers = [h for h in probe.logger.handlers if isinstance(h, ContextQueueHandler)]
+        try:
+            self.assertEqual([h.listener for h in handlers], [listener])
+            probe.logger.info('logged once')
+        finally:
+            for handler in handlers:
+                probe.logger.removeHandler(handler)
+            atexit.unregister(listener.stop)
+            listener.stop()
+        with open(path) as f:
+            self.assertEqual(f.read().count('logged once'), 1)
+
+
+class ClientCase(unittest.TestCase):
+    """Runs requests through the test client against a fresh database."""
+
+    def setUp(self):
+        app.config['WTF_CSRF_ENABLED'] = False
+        self.app_context = app.app_context()
+        self.app_context.push()
+        db.create_all()
+        user_cache.clear()
+        self.client = app.test_client()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def count_queries(self, url):
+        statements = []
+
+        def record(conn, cursor, statement, *args):
+            statements.append(statement)
+        event.listen(db.engine, 'before_cursor_execute', record)
+        try:
+            response = self.client.get(url)
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', record)
+        self.assertEqual(response.status_code, 200)
+        self.statements = statements
+        return len(statements)
+
+
+class ProjectDetailCase(ClientCase):
+    def test_view_project_query_count_is_constant(self):
+        author = User(username='john', email='john@example.com')
+        author.set_password('cat')
+        project = Project(title='project', body='body', author=author)
+        db.session.add_all([author, project,
+                            Todo(task='task', project=project)])
+        db.session.commit()
+        self.client.post('/login', data={'username': 'john', 'password': 'cat'})
+        url = f'/projects/{project.id}'
+
+        def add_comments(n):
+            for i in range(n):
+                commenter = User(username=f'user{i}_{n}',
+                                 email=f'user{i}_{n}@example.com')
+                db.session.add(Comment(body='nice work', user=commenter,
+                                       project=project))
+            db.session.commit()
+
+        add_comments(1)
+        self.client.get(url)  # warm the user loader cache
+        baseline = self.count_queries(url)
+        add_comments(25)
+        self.assertEqual(self.count_queries(url), baseline)
+        self.assertEqual(self.client.get(url).data.count(b'nice work'), 26)
+        # the page renders from the project it checked the ETag against
+        self.count_queries(url)
+        self.assertEqual(len([s for s in self.statements
+                              if re.search(r'\bFROM project\b', s)]), 1)
+
+
+class BlobCase(ClientCase):
+    def test_identical_uploads_share_one_blob(self):
+        author = User(username='john', email='john@example.com')
+        author.set_password('cat')
+        projects = [Project(title=f'project {i}', body='body', author=author)
+                    for i in range(2)]
+        db.session.add_all([author] + projects)
+        db.session.commit()
+        self.client.post('/login', data={'username': 'john', 'password': 'cat'})
+        content = b'%PDF-1.4 ' + os.urandom(200 * 1024)
+        for project in projects:
+            response = self.client.post(f'/projects/{project.id}', data={
+                'name': 'spec', 'asubmit': 'Submit',
+                'file': (BytesIO(content), 'spec.pdf')})
+            self.assertEqual(response.status_code, 302)
+
+        blob = Blob.query.one()
+        self.assertEqual((blob.refcount, blob.size), (2, len(content)))
+        with open(blob_path(blob.sha256), 'rb') as f:
+            self.assertEqual(f.read(), content)
+        stray = [name for _, _, files in os.walk(os.environ['BLOB_FOLDER'])
+                 for name in files if name.startswith('.upload-')]
+        self.assertEqual(stray, [])
+        url = f'/download_file/{blob.sha256}'
+        response = self.client.get(url)
+        self.assertEqual(response.data, content)
+        self.assertEqual(response.mimetype, 'application/pdf')
+        self.assertEqual(response.headers['ETag'], f'"{blob.sha256}"')
+
+        response = self.client.get(url, headers={'If-None-Match': f'"{blob.sha256}"'})
+        self.assertEqual((response.status_code, response.data), (304, b''))
+        response = self.client.get(url, headers={'Range': 'bytes=100-199'})
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response.data, content[100:200])
+        self.assertEqual(response.headers['Content-Range'],
+                         f'bytes 100-199/{len(content)}')
+
+        app.config['ARTIFACT_SENDFILE'] = 'x-accel-redirect'
+        try:
+            response = self.client.get(url)
+        finally:
+            app.config['ARTIFACT_SENDFILE'] = None
+        self.assertEqual(response.data, b'')
+        self.assertEqual(response.headers['X-Accel-Redirect'],
+                         f'/_blobs/{blob.sha256[:2]}/{blob.sha256[2:4]}/{blob.sha256}')
+
+    def test_blobs_go_to_the_app_blob_folder(self):
+        folder = tempfile.mkdtemp()
+        app.config['BLOB_FOLDER'] = folder
+        try:
+            digest, size = store_blob(BytesIO(b'%PDF-1.4 elsewhere'))
+            self.assertEqual(os.path.commonpath([folder, blob_path(digest)]), folder)
+            with open(blob_path(digest), 'rb') as f:
+                self.assertEqual(f.read(), b'%PDF-1.4 elsewhere')
+        finally:
+            app.config['BLOB_FOLDER'] = Config.BLOB_FOLDER
+
+
+class ApiCase(ClientCase):
+    def test_api_includes_are_batched(self):
+        john = User(username='john', email='john@example.com')
+        susan = User(username='susan', email='susan@example.com')
+        john.set_password('cat')
+        db.session.add_all([john, susan])
+        db.session.commit()
+        self.assertEqual(self.client.get('/api/v1/projects').status_code, 401)
+        self.client.post('/login', data={'username': 'john', 'password': 'cat'})
+        url = '/api/v1/projects?include=author,todos,comments&fields=id,title'
+
+        def add_projects(n):
+            for i in range(n):
+                project = Project(title=f'project {i}', author=[john, susan][i % 2])
+                db.session.add(project)
+                db.session.commit()
+                project.add_todo(Todo(task='task'))
+                project.add_comment(Comment(body='nice work', user=susan))
+            db.session.commit()
+
+        add_projects(2)
+        self.client.get(url)
+        few = self.count_queries(url)
+        add_projects(6)
+        self.assertEqual(self.count_queries(url), few)
+
+        data = self.client.get(url).get_json()['data']
+        self.assertEqual(len(data), 8)
+        self.assertEqual(set(data[0]) - {'todos'}, {'id', 'title', 'author', 'comments'})
+        # todos are private to the project's author
+        self.assertEqual(['todos' in d for d in data],
+                         [d['author']['username'] == 'john' for d in data])
+
+        ids = ','.join(str(d['id']) for d in data[:3]) + ',999'
+        batch = self.client.get(f'/api/v1/projects/batch?ids={ids}&fields=id').get_json()
+        self.assertEqual([d['id'] for d in batch['data']], [d['id'] for d in data[:3]])
+        self.assertEqual(batch['missing'], [999])
+        self.assertEqual(self.client.get('/api/v1/projects?fields=nope').status_code, 400)
+
+        # query args named like url_for()'s own or the view's are harmless
+        page = self.client.get('/api/v1/users/john/projects?limit=2&username=susan'
+                               '&endpoint=x&_external=0&fields=id').get_json()
+        self.assertEqual(len(page['data']), 2)
+        self.assertTrue(page['next'].startswith('http://localhost/api/v1/users/john/projects?'))
+        self.assertIn('cursor=', page['next'])
+        following = self.client.get(page['next']).get_json()['data']
+        self.assertEqual(len(following), 2)
+        self.assertFalse({d['id'] for d in following} & {d['id'] for d in page['data']})
+
+    def test_api_children_and_includes_are_paged(self):
+        from app.api.routes import MAX_INCLUDE
+        john = User(username='john', email='john@example.com')
+        john.set_password('cat')
+        project = Project(title='big', author=john)
+        db.session.add(project)
+        db.session.commit()
+        project.add_todos([f'task {i}' for i in range(MAX_INCLUDE + 5)], None)
+        for i in range(3):
+            project.add_comment(Comment(body=f'comment {i}', user=john))
+        db.session.commit()
+        newest = [t.id for t in project.todos.order_by(Todo.created_at.desc(), Todo.id.desc())]
+        self.client.post('/login', data={'username': 'john', 'password': 'cat'})
+
+        data = self.client.get(f'/api/v1/projects/{project.id}?include=todos,comments'
+                               f'&fields[todos]=id').get_json()['data']
+        self.assertEqual([t['id'] for t in data['todos']], newest[:MAX_INCLUDE])
+        self.assertEqual(len(data['comments']), 3)
+        self.assertNotIn('comments_next', data)
+        rest = self.client.get(data['todos_next']).get_json()
+        self.assertEqual(rest['data'], [{'id': id} for id in newest[MAX_INCLUDE:]])
+        self.assertIsNone(rest['next'])
+
+        seen, url = [], f'/api/v1/projects/{project.id}/todos?limit=10&fields=id'
+        while url:
+            page = self.client.get(url).get_json()
+            self.assertLessEqual(len(page['data']), 10)
+            seen += [t['id'] for t in page['data']]
+            url = page['next']
+        self.assertEqual(seen, newest)
+
+    def test_api_token_auth(self):
+        john = User(username='john', email='john@example.com')
+        john.set_password('cat')
+        db.session.add(john)
+        db.session.commit()
+
+        def basic(password):
+            credentials = b64encode(f'john:{password}'.encode()).decode()
+            return {'Authorization': f'Basic {credentials}'}
+        self.assertEqual(self.client.post('/api/v1/tokens').status_code, 401)
+        self.assertEqual(self.client.post('/api/v1/tokens', headers=basic('dog')).status_code, 401)
+        response = self.client.post('/api/v1/tokens', headers=basic('cat'))
+        self.assertEqual(response.get_json()['expires_in'], app.config['API_TOKEN_EXPIRES'])
+        bearer = {'Authorization': f'Bearer {response.get_json()["token"]}'}
+
+        response = self.client.get('/api/v1/users/john', headers=bearer)
+        self.assertEqual(response.get_json()['data']['username'], 'john')
+        self.assertNotIn('Set-Cookie', response.headers)
+        self.assertEqual(self.client.get('/api/v1/users/john', headers={
+            'Authorization': 'Bearer nope'}).status_code, 401)
+        reset = {'Authorization': f'Bearer {john.get_reset_password_token()}'}
+        self.assertEqual(self.client.get('/api/v1/users/john', headers=reset).status_code, 401)
+        # pages only take the session cookie
+        self.assertEqual(self.client.get('/index', headers=bearer).status_code, 302)
+
+    def test_bulk_todo_changes(self):
+        john = User(username='john', email='john@example.com')
+        susan = User(username='susan', email='susan@example.com')
+        john.set_password('cat')
+        susan.set_password('dog')
+        project = Project(title='sprint', author=john, sdate=datetime(2020, 5, 1),
+                          edate=datetime(2020, 5, 31))
+        other = Project(title='other', author=john)
+        db.session.add_all([john, susan, project, other])
+        db.session.commit()
+        for i in range(4):
+            project.add_todo(Todo(task=f'task {i}'))
+            db.session.commit()
+        other.add_todo(Todo(task='elsewhere'))
+        db.session.commit()
+        ids = [t.id for t in project.todos.order_by(Todo.id)]
+        elsewhere = other.todos.first().id
+        url = f'/api/v1/projects/{project.id}/todos'
+
+        self.client.post('/login', data={'username': 'john', 'password': 'cat'})
+        self.assertEqual(self.client.post(url, data={'action': 'done'}).status_code, 415)
+        response = self.client.post(url, json={'action': 'done',
+                                               'ids': ids[:3] + [elsewhere, 999]})
+        self.assertEqual(response.get_json(), {
+            'data': {'done': ids[:3], 'undone': [], 'deleted': [], 'created': []},
+            'open_todo_count': 1})
+        response = self.client.post(url, json={'action': 'done', 'ids': ids})
+        self.assertEqual(response.get_json()['data']['done'], ids[3:])
+        response = self.client.post(url, json={'action': 'undone', 'ids': ids[:2]})
+        self.assertEqual(response.get_json()['open_todo_count'], 2)
+        response = self.client.post(url, json={'action': 'delete', 'ids': ids[1:3] + [elsewhere]})
+        self.assertEqual(response.get_json()['data']['deleted'], ids[1:3])
+        self.assertEqual(response.get_json()['open_todo_count'], 1)
+        response = self.client.post(url, json={'action': 'create', 'edate': '2020-05-20',
+                                               'tasks': 'write tests\n\n  ship it  \n'})
+        created = response.get_json()['data']['created']
+        self.assertEqual([t['task'] for t in created], ['write tests', 'ship it'])
+        self.assertEqual(created[0]['edate'], '2020-05-20T00:00:00Z')
+        self.assertEqual(response.get_json()['open_todo_count'], 3)
+        self.assertEqual(self.client.post(url, json={'action': 'create', 'tasks': 'late',
+                                                     'edate': '2020-06-02'}).status_code, 400)
+        self.assertEqual(self.client.post(url, json={'action': 'done', 'ids': 'all'}).status_code, 400)
+
+        db.session.expire_all()
+        self.assertEqual(sorted(t.task for t in project.todos),
+                         ['ship it', 'task 0', 'task 3', 'write tests'])
+        self.assertEqual(project.open_todo_count,
+                         project.todos.filter(Todo.is_done == False).count())
+        self.assertEqual(other.todos.count(), 1)
+        self.assertEqual([hit.ref_id for hit in search('task', john)[0]], [ids[0], ids[3]])
+
+        self.client.get('/logout')
+        self.client.post('/login', data={'username': 'susan', 'password': 'dog'})
+        self.assertEqual(self.client.post(url, json={'action': 'delete', 'ids': ids}).status_code, 403)
+
+
+class ReaperCase(ClientCase):
+    def test_deleted_project_is_reaped_in_batches(self):
+        john = User(username='john', email='john@example.com')
+        susan = User(username='susan', email='susan@example.com')
+        john.set_password('cat')
+        susan.set_password('dog')
+        project = Project(title='doomed', body='doomed project', author=john)
+        other = Project(title='kept', author=john)
+        db.session.add_all([john, susan, project, other])
+        db.session.commit()
+        for i in range(3):
+            project.add_todo(Todo(task=f'doomed task {i}'))
+            db.session.commit()
+            project.add_comment(Comment(body=f'doomed comment {i}', user=susan))
+            db.session.commit()
+        shared, size = store_blob(BytesIO(os.urandom(64)))
+        unique, size = store_blob(BytesIO(os.urandom(64)))
+        db.session.add_all([
+            Artifact(name='shared', blob=Blob.acquire(shared, size), project=project),
+            Artifact(name='unique', blob=Blob.acquire(unique, size), project=project)])
+        db.session.commit()
+        db.session.add(Artifact(name='shared', blob=Blob.acquire(shared, size), project=other))
+        db.session.commit()
+        id = project.id
+
+        self.client.post('/login', data={'username': 'susan', 'password': 'dog'})
+        self.assertEqual(self.client.get(f'/projects/{id}/delete').status_code, 403)
+        self.client.get('/logout')
+        self.client.post('/login', data={'username': 'john', 'password': 'cat'})
+        app.config['REAPER_BATCH'] = 2
+        try:
+            with self.assertLogs(app.logger, 'INFO') as logs:
+                self.assertEqual(self.client.get(f'/projects/{id}/delete').status_code, 302)
+        finally:
+            app.config['REAPER_BATCH'] = Config.REAPER_BATCH
+        reaper_lines = [line for line in logs.output if f'project {id}' in line]
+        self.assertEqual(len(reaper_lines), 6)  # five batches of two rows or fewer, a summary
+        self.assertIn('removed 2 comment row(s)', reaper_lines[0])
+        self.assertIn('3 comment(s), 3 todo(s), 2 artifact(s), 1 project(s)',
+                      reaper_lines[-1])
+
+        db.session.expire_all()
+        self.assertEqual(self.client.get(f'/projects/{id}').status_code, 404)
+        self.assertEqual([p['id'] for p in self.client.get('/api/v1/projects').get_json()['data']],
+                         [other.id])
+        self.assertIsNone(Project.query.get(id))
+        for model in (Comment, Todo, Artifact):
+            self.assertEqual(model.query.filter_by(project_id=id).count(), 0)
+        self.assertEqual(db.session.query(search_document.c.rowid)
+                         .filter(search_document.c.project_id == id).count(), 0)
+        self.assertEqual(search('doomed', john), ([], False))
+        self.assertEqual(Blob.query.get(shared).refcount, 1)
+        self.assertTrue(os.path.exists(blob_path(shared)))
+        self.assertIsNone(Blob.query.get(unique))
+        self.assertFalse(os.path.exists(blob_path(unique)))
+        self.assertEqual(self.client.get(f'/projects/{id}/delete').status_code, 404)
+
+    def test_reaper_loops_instead_of_recursing(self):
+        john = User(username='john', email='john@example.com')
+        project = Project(title='huge', author=john, deleted_at=datetime.utcnow())
+        db.session.add_all([john, project])
+        db.session.commit()
+        db.session.execute(Todo.__table__.insert(), [
+            {'task': f'task {i}', 'project_id': project.id} for i in range(1200)])
+        db.session.commit()
+        app.config['REAPER_BATCH'] = 1
+        try:
+            # jobs run inline in tests: one batch per stack frame would overflow
+            reap_project(project.id)
+        finally:
+            app.config['REAPER_BATCH'] = Config.REAPER_BATCH
+        self.assertEqual(Todo.query.count(), 0)
+        self.assertEqual(Project.query.filter_by(id=project.id).count(), 0)
+
+    def test_reaper_and_uploads_of_the_same_content(self):
+        john = User(username='john', email='john@example.com')
+        project = Project(title='doomed', author=john, deleted_at=datetime.utcnow())
+        db.session.add_all([john, project])
+        db.session.commit()
+        content = os.urandom(64)
+        digest, size = store_blob(BytesIO(content))
+        db.session.add(Artifact(name='spec', blob=Blob.acquire(digest, size), project=project))
+        db.session.commit()
+
+        def fail(conn):
+            raise RuntimeError('commit failed')
+        event.listen(db.engine, 'commit', fail)
+        try:
+            self.assertRaises(RuntimeError, reap_batch, project.id, 10)
+        finally:
+            event.remove(db.engine, 'commit', fail)
+        db.session.rollback()
+        self.assertEqual(Blob.query.get(digest).refcount, 1)
+        self.assertTrue(os.path.exists(blob_path(digest)))
+
+        # received while the file still existed, stored after it was reaped
+        upload = receive_blob(BytesIO(content))
+        self.assertEqual(reap_batch(project.id, 10), ('artifact', 1))
+        self.assertFalse(os.path.exists(blob_path(digest)))
+        blob = Blob.acquire(upload.hexdigest(), upload.size)
+        keep_blob(upload)
+        db.session.commit()
+        self.assertEqual(blob.refcount, 1)
+        with open(blob_path(digest), 'rb') as f:
+            self.assertEqual(f.read(), content)
+
+
+class ConditionalGetCase(ClientCase):
+    def test_pages_answer_conditional_gets(self):
+        john = User(username='john', email='john@example.com')
+        susan = User(username='susan', email='susan@example.com')
+        john.set_password('cat')
+        project = Project(title='project', author=susan)
+        db.session.add_all([john, susan, project])
+        db.session.commit()
+        john.follow(susan)
+        db.session.commit()
+        self.client.post('/login', data={'username': 'john', 'password': 'cat'})
+        self.client.get('/index')  # consume the login flash
+
+        for url in ('/index', '/explore', '/user/susan', f'/projects/{project.id}'):
+            etag = self.client.get(url).headers['ETag']
+            self.assertTrue(etag.startswith('W/'), url)
+            self.assertEqual(self.client.get(
+                url, headers={'If-None-Match': etag}).status_code, 304, url)
+
+        etags = {url: self.client.get(url).headers['ETag']
+                 for url in ('/index', f'/projects/{project.id}')}
+        project.add_comment(Comment(body='nice work', user=john))
+        db.session.commit()
+        for url, etag in etags.items():
+            self.assertEqual(self.client.get(
+                url, headers={'If-None-Match': etag}).status_code, 200, url)
+
+        etag = self.client.get('/index').headers['ETag']
+        db.session.add(Project(title='another', author=susan))
+        db.session.commit()
+        self.assertEqual(self.client.get(
+            '/index', headers={'If-None-Match': etag}).status_code, 200)
+
+    def test_own_profile_stamp_is_read_from_the_database(self):
+        john = User(username='john', email='john@example.com')
+        john.set_password('cat')
+        db.session.add(john)
+        db.session.commit()
+        self.client.post('/login', data={'username': 'john', 'password': 'cat'})
+        self.client.get('/index')  # consume the login flash
+        etag = self.client.get('/user/john').headers['ETag']
+        # behind the back of the user cache, as another worker would
+        db.session.execute(User.__table__.update().where(User.id == john.id).values(
+            about_me='changed', updated_at=datetime.utcnow() + timedelta(seconds=1)))
+        db.session.commit()
+        response = self.client.get('/user/john', headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'changed', response.data)
+
+
+class ExploreCase(ClientCase):
+    def test_explore_pages_and_streams(self):
+        john = User(username='john', email='john@example.com')
+        john.set_password('cat')
+        now = datetime.utcnow()
+        projects = [Project(title=f'project {i}', author=john,
+                            created_at=now - timedelta(minutes=i)) for i in range(5)]
+        db.session.add_all([john] + projects)
+        db.session.commit()
+        self.client.post('/login', data={'username': 'john', 'password': 'cat'})
+        self.client.get('/index')  # consume the login flash
+        card = re.compile(r'<h4><a href="/projects/\d+">([^<]*)</a></h4>')
+        next_link = re.compile(r'<li class="next"><a href="([^"]+)"')
+
+        def crawl():
+            pages, url = [], '/explore'
+            while url:
+                html = self.client.get(url).get_data(as_text=True)
+                pages.append(card.findall(html))
+                url = next_link.search(html)
+                url = url and url.group(1).replace('&amp;', '&')
+            return pages
+
+        app.config['PROJECTS_PER_PAGE'] = 2
+        try:
+            pages = crawl()
+            self.assertEqual(pages, [['project 0', 'project 1'],
+                                     ['project 2', 'project 3'], ['project 4']])
+            app.config['STREAM_TEMPLATES'] = True
+            try:
+                response = self.client.get('/explore')
+                self.assertTrue(response.is_streamed)
+                self.assertEqual(crawl(), pages)
+            finally:
+                app.config['STREAM_TEMPLATES'] = Config.STREAM_TEMPLATES
+        finally:
+            app.config['PROJECTS_PER_PAGE'] = Config.PROJECTS_PER_PAGE
+
+
+class ProfilingCase(ClientCase):
+    def test_request_profiling(self):
+        self.assertEqual(fingerprint("SELECT * FROM user WHERE id IN (1, 2, 3) AND name = 'x'"),
+                         'SELECT * FROM user WHERE id IN (?) AND name = ?')
+        admin = User(username='admin', email=app.config['ADMINS'][0])
+        susan = User(username='susan', email='susan@example.com')
+        admin.set_password('cat')
+        susan.set_password('dog')
+        db.session.add_all([admin, susan])
+        db.session.commit()
+        profiler.reset()
+        self.client.post('/login', data={'username': 'admin', 'password': 'cat'})
+        response = self.client.get('/user/susan')
+        self.assertRegex(response.headers['Server-Timing'],
+                         r'db;dur=[\d.]+;desc="\d+ queries", app;dur=[\d.]+')
+        stats = self.client.get('/admin/stats').get_json()['endpoints']
+        self.assertEqual(stats['main.user']['requests'], 1)
+        self.assertGreater(stats['main.user']['mean_queries'], 0)
+        metrics = self.client.get('/admin/stats?format=prometheus').data.decode()
+        self.assertIn('projapp_request_duration_seconds_count{endpoint="main.user"} 1', metrics)
+
+        self.client.get('/logout')
+        self.client.post('/login', data={'username': 'susan', 'password': 'dog'})
+        self.assertEqual(self.client.get('/admin/stats').status_code, 403)
+
+    def test_profiler_hooks_are_installed_once(self):
+        hooks = lambda: len(list(db.engine.dispatch.after_cursor_execute))
+        installed = hooks()
+        probe = RequestProfiler()
+        for enabled in (True, True, False):
+            probe.init_app(probe_app(PROFILE_REQUESTS=enabled))
+        self.assertEqual(hooks(), installed + 1)
+        for enabled in (True, False):
+            profiler.init_app(probe_app(PROFILE_REQUESTS=enabled))
+        self.assertEqual(hooks(), installed + 1)
+
+    def test_profiling_is_decided_per_request(self):
+        self.assertIn('Server-Timing', self.client.get('/explore').headers)
+        app.config['PROFILE_REQUESTS'] = False
+        try:
+            self.assertNotIn('Server-Timing', self.client.get('/explore').headers)
+        finally:
+            app.config['PROFILE_REQUESTS'] = True
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)